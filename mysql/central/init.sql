@@ -168,6 +168,15 @@ CREATE TABLE replication_log (
     INDEX idx_estado (estado_replicacion)
 ) ENGINE=InnoDB;
 
+-- Punto de control de la captura de cambios del binlog (conjunto GTID aplicado)
+CREATE TABLE IF NOT EXISTS cdc_checkpoint (
+    nombre VARCHAR(64) PRIMARY KEY,
+    gtid_set TEXT NOT NULL,
+    transacciones BIGINT NOT NULL DEFAULT 0,
+    esclavos_atrasados VARCHAR(255) NOT NULL DEFAULT '',
+    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
 
 -- Tabla de auditoría
 CREATE TABLE IF NOT EXISTS transferencia_estudiante (
@@ -13,7 +13,13 @@ if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
 from config import APP_CONFIG, DB_CONFIG, COLORS, get_all_sedes, get_sede_info
-from utils.db_connections import test_all_connections, get_db_connection, execute_distributed_query, test_load_balancer, get_nginx_status
+from utils.db_connections import get_db_connection, execute_distributed_query, get_breaker_status
+from utils.health_monitor import get_health_status
+from utils.metrics_exporter import get_metrics_exporter
+from utils.top_n import TopNQuery, run_top_n
+from utils.query_cache import cached_query
+from utils.redis_widget import show_redis_widget
+from utils.circuit_breaker import CLOSED
 
 st.set_page_config(
     page_title=APP_CONFIG['title'],
@@ -74,10 +80,18 @@ def show_connection_status():
     
     cols = st.columns(len(DB_CONFIG) + 2) 
     
-    with st.spinner("Verificando conexiones..."):
-        status = test_all_connections()
-        lb_status = test_load_balancer()
-        nginx_info = get_nginx_status()
+    # Estado publicado por el monitor de salud: no se abre ninguna conexión aquí
+    health = get_health_status()
+    nodes = health['nodes']
+    breakers = get_breaker_status()
+    
+    status = {sede: nodes.get(sede, {}).get('disponible', False) for sede in DB_CONFIG.keys()}
+    status['redis'] = nodes.get('redis', {}).get('disponible', False)
+    lb_info = nodes.get('load_balancer', {})
+    lb_status = lb_info.get('disponible', False)
+    
+    if health['age'] is not None:
+        st.caption(f"Última verificación hace {health['age']:.0f}s")
     
     for idx, (sede, is_connected) in enumerate(status.items()):
         if sede != 'redis':
@@ -85,15 +99,18 @@ def show_connection_status():
                 sede_info = get_sede_info(sede)
                 if is_connected:
                     st.success(f"✅ {sede_info['name']}")
-                    st.caption("Conectado")
+                    st.caption(f"Conectado · {nodes[sede]['rtt_ms']:.1f} ms")
                 else:
                     st.error(f"❌ {sede_info['name']}")
-                    st.caption("Desconectado")
+                    if breakers[sede]['state'] != CLOSED:
+                        st.caption(f"Circuito {breakers[sede]['state']}")
+                    else:
+                        st.caption("Desconectado")
     
     with cols[-2]:
         if status.get('redis', False):
             st.success("✅ Redis Cache")
-            st.caption("Conectado")
+            st.caption(f"Conectado · {nodes['redis']['rtt_ms']:.1f} ms")
         else:
             st.error("❌ Redis Cache")
             st.caption("Desconectado")
@@ -101,11 +118,20 @@ def show_connection_status():
     with cols[-1]:
         if lb_status:
             st.success("✅ Load Balancer")
-            st.caption(f"Tiempo: {nginx_info.get('response_time', 'N/A')}s")
+            st.caption(f"Tiempo: {lb_info['rtt_ms'] / 1000:.3f}s")
         else:
             st.error("❌ Load Balancer")
             st.caption("Desconectado")
 
+    if health['replication']:
+        rep_cols = st.columns(len(health['replication']))
+        for col, (sede, replicacion) in zip(rep_cols, health['replication'].items()):
+            with col:
+                lag = replicacion.get('lag_seconds')
+                st.metric(f"Retraso de replicación {get_sede_info(sede)['name']}",
+                          f"{lag:.0f}s" if lag is not None else "N/A",
+                          help=f"Registros pendientes en replication_log: {replicacion.get('pendientes', 'N/A')}")
+
     st.markdown("### Salud General del Sistema")
 
     # Calcular score de salud
@@ -196,7 +222,7 @@ def show_system_overview():
                         continue
           
                     try:
-                        result = db.execute_query(query)
+                        result = cached_query(sede, query, ttl=60, db=db, hot=True)
                         if result and len(result) > 0:
                             metrics[sede][metric_name] = result[0]['total']
                         else:
@@ -305,90 +331,70 @@ def show_system_overview():
             fig_pie.update_layout(height=400)
             st.plotly_chart(fig_pie, use_container_width=True)
 
+RECENT_ACTIVITY_QUERIES = {
+    'matriculas': TopNQuery("""
+        SELECT e.nombre as estudiante, c.nombre as curso, 
+            m.fecha_creacion, s.nombre as sede
+        FROM matricula m
+        JOIN estudiante e ON m.id_estudiante = e.id_estudiante
+        JOIN curso c ON m.id_curso = c.id_curso
+        JOIN sede s ON e.id_sede = s.id_sede
+    """, order_by=[('m.fecha_creacion', 'fecha_creacion')], n=10),
+    'pagos': TopNQuery("""
+        SELECT e.nombre as estudiante, p.monto, p.fecha, 
+               s.nombre as sede
+        FROM pago p
+        JOIN estudiante e ON p.id_estudiante = e.id_estudiante
+        JOIN sede s ON e.id_sede = s.id_sede
+    """, order_by=[('p.fecha', 'fecha')], n=10),
+    'notas': TopNQuery("""
+        SELECT e.nombre as estudiante, c.nombre as curso, 
+               n.nota, n.fecha_creacion, s.nombre as sede
+        FROM nota n
+        JOIN matricula m ON n.id_matricula = m.id_matricula
+        JOIN estudiante e ON m.id_estudiante = e.id_estudiante
+        JOIN curso c ON m.id_curso = c.id_curso
+        JOIN sede s ON e.id_sede = s.id_sede
+    """, order_by=[('n.fecha_creacion', 'fecha_creacion')], n=10)
+}
+
 def show_recent_activity():
     st.subheader("Actividad Reciente")
     
+    sedes = ['sancarlos', 'heredia', 'central']
+    recientes, resultados = run_top_n(RECENT_ACTIVITY_QUERIES, sedes)
+    
+    degradadas = sorted({sede for (tipo, sede), resultado in resultados.items() if resultado.get('degraded')})
+    if degradadas:
+        st.warning(f"Sin datos de {', '.join(get_sede_info(sede)['name'] for sede in degradadas)}: sede no disponible")
+    
     tab1, tab2, tab3 = st.tabs(["Últimas Matrículas", "Últimos Pagos", "Notas Recientes"])
     
     with tab1:
-        matriculas = []
-        for sede in ['sancarlos', 'heredia', 'central']:
-            with get_db_connection(sede) as db:
-                if db:
-                    query = """
-                    SELECT e.nombre as estudiante, c.nombre as curso, 
-                        m.fecha_creacion, s.nombre as sede
-                    FROM matricula m
-                    JOIN estudiante e ON m.id_estudiante = e.id_estudiante
-                    JOIN curso c ON m.id_curso = c.id_curso
-                    JOIN sede s ON e.id_sede = s.id_sede
-                    ORDER BY m.fecha_creacion DESC
-                    LIMIT 10
-                    """
-                    result = db.get_dataframe(query)
-                    if result is not None and not result.empty:
-                        matriculas.append(result)
-        
-        if matriculas:
-            df_matriculas = pd.concat(matriculas, ignore_index=True)
-            df_matriculas = df_matriculas.sort_values('fecha_creacion', ascending=False).head(10)
+        if recientes['matriculas']:
+            df_matriculas = pd.DataFrame(recientes['matriculas'])
             st.dataframe(df_matriculas, use_container_width=True, hide_index=True)
         else:
             st.info("No hay matrículas recientes")
     
     with tab2:
-        pagos = []
-        for sede in ['sancarlos', 'heredia', 'central']:
-            with get_db_connection(sede) as db:
-                if db:
-                    query = """
-                    SELECT e.nombre as estudiante, p.monto, p.fecha, 
-                           s.nombre as sede
-                    FROM pago p
-                    JOIN estudiante e ON p.id_estudiante = e.id_estudiante
-                    JOIN sede s ON e.id_sede = s.id_sede
-                    ORDER BY p.fecha DESC
-                    LIMIT 10
-                    """
-                    result = db.get_dataframe(query)
-                    if result is not None and not result.empty:
-                        pagos.append(result)
-        
-        if pagos:
-            df_pagos = pd.concat(pagos, ignore_index=True)
-            df_pagos = df_pagos.sort_values('fecha', ascending=False).head(10)
+        if recientes['pagos']:
+            df_pagos = pd.DataFrame(recientes['pagos'])
             df_pagos['monto'] = df_pagos['monto'].apply(lambda x: f"₡{x:,.2f}")
             st.dataframe(df_pagos, use_container_width=True, hide_index=True)
         else:
             st.info("No hay pagos recientes")
     
     with tab3:
-        notas = []
-        for sede in ['sancarlos', 'heredia', 'central']:
-            with get_db_connection(sede) as db:
-                if db:
-                    query = """
-                    SELECT e.nombre as estudiante, c.nombre as curso, 
-                           n.nota, n.fecha_creacion, s.nombre as sede
-                    FROM nota n
-                    JOIN matricula m ON n.id_matricula = m.id_matricula
-                    JOIN estudiante e ON m.id_estudiante = e.id_estudiante
-                    JOIN curso c ON m.id_curso = c.id_curso
-                    JOIN sede s ON e.id_sede = s.id_sede
-                    ORDER BY n.id_nota DESC
-                    LIMIT 10
-                    """
-                    result = db.get_dataframe(query)
-                    if result is not None and not result.empty:
-                        notas.append(result)
-        
-        if notas:
-            df_notas = pd.concat(notas, ignore_index=True).head(10)
+        if recientes['notas']:
+            df_notas = pd.DataFrame(recientes['notas'])
             st.dataframe(df_notas, use_container_width=True, hide_index=True)
         else:
             st.info("No hay notas recientes")
 
 def main():
+    get_metrics_exporter()
+
     st.markdown("""
     <div class="main-header">
         <h1>Sistema Distribuido Universidad Cenfotec</h1>
@@ -413,6 +419,8 @@ with st.sidebar:
     if st.button("🔄 Actualizar Dashboard", use_container_width=True):
         st.rerun()
     
+    show_redis_widget()
+    
 
 # Ejecutar la aplicación
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""
+Benchmark del formato del cache: JSON vs codec binario (msgpack/zlib/lz4)
+
+No necesita las bases de datos; genera filas parecidas a las de pago y nota.
+Uso:
+    python benchmarks/bench_cache_codec.py --rows 20000
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+import sys
+import os
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.cache_codec import CacheCodec, MSGPACK_AVAILABLE, LZ4_AVAILABLE
+from utils.query_cache import _json_default
+
+
+def generate_rows(count: int):
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            'id_pago': i,
+            'id_estudiante': random.randint(1, 5000),
+            'estudiante': f"Estudiante {random.randint(1, 5000)}",
+            'monto': Decimal(random.randint(10000, 500000)) / 100,
+            'fecha': (start + timedelta(minutes=random.randint(0, 500000))).date(),
+            'fecha_creacion': start + timedelta(seconds=random.randint(0, 30000000)),
+            'sede': random.choice(['Central', 'San Carlos', 'Heredia'])
+        }
+        for i in range(count)
+    ]
+
+
+def measure(fn, rounds: int):
+    samples = []
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    df = pd.DataFrame(rows)
+    df['monto'] = df['monto'].astype(float)
+    df['fecha_creacion'] = pd.to_datetime(df['fecha_creacion'])
+
+    formats = {
+        # Formato anterior: Decimal y fechas se pierden al pasar a float/str
+        'json': (lambda value: json.dumps(value if isinstance(value, list) else value.to_dict('records'),
+                                          default=_json_default).encode('utf-8'),
+                 lambda data: json.loads(data)),
+        'json+zlib': CacheCodec('json', 'zlib'),
+        'msgpack': CacheCodec('msgpack', 'none'),
+        'msgpack+zlib': CacheCodec('msgpack', 'zlib'),
+        'msgpack+lz4': CacheCodec('msgpack', 'lz4')
+    }
+    if not MSGPACK_AVAILABLE:
+        print("msgpack no está instalado: los formatos msgpack usan JSON")
+    if not LZ4_AVAILABLE:
+        print("lz4 no está instalado: msgpack+lz4 usa zlib")
+
+    print(f"{'datos':<12}{'formato':<16}{'encode ms':>12}{'decode ms':>12}{'bytes':>12}")
+    for label, value in (('filas', rows), ('dataframe', df)):
+        for name, codec in formats.items():
+            encode, decode = codec if isinstance(codec, tuple) else (codec.encode, codec.decode)
+            encode_ms, data = measure(lambda: encode(value), args.rounds)
+            decode_ms, _ = measure(lambda: decode(data), args.rounds)
+            print(f"{label:<12}{name:<16}{encode_ms:>12.1f}{decode_ms:>12.1f}{len(data):>12,}")
+
+    codec = CacheCodec()
+    assert codec.decode(codec.encode(rows[:100])) == rows[:100], "Las filas no se recuperan iguales"
+    pd.testing.assert_frame_equal(codec.decode(codec.encode(df)), df)
+    print("Ida y vuelta correcta: Decimal, date y datetime se conservan")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark de consultas distribuidas: secuencial vs hilos vs asyncio
+
+Uso (dentro del contenedor de Streamlit):
+    python benchmarks/bench_distributed_query.py --rounds 20
+"""
+import argparse
+import statistics
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.db_connections import execute_distributed_query, execute_distributed_query_parallel
+from utils.async_db import execute_distributed_query_async, AIOMYSQL_AVAILABLE
+
+QUERIES = {
+    'conteo_estudiantes': "SELECT COUNT(*) as total FROM estudiante",
+    'pagos_anio': """
+        SELECT COUNT(*) as total_pagos, COALESCE(SUM(monto), 0) as monto_total
+        FROM pago
+        WHERE YEAR(fecha) = YEAR(CURDATE())
+    """,
+    'matriculas_recientes': """
+        SELECT e.nombre as estudiante, c.nombre as curso, m.fecha_creacion
+        FROM matricula m
+        JOIN estudiante e ON m.id_estudiante = e.id_estudiante
+        JOIN curso c ON m.id_curso = c.id_curso
+        ORDER BY m.fecha_creacion DESC
+        LIMIT 10
+    """
+}
+
+
+def measure(fn, rounds: int):
+    fn()  # calentamiento: crea pools y conexiones
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max': samples[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    modes = {
+        'secuencial': lambda q: execute_distributed_query(q, parallel=False),
+        'hilos': lambda q: execute_distributed_query_parallel(q),
+        'asyncio': lambda q: execute_distributed_query_async(q)
+    }
+    if not AIOMYSQL_AVAILABLE:
+        print("aiomysql no está instalado: el modo asyncio usa el ejecutor con hilos")
+
+    print(f"{'consulta':<24}{'modo':<12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, query in QUERIES.items():
+        for mode, fn in modes.items():
+            result = measure(lambda: fn(query), args.rounds)
+            print(f"{name:<24}{mode:<12}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['max']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
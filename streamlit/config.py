@@ -11,7 +11,8 @@ DB_CONFIG = {
         'database': 'cenfotec_central',
         'name': 'Sede Central',
         'description': 'Base de datos administrativa - Planillas y Pagarés',
-        'color': '#1f77b4'
+        'color': '#1f77b4',
+        'max_connections': 100
     },
     'sancarlos': {
         'host': '172.20.0.11',
@@ -21,7 +22,8 @@ DB_CONFIG = {
         'database': 'cenfotec_sancarlos',
         'name': 'Sede San Carlos',
         'description': 'Base de datos académica - Estudiantes San Carlos',
-        'color': '#ff7f0e' 
+        'color': '#ff7f0e',
+        'max_connections': 100
     },
     'heredia': {
         'host': '172.20.0.12',
@@ -31,7 +33,8 @@ DB_CONFIG = {
         'database': 'cenfotec_heredia',
         'name': 'Sede Heredia',
         'description': 'Base de datos académica - Estudiantes Heredia',
-        'color': '#2ca02c'
+        'color': '#2ca02c',
+        'max_connections': 100
     }
 }
 
@@ -48,7 +51,8 @@ REPLICATION_USER_CONFIG = {
         'database': 'cenfotec_central',
         'name': 'Central',
         'description': 'Conexión de replicación para verificación de datos maestros',
-        'color': '#17a2b8' 
+        'color': '#17a2b8',
+        'max_connections': 100
     }
 }
 
@@ -96,6 +100,7 @@ CHART_CONFIG = {
 MESSAGES = {
     'connection_success': '✅ Conexión exitosa a {sede}',
     'connection_error': '❌ Error al conectar con {sede}: {error}',
+    'circuit_open': '⚠️ {sede} no disponible: circuito abierto, se reintentará en segundo plano',
     'query_success': '✅ Consulta ejecutada exitosamente',
     'query_error': '❌ Error en la consulta: {error}',
     'replication_success': '✅ Replicación completada',
@@ -113,6 +118,177 @@ TIMEOUT_CONFIG = {
     'retry_delay': 1
 }
 
+# Pool de conexiones por sede: el tamaño máximo es una fracción del
+# max_connections de cada nodo (my.cnf) para dejar margen a otros clientes
+POOL_CONFIG = {
+    'max_connections_share': 0.2,
+    'replication_max_connections_share': 0.05,
+    'async_max_connections_share': 0.1,
+    'checkout_timeout': 10,
+    'validation_interval': 5,
+    'max_idle_time': 300
+}
+
+# Consultas distribuidas en paralelo: cada sede tiene su propio plazo
+# (por defecto TIMEOUT_CONFIG['query_timeout']) y se devuelven resultados parciales
+FANOUT_CONFIG = {
+    'max_workers': 8,
+    'sede_deadlines': {}
+}
+
+# Circuit breaker por sede: tras failure_threshold fallos seguidos de conexión
+# las llamadas a esa sede fallan de inmediato y un hilo la prueba cada probe_interval
+CIRCUIT_BREAKER_CONFIG = {
+    'failure_threshold': 3,
+    'probe_interval': 5,
+    'probe_timeout': 2
+}
+
+# Monitor de salud: un hilo por proceso sondea los nodos cada interval segundos
+# y publica RTT, disponibilidad y retraso de replicación en Redis
+HEALTH_CONFIG = {
+    'interval': 10,
+    'probe_timeout': 2,
+    'key_prefix': 'health',
+    'lb_url': 'http://172.20.0.14'
+}
+
+# Fragmentación horizontal: columnas que identifican el fragmento (el id_sede
+# de cada nodo en SEDE_METADATA_REAL) y tablas derivadas, que siguen al
+# fragmento de su tabla padre por la clave foránea
+FRAGMENT_CONFIG = {
+    'fragment_columns': ['id_sede', 'sede_actual'],
+    'derived_tables': {
+        'matricula': 'estudiante',
+        'nota': 'matricula',
+        'asistencia': 'matricula',
+        'pago': 'estudiante',
+        'curso': 'carrera'
+    }
+}
+
+# Agregación distribuida: COUNT DISTINCT se aproxima con HyperLogLog de
+# 2^hll_precision registros por grupo (error típico 1.04 / sqrt(2^p) ≈ 3%)
+AGGREGATION_CONFIG = {
+    'hll_precision': 10
+}
+
+# Join entre sedes: las claves del lado pequeño viajan en lotes de batch_size
+# como WHERE ... IN (...) y el join se aborta si llegan más de max_probe_rows filas
+JOIN_CONFIG = {
+    'batch_size': 500,
+    'max_probe_rows': 200000
+}
+
+# Directorio global de estudiantes en Redis: email -> (sede, id_estudiante, estado).
+# Un hash por email bajo key_prefix; reservation_ms es el lease que evita que
+# dos sesiones den de alta el mismo email a la vez
+DIRECTORY_CONFIG = {
+    'key_prefix': 'directorio:estudiante',
+    'reservation_ms': 10000,
+    'backfill_batch': 1000
+}
+
+# Ids globales entre sedes: cada proceso reserva bloques de block_size ids con
+# INCRBY en Redis. Las columnas son INT, así que max_id es el límite de INT con signo.
+# Si el contador desaparece de Redis se siembra con MAX(id) + reseed_margin
+ID_ALLOCATOR_CONFIG = {
+    'key_prefix': 'ids',
+    'block_size': 100,
+    'max_id': 2147483647,
+    'reseed_margin': 10000,
+    'entities': {
+        'estudiante': 'id_estudiante',
+        'matricula': 'id_matricula',
+        'pago': 'id_pago'
+    }
+}
+
+# Replicación asíncrona (outbox): las escrituras de datos maestros en Central
+# agregan filas 'pendiente' a replication_log en la misma transacción y
+# replication_worker.py las aplica en cada esclavo. queue_batches es cuántos
+# lotes puede acumular un esclavo lento antes de frenar la lectura del log
+OUTBOX_CONFIG = {
+    'enabled': True,
+    'batch_size': 200,
+    'queue_batches': 4,
+    'poll_interval': 0.5,
+    'sweep_interval': 30,
+    'retry_initial': 0.5,
+    'retry_max': 30
+}
+
+# Captura de cambios (CDC) desde el binlog de Central (ROW + GTID en my.cnf):
+# replication_worker.py aplica en los esclavos toda escritura en las tablas
+# maestras, no solo las hechas desde la interfaz; mientras está activo es el
+# único camino hacia los esclavos y no se escribe el outbox. El punto de control
+# es el conjunto GTID aplicado, en checkpoint_table de Central; server_id
+# identifica al lector ante MySQL y no puede repetir el de ningún nodo. Un
+# esclavo que no responde tras max_retries reintentos deja de frenar a los
+# demás y se pone al día con el verificador de consistencia al volver. Con
+# fixture_path se leen los eventos de un archivo JSONL en vez del servidor
+CDC_CONFIG = {
+    'enabled': True,
+    'server_id': 101,
+    'checkpoint_table': 'cdc_checkpoint',
+    'checkpoint_interval': 60,
+    'batch_size': 500,
+    'flush_interval': 0.5,
+    'queue_transactions': 1000,
+    'retry_initial': 0.5,
+    'retry_max': 30,
+    'max_retries': 5,
+    'fixture_path': None
+}
+
+# Verificación de consistencia por tramos de clave primaria: se compara un
+# checksum (BIT_XOR de CRC32) por tramo de chunk_size claves y solo los tramos
+# distintos se dividen en fanout subtramos, hasta leaf_size claves, donde se
+# comparan fila por fila
+CONSISTENCY_CONFIG = {
+    'chunk_size': 1000,
+    'fanout': 16,
+    'leaf_size': 64
+}
+
+# Métricas de latencia por sede y forma de consulta (página Rendimiento).
+# Se exportan en formato Prometheus en export_port/metrics y, si export_textfile
+# tiene una ruta, también en ese archivo cada export_interval segundos
+METRICS_CONFIG = {
+    'enabled': True,
+    'max_fingerprints': 1000,
+    'export_host': '0.0.0.0',
+    'export_port': 9108,
+    'export_textfile': None,
+    'export_interval': 15,
+    'histogram_buckets_ms': [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+}
+
+# Cache de resultados de consultas en Redis. Las entradas se invalidan
+# por tabla cuando execute_update escribe en ella
+CACHE_CONFIG = {
+    'enabled': True,
+    'key_prefix': 'qcache',
+    'default_ttl': 300,
+    # Nivel local (LRU en memoria del proceso) delante de Redis
+    'local_max_bytes': 64 * 1024 * 1024,
+    'local_revalidate_interval': 2,
+    # Formato de las entradas: msgpack (o json si no está instalado) y
+    # compresión zlib/lz4 a partir de compress_threshold bytes
+    'serializer': 'msgpack',
+    'compression': 'zlib',
+    'compress_threshold': 1024,
+    # Vencida la entrada (TTL suave) se sigue sirviendo stale_ttl segundos más
+    # mientras un solo proceso la refresca con un bloqueo SET NX de refresh_lease_ms
+    'stale_ttl': 120,
+    'refresh_lease_ms': 10000,
+    'lock_wait': 2,
+    # Refresco anticipado probabilístico (XFetch); 0 lo desactiva
+    'early_refresh_beta': 1.0,
+    # Las claves calientes dejan de refrescarse solas tras este tiempo sin lecturas
+    'hot_key_idle': 600
+}
+
 OPERATION_USERS = {
     'read_master_data': 'replication', 
     'write_master_data': 'admin', 
@@ -186,5 +362,8 @@ REPLICATION_CONFIG = {
     'replication_user': 'replicacion',
     'replication_log_table': 'replication_log',
     'verification_interval': 30,
-    'max_replication_lag': 5 
+    'max_replication_lag': 5,
+    # Plazo en segundos para aplicar un cambio en cada esclavo (en paralelo)
+    'slave_timeout': 5,
+    'slave_timeouts': {}
 }
\ No newline at end of file
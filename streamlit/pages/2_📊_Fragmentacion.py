@@ -10,6 +10,10 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import DB_CONFIG, COLORS, get_sede_info
 from utils.db_connections import get_db_connection, execute_distributed_query
+from utils.query_cache import cached_dataframe
+from utils.fragment_router import route_query
+from utils.distributed_agg import run_distributed_aggregate
+from utils.queries_fragmentacion import CONSULTAS_COMPARACION_SEDES_REAL
 
 st.set_page_config(
     page_title="Fragmentación - Sistema Cenfotec",
@@ -44,6 +48,35 @@ def limpiar_resultados(categoria):
     elif categoria == 'derivada':
         st.session_state.fragmentacion_derivada = {}
 
+def leer_notas_por_lotes(db, query, muestra=200, batch_size=5000):
+    """
+    Lee todas las notas de la sede por lotes (cursor sin buffer): conserva solo
+    las primeras `muestra` filas para mostrarlas y acumula el resumen por curso
+    lote a lote, así la memoria no depende del tamaño de la tabla.
+    """
+    db.last_error = None
+    primeras = []
+    en_muestra = 0
+    por_curso = None
+    for lote in db.iter_dataframes(query, batch_size=batch_size):
+        if en_muestra < muestra:
+            primeras.append(lote.head(muestra - en_muestra))
+            en_muestra += len(primeras[-1])
+        notas = lote['nota'].astype(float)
+        parcial = pd.DataFrame({'curso': lote['curso'], 'nota': notas, 'aprobada': notas >= 70}).groupby('curso').agg(
+            notas=('nota', 'size'), suma=('nota', 'sum'), aprobadas=('aprobada', 'sum'))
+        por_curso = parcial if por_curso is None else por_curso.add(parcial, fill_value=0)
+    if db.last_error:
+        return None, None
+    
+    df_muestra = pd.concat(primeras, ignore_index=True) if primeras else pd.DataFrame()
+    if por_curso is None:
+        return df_muestra, pd.DataFrame()
+    por_curso = por_curso.reset_index()
+    por_curso['promedio'] = (por_curso['suma'] / por_curso['notas']).round(2)
+    por_curso[['notas', 'aprobadas']] = por_curso[['notas', 'aprobadas']].astype(int)
+    return df_muestra, por_curso.drop(columns='suma').sort_values('notas', ascending=False)
+
 st.title("Fragmentación de Bases de Datos Distribuidas")
 
 tab1, tab2, tab3, tab4 = st.tabs([
@@ -174,26 +207,13 @@ with tab2:
                         GROUP BY e.id_estudiante, e.nombre, s.nombre, e.sede_actual
                         ORDER BY e.nombre;
                     """
-                    with get_db_connection('central') as db:
-                        if db:
-                            df_central = db.get_dataframe(query_fragmento)
-                            if df_central is not None and not df_central.empty:
-                                estudiantes_distribuidos.append(df_central)
-                                sedes_consultadas.append("Central")
-
-                    with get_db_connection('sancarlos') as db:
-                        if db:
-                            df_sc = db.get_dataframe(query_fragmento)
-                            if df_sc is not None and not df_sc.empty:
-                                estudiantes_distribuidos.append(df_sc)
-                                sedes_consultadas.append("San Carlos")
-                    
-                    with get_db_connection('heredia') as db:
-                        if db:
-                            df_hd = db.get_dataframe(query_fragmento)
-                            if df_hd is not None and not df_hd.empty:
-                                estudiantes_distribuidos.append(df_hd)
-                                sedes_consultadas.append("Heredia")
+                    for sede in route_query(['estudiante', 'matricula']):
+                        with get_db_connection(sede) as db:
+                            if db:
+                                df_fragmento = db.get_dataframe(query_fragmento)
+                                if df_fragmento is not None and not df_fragmento.empty:
+                                    estudiantes_distribuidos.append(df_fragmento)
+                                    sedes_consultadas.append(get_sede_info(sede)['name'])
                     
                     if estudiantes_distribuidos:
                         df_todos = pd.concat(estudiantes_distribuidos, ignore_index=True)
@@ -469,6 +489,32 @@ with tab2:
                         st.dataframe(curso_data['data'], use_container_width=True, hide_index=True)
                     else:
                         st.warning(f"No hay cursos en {nombre}")
+    
+    st.markdown("### Consolidación Global entre Sedes")
+    st.caption("Cada sede devuelve estados parciales (SUM, COUNT, registros HyperLogLog) y el total se combina aquí: "
+               "los promedios y porcentajes globales son exactos, los conteos distintos aproximados.")
+    
+    comparacion_key = st.selectbox(
+        "Comparación:",
+        list(CONSULTAS_COMPARACION_SEDES_REAL.keys()),
+        format_func=lambda key: CONSULTAS_COMPARACION_SEDES_REAL[key]['nombre'],
+        key="comparacion_global"
+    )
+    
+    if st.button("Calcular Consolidación Global", key="consolidacion_global"):
+        with st.spinner('Combinando estados parciales de las sedes...'):
+            try:
+                resultado = run_distributed_aggregate(CONSULTAS_COMPARACION_SEDES_REAL[comparacion_key]['agregado'])
+                
+                if resultado['fallidas']:
+                    st.warning(f"Resultado parcial, sin datos de: "
+                               f"{', '.join(get_sede_info(sede)['name'] for sede in resultado['fallidas'])}")
+                
+                df_global = resultado['data'].assign(sede='Total')
+                df_comparacion = pd.concat([resultado['por_sede'], df_global], ignore_index=True)
+                st.dataframe(df_comparacion.round(2), use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"❌ Error en la consolidación global: {str(e)}")
 
 with tab3:
     st.header("Fragmentación Vertical - Separación Funcional")
@@ -507,16 +553,16 @@ with tab3:
                 
                 with get_db_connection('central') as db:
                     if db:
-                        df_planilla = db.get_dataframe(planilla_query)
+                        df_planilla = cached_dataframe('central', planilla_query, ttl=60, db=db)
                         
-                        df_pagare = db.get_dataframe(pagare_query)
+                        df_pagare = cached_dataframe('central', pagare_query, ttl=60, db=db)
                         
                         resumen_admin = """
                             SELECT 'Planillas' as tabla, COUNT(*) as registros FROM planilla
                             UNION ALL
                             SELECT 'Pagarés' as tabla, COUNT(*) as registros FROM pagare;
                         """
-                        df_resumen = db.get_dataframe(resumen_admin)
+                        df_resumen = cached_dataframe('central', resumen_admin, ttl=60, db=db)
                         
                         # Guardar en session_state
                         st.session_state.datos_administrativos['central'] = {
@@ -570,12 +616,13 @@ with tab3:
                 
                 with get_db_connection(sede_key) as db:
                     if db:
-                        df_notas = db.get_dataframe(notas_query)
-                        df_asistencia = db.get_dataframe(asistencia_query)
-                        df_resumen_acad = db.get_dataframe(resumen_acad)
+                        df_notas, df_notas_curso = leer_notas_por_lotes(db, notas_query)
+                        df_asistencia = cached_dataframe(sede_key, asistencia_query, ttl=60, db=db)
+                        df_resumen_acad = cached_dataframe(sede_key, resumen_acad, ttl=60, db=db)
                         
                         st.session_state.datos_academicos[sede_key] = {
                             'notas': df_notas,
+                            'notas_por_curso': df_notas_curso,
                             'asistencia': df_asistencia,
                             'resumen': df_resumen_acad,
                             'sede_nombre': sede_academica,
@@ -608,10 +655,17 @@ with tab3:
             st.markdown(f"### Datos Académicos - {acad_data['sede_nombre']}")
             with st.expander(f"{icono} Datos Académicos - {acad_data['sede_nombre']} - Consultado a las {acad_data['timestamp'].strftime('%H:%M:%S')}", expanded=True):
                 
+                notas_por_curso = acad_data.get('notas_por_curso')
                 if acad_data['notas'] is not None and not acad_data['notas'].empty:
-                    st.markdown(f"**Notas en {acad_data['sede_nombre']}:**")
+                    total_notas = int(notas_por_curso['notas'].sum()) if notas_por_curso is not None else len(acad_data['notas'])
+                    st.markdown(f"**Notas en {acad_data['sede_nombre']}** "
+                                f"(las {len(acad_data['notas'])} más recientes de {total_notas}):")
                     st.dataframe(acad_data['notas'], use_container_width=True, hide_index=True)
                 
+                if notas_por_curso is not None and not notas_por_curso.empty:
+                    st.markdown("**Notas por curso:**")
+                    st.dataframe(notas_por_curso, use_container_width=True, hide_index=True)
+                
                 if acad_data['asistencia'] is not None and not acad_data['asistencia'].empty:
                     st.markdown(f"**Resumen Asistencia:**")
                     st.dataframe(acad_data['asistencia'], use_container_width=True, hide_index=True)
@@ -635,15 +689,11 @@ with tab4:
         st.info(f"Demostrando fragmentación derivada en **{sede_derivada}**")
     
     if st.button("Demostrar Fragmentación Derivada", type="primary", key="demo_derivada"):
-        sede_mapeo = {
-            "Central": {"key": "central", "id": 1},
-            "San Carlos": {"key": "sancarlos", "id": 2},
-            "Heredia": {"key": "heredia", "id": 3}
-        }
+        sede_ids = {"Central": 1, "San Carlos": 2, "Heredia": 3}
 
-        sede_info = sede_mapeo.get(sede_derivada, {"key": "desconocido", "id": 0})
-        sede_key = sede_info["key"]
-        sede_id = sede_info["id"]
+        sede_id = sede_ids.get(sede_derivada, 0)
+        # Las tablas derivadas siguen al fragmento del estudiante: un solo nodo
+        sede_key = route_query(['estudiante', 'matricula', 'nota', 'asistencia'], {'sede_actual': sede_id})[0]
 
         with st.spinner(f'Analizando fragmentación derivada en {sede_derivada}...'):
             try:
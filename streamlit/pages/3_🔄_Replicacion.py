@@ -8,9 +8,16 @@ import json
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DB_CONFIG, COLORS, get_sede_info, MESSAGES
+from config import DB_CONFIG, COLORS, get_sede_info, MESSAGES, OUTBOX_CONFIG
 from utils.db_connections import get_db_connection, get_redis_connection, execute_real_transfer, log_transfer_audit
-from utils.replication import execute_master_slave_replication, execute_profesor_replication, MasterSlaveReplication
+from utils.fragment_router import route_query
+from utils.student_directory import get_student_directory, find_student
+from utils.consistency import verify_replication_consistency, repair_replication
+from utils.replication import (execute_master_slave_replication, execute_profesor_replication,
+                               execute_batch_replication, MasterSlaveReplication, MASTER_COLUMNS, CDC_ACTIVE)
+
+# Con el outbox o la captura del binlog las sedes se actualizan en segundo plano
+replicacion_asincrona = OUTBOX_CONFIG['enabled'] or CDC_ACTIVE
 
 st.set_page_config(
     page_title="Replicación Master-Slave - Sistema Cenfotec",
@@ -380,12 +387,19 @@ with tab1:
             
             if success:
                 #st.balloons()
-                if tipo_replicacion == "Profesor":
+                if replicacion_asincrona:
+                    st.success(f"¡{tipo_replicacion} guardado en Central y enviado a las sedes en segundo plano!")
+                elif tipo_replicacion == "Profesor":
                     st.success(f"¡Profesor replicado exitosamente y salario registrado en planilla!")
                 else:
                     st.success(f"¡{tipo_replicacion} replicado exitosamente!")
                 
-                if tipo_replicacion == "Carrera":
+                if tipo_replicacion == "Carrera" and replicacion_asincrona:
+                    st.info(
+                        f"Se insertó la carrera '{nombre_item}' en la base de datos Central; "
+                        f"el worker de replicación la aplica en San Carlos y Heredia en segundo plano."
+                    )
+                elif tipo_replicacion == "Carrera":
                     st.info(
                         f"Se insertó la carrera '{nombre_item}' en la base de datos Central "
                         f"y se replicó automáticamente a las sedes (San Carlos Y Heredia). "
@@ -399,6 +413,91 @@ with tab1:
         else:
             st.error(mensaje_error)
 
+    st.markdown("---")
+    
+    st.subheader("Carga Masiva")
+    st.markdown("""
+    Replica un archivo CSV completo (por ejemplo, los profesores o carreras de un nuevo semestre)
+    como **un solo lote**: una transacción en Central, un upsert multi-fila por sede y una
+    verificación por checksum de todo el lote.
+    """)
+    
+    col_tabla, col_archivo = st.columns([1, 2])
+    with col_tabla:
+        tabla_lote = st.selectbox("Tabla:", ["carrera", "profesor"], key="tabla_lote")
+        st.caption(f"Columnas: {', '.join(MASTER_COLUMNS[tabla_lote][1:])} "
+                   f"({MASTER_COLUMNS[tabla_lote][0]} opcional)")
+    with col_archivo:
+        archivo_lote = st.file_uploader("Archivo CSV:", type=["csv"], key="archivo_lote")
+    
+    if archivo_lote is not None:
+        filas_lote = pd.read_csv(archivo_lote)
+        st.dataframe(filas_lote.head(20), use_container_width=True, hide_index=True)
+        st.caption(f"{len(filas_lote)} filas")
+        
+        if st.button(f"Replicar Lote de {tabla_lote.capitalize()}", type="primary", key="replicar_lote"):
+            progress_lote = st.progress(0)
+            status_lote = st.container()
+            # Tipos nativos: el conector no acepta numpy.int64
+            registros = [{columna: (valor.item() if hasattr(valor, 'item') else valor)
+                          for columna, valor in fila.items()}
+                         for fila in filas_lote.to_dict('records')]
+            resultado = execute_batch_replication(tabla_lote, registros, progress_lote, status_lote)
+            if resultado.get('encolado'):
+                st.success(f"{len(resultado['ids'])} filas guardadas en Central y enviadas a las sedes en segundo plano "
+                           f"(IDs {min(resultado['ids'])}-{max(resultado['ids'])})")
+            elif resultado['exito']:
+                st.success(f"{len(resultado['ids'])} filas replicadas en {resultado['segundos']:.2f}s "
+                           f"(IDs {min(resultado['ids'])}-{max(resultado['ids'])})")
+            else:
+                st.error(f"El lote no se replicó completamente: {resultado.get('error', 'ver estado')}")
+    
+    st.markdown("---")
+    
+    st.subheader("Verificación de Consistencia")
+    st.markdown("""
+    Compara Central con cada sede por **checksums de tramos de clave primaria** calculados en cada
+    servidor. Solo los tramos distintos se revisan con más detalle, así que detectar diferencias en
+    tablas completas cuesta unas pocas consultas. La reparación copia desde Central únicamente las
+    filas distintas y borra las que sobran en la sede.
+    """)
+    
+    if st.button("Verificar Consistencia", key="verificar_consistencia"):
+        with st.spinner("Comparando checksums en todas las sedes..."):
+            st.session_state['reporte_consistencia'] = verify_replication_consistency()
+    
+    reporte = st.session_state.get('reporte_consistencia')
+    if reporte:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Estado", "Consistente" if reporte['consistente'] else "Con diferencias")
+        with col2:
+            st.metric("Consultas", reporte['consultas'])
+        with col3:
+            st.metric("Tiempo", f"{reporte['segundos']:.2f}s")
+        
+        st.dataframe(pd.DataFrame([{
+            'Tabla': resultado['tabla'],
+            'Sede': DB_CONFIG[resultado['sede']]['name'],
+            'Tramos': resultado['tramos'],
+            'Tramos distintos': resultado['tramos_distintos'],
+            'Filas a copiar': len(resultado['upsert']),
+            'Filas a borrar': len(resultado['delete']),
+            'Error': resultado['error'] or ''
+        } for resultado in reporte['resultados']]), use_container_width=True, hide_index=True)
+        
+        if not reporte['consistente'] and st.button("Aplicar Reparación", type="primary", key="reparar_consistencia"):
+            with st.spinner("Aplicando reparación en las sedes..."):
+                reparaciones = repair_replication(reporte)
+            del st.session_state['reporte_consistencia']
+            for reparacion in reparaciones:
+                sede_nombre = DB_CONFIG[reparacion['sede']]['name']
+                if reparacion['fallidas']:
+                    st.warning(f"{reparacion['tabla']} en {sede_nombre}: {reparacion['reparadas']} cambios aplicados, "
+                               f"{reparacion['fallidas']} fallidos {reparacion['error'] or ''}")
+                else:
+                    st.success(f"{reparacion['tabla']} en {sede_nombre}: {reparacion['reparadas']} cambios aplicados")
+    
     if st.button("Ver Logs", type="secondary"):
             with st.expander("Logs de Replicaciones", expanded=True):
                 mostrar_logs_replicacion()
@@ -410,7 +509,9 @@ with tab2:
 
     tab_central, tab_sc, tab_hd = st.tabs(["Central", "San Carlos", "Heredia"])
 
-    def get_students_by_sede(sede_key, sede_id):
+    def get_students_by_sede(sede_id):
+        # La fila activa del estudiante vive en la sede de sede_actual
+        sede_key = route_query(['estudiante', 'matricula', 'nota'], {'sede_actual': sede_id})[0]
         with get_db_connection(sede_key) as db:
             if db:
                 query = f"""
@@ -430,7 +531,7 @@ with tab2:
     
     with tab_central:
         st.markdown("**Estudiantes en Central**")
-        estudiantes_central = get_students_by_sede('central', 1)
+        estudiantes_central = get_students_by_sede(1)
         if not estudiantes_central.empty:
             st.dataframe(estudiantes_central, use_container_width=True, hide_index=True)
             st.info(f"Total estudiantes: {len(estudiantes_central)}")
@@ -439,7 +540,7 @@ with tab2:
 
     with tab_sc:
         st.markdown("**Estudiantes en San Carlos**")
-        estudiantes_sc = get_students_by_sede('sancarlos', 2)
+        estudiantes_sc = get_students_by_sede(2)
         if not estudiantes_sc.empty:
             st.dataframe(estudiantes_sc, use_container_width=True, hide_index=True)
             st.info(f"Total estudiantes: {len(estudiantes_sc)}")
@@ -448,7 +549,7 @@ with tab2:
 
     with tab_hd:
         st.markdown("**Estudiantes en Heredia**")
-        estudiantes_hd = get_students_by_sede('heredia', 3)
+        estudiantes_hd = get_students_by_sede(3)
         if not estudiantes_hd.empty:
             st.dataframe(estudiantes_hd, use_container_width=True, hide_index=True)
             st.info(f"Total estudiantes: {len(estudiantes_hd)}")
@@ -459,6 +560,37 @@ with tab2:
         st.rerun()
 
     st.divider()
+
+    st.markdown("""
+    ### Directorio Global de Estudiantes
+
+    Índice en Redis **email → sede, id y estado**: si el email está en el directorio no hace
+    falta consultar las tres sedes; si no está, siempre se confirma en las bases de datos.
+    Se mantiene en cada alta y transferencia; la reconstrucción lo vuelve a generar desde todas las sedes.
+    """)
+
+    directorio = get_student_directory()
+    estado_directorio = directorio.status()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Entradas", estado_directorio['entradas'])
+    with col2:
+        st.metric("Estado", "Completo" if estado_directorio['completo'] else "Parcial")
+    with col3:
+        st.metric("Reconstruido", estado_directorio['reconstruido'] or "Nunca")
+
+    if not estado_directorio['disponible']:
+        st.warning("Redis no disponible: las verificaciones consultan todas las sedes")
+    elif st.button("Reconstruir Directorio", key="rebuild_directory"):
+        with st.spinner("Leyendo estudiantes de todas las sedes..."):
+            resultado = directorio.backfill()
+        if resultado['completo']:
+            st.success(f"Directorio reconstruido: {resultado['entradas']} emails, "
+                       f"{resultado['eliminadas']} entradas obsoletas eliminadas ({resultado['segundos']:.2f}s)")
+        else:
+            st.warning(f"Directorio parcial: sin datos de {', '.join(resultado['fallidas']) or 'Redis'}")
+
+    st.divider()
     
     st.markdown("""
     ### Transferencia de Estudiantes
@@ -550,6 +682,10 @@ with tab2:
                 st.markdown("### Estado de la Transferencia")
                 status_container = st.container()
                 
+                # Con ids globales el id se conserva: el retorno se reconoce por la copia en el destino
+                registro = find_student(estudiante_data['email'])
+                es_retorno = bool(registro) and sede_destino.lower().replace(' ', '') in registro['ids']
+
                 success, new_student_id = execute_real_transfer(
                 estudiante_data, sede_origen, sede_destino, 
                 progress_bar, status_container
@@ -563,13 +699,13 @@ with tab2:
                 
                 audit_details = pd.DataFrame([{
                     'ID Original': estudiante_data['id_estudiante'],
-                    'ID Destino': new_student_id if new_student_id != estudiante_data['id_estudiante'] else 'Mismo (retorno)',
+                    'ID Destino': new_student_id if new_student_id != estudiante_data['id_estudiante'] else 'Mismo',
                     'Estudiante': estudiante_data['nombre'],
                     'Email': estudiante_data['email'],
                     'Desde': sede_origen,
                     'Hacia': sede_destino,
                     'Timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'Tipo': 'Retorno' if new_student_id == estudiante_data['id_estudiante'] else 'Nueva transferencia',
+                    'Tipo': 'Retorno' if es_retorno else 'Nueva transferencia',
                     'Estado': 'Completada'
                 }])
                 st.table(audit_details)
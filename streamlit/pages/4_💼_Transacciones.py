@@ -11,6 +11,24 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import DB_CONFIG, COLORS, get_sede_info
 from utils.db_connections import get_db_connection, execute_distributed_query, get_redis_connection
+from utils.async_db import run_distributed_queries
+from utils.distributed_agg import run_distributed_aggregate
+from utils.distributed_join import distributed_hash_join
+from utils.student_directory import get_student_directory
+from utils.id_allocator import allocate_id, allocate_ids
+
+PAGOS_ANIO_ACTUAL = {
+    'tables': ['pago'],
+    'from': """
+        FROM pago
+        WHERE YEAR(fecha) = YEAR(CURDATE())
+    """,
+    'aggregates': {
+        'total_pagos': ('count', '*'),
+        'monto_total': ('sum', 'monto'),
+        'promedio_pago': ('avg', 'monto')
+    }
+}
 
 st.set_page_config(
     page_title="Transacciones - Sistema Cenfotec",
@@ -280,12 +298,16 @@ with tab2:
             
             with get_db_connection(estudiante_info['sede']) as db:
                 if db:
-                    insert_query = "INSERT INTO pago (id_estudiante, monto, fecha) VALUES (%s, %s, %s)"
+                    id_pago = allocate_id('pago')
+                    if id_pago is None:
+                        step3.error("❌ No se pudo asignar un id global al pago (Redis no disponible)")
+                        st.stop()
+                    insert_query = "INSERT INTO pago (id_pago, id_estudiante, monto, fecha) VALUES (%s, %s, %s, %s)"
                     affected_rows = db.execute_update(insert_query, 
-                        (estudiante_info['id'], monto, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                        (id_pago, estudiante_info['id'], monto, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
                     
                     if affected_rows and affected_rows > 0:
-                        pago_id = f"PAY-{random.randint(1000, 9999)}"
+                        pago_id = f"PAY-{id_pago}"
                         step3.success(f"Paso 3/5: Pago registrado - ID: {pago_id}")
                     else:
                         step3.error("❌ Error al registrar el pago")
@@ -300,22 +322,27 @@ with tab2:
                 
                 with get_db_connection('central') as db:
                     if db:
-                        pagare_query = "SELECT id_pagare, monto FROM pagare WHERE id_estudiante = %s AND monto > 0"
-                        pagares = db.execute_query(pagare_query, (estudiante_info['id'],))
+                        pagare_query = "SELECT id_pagare, monto FROM pagare WHERE id_estudiante = %s AND monto > 0 LIMIT 1 FOR UPDATE"
+                        update_query = "UPDATE pagare SET monto = %s WHERE id_pagare = %s"
                         
-                        if pagares and len(pagares) > 0:
-                            pagare = pagares[0]
-                            nuevo_monto = max(0, pagare['monto'] - monto)
+                        try:
+                            # Lectura y actualización del pagaré en una sola transacción (un commit)
+                            with db.transaction():
+                                pagares = db.execute_query(pagare_query, (estudiante_info['id'],))
+                                affected = None
+                                if pagares:
+                                    pagare = pagares[0]
+                                    nuevo_monto = max(0, pagare['monto'] - monto)
+                                    affected = db.execute_update(update_query, (nuevo_monto, pagare['id_pagare']))
                             
-                            update_query = "UPDATE pagare SET monto = %s WHERE id_pagare = %s"
-                            affected = db.execute_update(update_query, (nuevo_monto, pagare['id_pagare']))
-                            
-                            if affected and affected > 0:
+                            if not pagares:
+                                step4.info("Paso 4/5: Sin pagarés pendientes para este estudiante")
+                            elif affected and affected > 0:
                                 step4.success("Paso 4/5: Pagaré actualizado en sede Central")
                             else:
                                 step4.error("❌ Error al actualizar pagaré")
-                        else:
-                            step4.info("Paso 4/5: Sin pagarés pendientes para este estudiante")
+                        except Exception as e:
+                            step4.error(f"❌ Error al actualizar pagaré: {e}")
                     else:
                         step4.warning("Paso 4/5: No se pudo conectar a Central para verificar pagarés")
             else:
@@ -479,43 +506,50 @@ with tab3:
             
             if crear_estudiante:
                 if nuevo_nombre and nuevo_email:
-                    email_existe = False
-                    for sede_check in ['central', 'sancarlos', 'heredia']:
-                        with get_db_connection(sede_check) as db:
-                            if db:
-                                check_query = "SELECT id_estudiante FROM estudiante WHERE email = %s"
-                                result = db.execute_query(check_query, (nuevo_email,))
-                                if result:
-                                    email_existe = True
-                                    break
-                    
-                    if email_existe:
-                        st.error("❌ Este email ya está registrado en el sistema")
-                    else:
-                        with get_db_connection(sede_matricula) as db:
-                            if db:
-                                sede_ids = {"central": 1, "sancarlos": 2, "heredia": 3}
-                                id_sede = sede_ids[sede_matricula]
+                    # Un acierto en el directorio de Redis basta; si no, se confirma en todas las sedes
+                    directorio = get_student_directory()
+                    with directorio.reservation(nuevo_email) as reservado:
+                        registrado = directorio.is_registered(nuevo_email) if reservado else None
+                        if not reservado:
+                            st.error("❌ Este email se está registrando en otra sesión, intente de nuevo")
+                        elif registrado:
+                            st.error("❌ Este email ya está registrado en el sistema")
+                        elif registrado is None:
+                            st.error("❌ No se pudo verificar el email en todas las sedes, intente de nuevo")
+                        else:
+                            with get_db_connection(sede_matricula) as db:
+                                if db:
+                                    sede_ids = {"central": 1, "sancarlos": 2, "heredia": 3}
+                                    id_sede = sede_ids[sede_matricula]
                                 
-                                insert_query = "INSERT INTO estudiante (nombre, email, id_sede, sede_actual) VALUES (%s, %s, %s, %s)"
-                                affected = db.execute_update(insert_query, (nuevo_nombre, nuevo_email, id_sede, id_sede))
+                                    # Id global asignado antes del INSERT; sin Redis no se crea el estudiante
+                                    # (AUTO_INCREMENT podría repetir un id de otra sede)
+                                    nuevo_id = allocate_id('estudiante')
+                                    if nuevo_id is None:
+                                        st.error("❌ No se pudo asignar un id global (Redis no disponible), intente de nuevo")
+                                        st.stop()
+                                    insert_query = "INSERT INTO estudiante (id_estudiante, nombre, email, id_sede, sede_actual) VALUES (%s, %s, %s, %s, %s)"
+                                    affected = db.execute_update(insert_query, (nuevo_id, nuevo_nombre, nuevo_email, id_sede, id_sede))
                                 
-                                if affected and affected > 0:
-                                    get_id_query = "SELECT id_estudiante, nombre, email FROM estudiante WHERE email = %s"
-                                    result = db.execute_query(get_id_query, (nuevo_email,))
-                                    
-                                    if result:
-                                        st.session_state.nuevo_estudiante_creado = result[0]
-                                        st.success(f"✅ Estudiante creado exitosamente - ID: {result[0]['id_estudiante']}")
-                                        st.success("🔄 Continuando automáticamente con el proceso de matrícula...")
-                                        time.sleep(1)
-                                        st.rerun()
+                                    if affected and affected > 0:
+                                        if nuevo_id:
+                                            get_student_directory().register(nuevo_email, sede_matricula, nuevo_id)
+                                            nuevo_estudiante = {
+                                                'id_estudiante': nuevo_id,
+                                                'nombre': nuevo_nombre,
+                                                'email': nuevo_email
+                                            }
+                                            st.session_state.nuevo_estudiante_creado = nuevo_estudiante
+                                            st.success(f"✅ Estudiante creado exitosamente - ID: {nuevo_estudiante['id_estudiante']}")
+                                            st.success("🔄 Continuando automáticamente con el proceso de matrícula...")
+                                            time.sleep(1)
+                                            st.rerun()
+                                        else:
+                                            st.error("❌ Error al obtener datos del estudiante creado")
                                     else:
-                                        st.error("❌ Error al obtener datos del estudiante creado")
+                                        st.error("❌ Error al crear el estudiante")
                                 else:
-                                    st.error("❌ Error al crear el estudiante")
-                            else:
-                                st.error("❌ No se pudo conectar a la base de datos")
+                                    st.error("❌ No se pudo conectar a la base de datos")
                 else:
                     st.error("❌ Por favor complete todos los campos")
     
@@ -599,16 +633,23 @@ with tab3:
                                     
                                     with get_db_connection(sede_matricula) as db:
                                         if db:
-                                            for curso in cursos_seleccionados:
-                                                matricula_query = "INSERT INTO matricula (id_estudiante, id_curso) VALUES (%s, %s)"
-                                                affected = db.execute_update(matricula_query, 
-                                                    (estudiante_matricula['id_estudiante'], curso['id_curso']))
-                                                
-                                                if affected and affected > 0:
-                                                    matriculas_creadas.append(curso['nombre'])
-                                                else:
-                                                    step3.error(f"❌ Error al matricular en {curso['nombre']}")
-                                                    st.stop()
+                                            filas_matricula = [
+                                                {'id_estudiante': estudiante_matricula['id_estudiante'], 'id_curso': curso['id_curso']}
+                                                for curso in cursos_seleccionados
+                                            ]
+                                            ids_globales = allocate_ids('matricula', len(filas_matricula))
+                                            if not ids_globales:
+                                                step3.error("❌ No se pudieron asignar ids globales (Redis no disponible)")
+                                                st.stop()
+                                            for fila, id_matricula in zip(filas_matricula, ids_globales):
+                                                fila['id_matricula'] = id_matricula
+                                            ids_matricula = db.bulk_insert('matricula', filas_matricula, id_column='id_matricula')
+                                            
+                                            if ids_matricula is not None:
+                                                matriculas_creadas.extend(curso['nombre'] for curso in cursos_seleccionados)
+                                            else:
+                                                step3.error("❌ Error al registrar las matrículas")
+                                                st.stop()
                                             
                                             step3.success(f"Paso 3/5: {len(matriculas_creadas)} matrícula(s) registrada(s)")
                                         else:
@@ -621,13 +662,17 @@ with tab3:
                                         
                                         with get_db_connection(sede_matricula) as db:
                                             if db:
-                                                pago_query = "INSERT INTO pago (id_estudiante, monto, fecha) VALUES (%s, %s, %s)"
+                                                id_pago = allocate_id('pago')
+                                                if id_pago is None:
+                                                    step4.error("❌ No se pudo asignar un id global al pago (Redis no disponible)")
+                                                    st.stop()
+                                                pago_query = "INSERT INTO pago (id_pago, id_estudiante, monto, fecha) VALUES (%s, %s, %s, %s)"
                                                 affected = db.execute_update(pago_query, 
-                                                    (estudiante_matricula['id_estudiante'], costo_total, 
+                                                    (id_pago, estudiante_matricula['id_estudiante'], costo_total, 
                                                      datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
                                                 
                                                 if affected and affected > 0:
-                                                    pago_id = f"PAY-{random.randint(1000, 9999)}"
+                                                    pago_id = f"PAY-{id_pago}"
                                                     step4.success(f"Paso 4/6: Pago procesado - ID: {pago_id}")
                                                 else:
                                                     step4.error("❌ Error al procesar el pago")
@@ -762,47 +807,32 @@ with tab4:
         datos_consolidados = []
         sedes = ['central', 'sancarlos', 'heredia']
         
+        query = """
+        SELECT 
+            COUNT(*) as total_estudiantes,
+            COUNT(CASE WHEN estado = 'Activo' THEN 1 END) as estudiantes_activos,
+            '%s' as sede
+        FROM estudiante
+        """
+        resultados = run_distributed_queries({sede: (sede, query % sede.title(), None) for sede in sedes})
+        
         for sede in sedes:
-            try:
-                with get_db_connection(sede) as conn:
-                    query = """
-                    SELECT 
-                        COUNT(*) as total_estudiantes,
-                        COUNT(CASE WHEN estado = 'Activo' THEN 1 END) as estudiantes_activos,
-                        '%s' as sede
-                    FROM estudiante
-                    """ % sede.title()
-                    results = conn.execute_query(query)
-                    if results:
-                        datos_consolidados.extend(results)
-            except Exception as e:
-                st.warning(f"Error consolidando datos de {sede}: {e}")
+            resultado = resultados[sede]
+            if resultado['rows']:
+                datos_consolidados.extend(resultado['rows'])
+            elif resultado['error']:
+                st.warning(f"Error consolidando datos de {sede}: {resultado['error']}")
         
         return datos_consolidados
     
     def consolidar_datos_pagos():
-        datos_pagos = []
-        sedes = ['central','sancarlos', 'heredia']
+        # Estados parciales por sede: el promedio global sale de SUM/COUNT, no de promediar promedios
+        resultado = run_distributed_aggregate(PAGOS_ANIO_ACTUAL)
         
-        for sede in sedes:
-            try:
-                with get_db_connection(sede) as conn:
-                    query = """
-                    SELECT 
-                        COUNT(*) as total_pagos,
-                        COALESCE(SUM(monto), 0) as monto_total,
-                        COALESCE(AVG(monto), 0) as promedio_pago,
-                        '%s' as sede
-                    FROM pago
-                    WHERE YEAR(fecha) = YEAR(CURDATE())
-                    """ % sede.title()
-                    results = conn.execute_query(query)
-                    if results:
-                        datos_pagos.extend(results)
-            except Exception as e:
-                st.warning(f"Error consolidando pagos de {sede}: {e}")
+        for sede, error in resultado['fallidas'].items():
+            st.warning(f"Error consolidando pagos de {sede}: {error}")
         
-        return datos_pagos
+        return resultado
     
     col1, col2, col3 = st.columns([1, 1, 2])
     
@@ -1058,7 +1088,26 @@ with tab4:
                 pagares = conn.execute_query(query_pagares)
                 
                 if pagares:
+                    # pagare vive solo en Central y estudiante está fragmentado: se trae
+                    # el nombre de cada sede con un semi-join por id_estudiante
+                    pagares_estudiante, info_join = distributed_hash_join(
+                        pagares, 'id_estudiante',
+                        "SELECT id_estudiante, nombre FROM estudiante WHERE id_estudiante IN ({keys})",
+                        'id_estudiante', ['estudiante'], how='left'
+                    )
+                    if info_join['fallidas']:
+                        st.warning(f"Sin nombres de: {', '.join(get_sede_info(sede)['name'] for sede in info_join['fallidas'])}")
+                    
+                    # pagare no guarda la sede: un id que existe en varias sedes muestra cada candidato
+                    nombres = {}
+                    for fila in pagares_estudiante:
+                        if fila.get('nombre'):
+                            nombres.setdefault(fila['id_pagare'], []).append(
+                                f"{fila['nombre']} ({get_sede_info(fila['sede_key'])['name']})")
+                    
                     df_pagares = pd.DataFrame(pagares)
+                    df_pagares['estudiante'] = df_pagares['id_pagare'].map(
+                        lambda id_pagare: ' / '.join(nombres.get(id_pagare, [])) or 'Sin registro')
                     
                     col1, col2, col3, col4 = st.columns(4)
                     with col1:
@@ -1075,8 +1124,9 @@ with tab4:
                         st.metric("💰 Monto Total", f"₡{monto_total:,.0f}")
                     
                     st.dataframe(
-                        df_pagares[['codigo_estudiante', 'monto', 'vencimiento', 'estado', 'dias_vencimiento']].rename(columns={
+                        df_pagares[['codigo_estudiante', 'estudiante', 'monto', 'vencimiento', 'estado', 'dias_vencimiento']].rename(columns={
                             'codigo_estudiante': 'Código Estudiante',
+                            'estudiante': 'Estudiante',
                             'monto': 'Monto', 
                             'vencimiento': 'Vencimiento',
                             'estado': 'Estado',
@@ -1117,16 +1167,19 @@ with tab4:
                 st.markdown("#### Consolidación de Pagos")
                 datos_pagos = consolidar_datos_pagos()
                 
-                if datos_pagos:
-                    df_pagos_dist = pd.DataFrame(datos_pagos)
+                if not datos_pagos['por_sede'].empty:
+                    df_pagos_dist = datos_pagos['por_sede']
+                    global_pagos = datos_pagos['data'].iloc[0]
                     
-                    col1, col2 = st.columns(2)
+                    col1, col2, col3 = st.columns(3)
                     with col1:
-                        total_ingresos = df_pagos_dist['monto_total'].sum()
+                        total_ingresos = global_pagos['monto_total'] or 0
                         st.metric("Ingresos Consolidados", f"₡{total_ingresos:,.0f}")
                     with col2:
-                        total_transacciones = df_pagos_dist['total_pagos'].sum()
-                        st.metric("Total Transacciones", int(total_transacciones))
+                        st.metric("Total Transacciones", int(global_pagos['total_pagos']))
+                    with col3:
+                        promedio_global = global_pagos['promedio_pago'] or 0
+                        st.metric("Pago Promedio Global", f"₡{promedio_global:,.0f}")
                     
                     fig_ingresos = px.bar(
                         df_pagos_dist,
@@ -0,0 +1,153 @@
+import streamlit as st
+import pandas as pd
+import plotly.graph_objects as go
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_CONFIG, get_sede_info
+from utils.db_connections import get_pool_metrics
+from utils.query_cache import get_cache_stats
+from utils.metrics import get_metrics_registry
+from utils.metrics_exporter import get_metrics_exporter
+
+st.set_page_config(
+    page_title="Rendimiento - Sistema Cenfotec",
+    page_icon="⏱️",
+    layout="wide"
+)
+
+st.title("Rendimiento de Consultas")
+
+with st.expander("Detalles Técnicos", expanded=False):
+    st.markdown("""
+    **Cómo se mide:**
+    - Cada consulta de `DatabaseConnection`, del usuario de replicación y cada comando de Redis se cronometra
+    - El tiempo se separa en **conexión** (préstamo del pool), **ejecución** y **lectura** de filas
+    - Las consultas se agrupan por **huella**: el SQL con literales y parámetros reemplazados por `?`
+    - Los percentiles salen de histogramas log-lineales (error relativo ~6%)
+    - Las métricas son de este proceso de Streamlit y se pierden al reiniciarlo
+    - Para monitoreo externo se exportan en formato Prometheus en el puerto 9108 (`/metrics`)
+    """)
+
+registry = get_metrics_registry()
+get_metrics_exporter()
+
+
+def nombre_nodo(node: str) -> str:
+    return get_sede_info(node)['name'] if node in DB_CONFIG else node.title()
+
+
+col1, col2 = st.columns([3, 1])
+with col2:
+    if st.button("Reiniciar métricas", type="secondary"):
+        registry.reset()
+        st.success("Métricas reiniciadas")
+
+query_stats = registry.query_stats()
+if not query_stats:
+    st.info("Todavía no hay consultas registradas. Navega por las demás páginas para generar datos.")
+    st.stop()
+
+df = pd.DataFrame(query_stats)
+df['nodo'] = df['node'].apply(nombre_nodo)
+
+st.markdown("### Latencia por Nodo")
+
+resumen = []
+for (source, node), histogram in registry.histograms().items():
+    filas = df[(df['source'] == source) & (df['node'] == node)]
+    resumen.append({
+        'Origen': source,
+        'Nodo': nombre_nodo(node),
+        'Llamadas': histogram.count,
+        'Errores': int(filas['errors'].sum()),
+        'Filas': int(filas['rows'].sum()),
+        'p50 (ms)': round(histogram.percentile(50), 2),
+        'p95 (ms)': round(histogram.percentile(95), 2),
+        'p99 (ms)': round(histogram.percentile(99), 2),
+        'Máx (ms)': round(histogram.max_us / 1000, 2)
+    })
+df_resumen = pd.DataFrame(resumen).sort_values(['Origen', 'Nodo'])
+st.dataframe(df_resumen, use_container_width=True, hide_index=True)
+
+fig = go.Figure()
+etiquetas = df_resumen['Origen'] + ' · ' + df_resumen['Nodo']
+for percentil in ['p50 (ms)', 'p95 (ms)', 'p99 (ms)']:
+    fig.add_trace(go.Bar(name=percentil.split(' ')[0], x=etiquetas, y=df_resumen[percentil]))
+fig.update_layout(barmode='group', yaxis_title='ms', height=350, margin=dict(t=20, b=20))
+st.plotly_chart(fig, use_container_width=True)
+
+connect_stats = registry.connect_stats()
+if connect_stats:
+    st.markdown("### Tiempo de Conexión")
+    df_connect = pd.DataFrame(connect_stats)
+    df_connect['node'] = df_connect['node'].apply(nombre_nodo)
+    st.dataframe(
+        df_connect.rename(columns={
+            'source': 'Origen', 'node': 'Nodo', 'calls': 'Conexiones', 'errors': 'Errores',
+            'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)', 'p99_ms': 'p99 (ms)', 'max_ms': 'Máx (ms)'
+        }).round(2),
+        use_container_width=True, hide_index=True
+    )
+
+operation_stats = registry.operation_stats()
+if operation_stats:
+    st.markdown("### Réplicas y Transferencias")
+    df_operations = pd.DataFrame(operation_stats)
+    st.dataframe(
+        df_operations.rename(columns={
+            'operation': 'Operación', 'node': 'Destino', 'calls': 'Ejecuciones', 'errors': 'Errores',
+            'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)', 'p99_ms': 'p99 (ms)', 'max_ms': 'Máx (ms)'
+        }).round(2),
+        use_container_width=True, hide_index=True
+    )
+
+st.markdown("### Consultas Más Costosas")
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    nodos = ['Todos'] + sorted(df['nodo'].unique())
+    nodo = st.selectbox("Nodo:", nodos)
+with col2:
+    criterio = st.selectbox("Ordenar por:", ["Tiempo total", "p99", "Llamadas", "Filas"])
+with col3:
+    limite = st.slider("Cantidad:", min_value=5, max_value=50, value=10, step=5)
+
+columnas_orden = {'Tiempo total': 'total_ms', 'p99': 'p99_ms', 'Llamadas': 'calls', 'Filas': 'rows'}
+df_top = df if nodo == 'Todos' else df[df['nodo'] == nodo]
+df_top = df_top.sort_values(columnas_orden[criterio], ascending=False).head(limite)
+
+st.dataframe(
+    df_top[['nodo', 'source', 'fingerprint', 'calls', 'errors', 'rows', 'p50_ms', 'p95_ms', 'p99_ms',
+            'execute_p95_ms', 'fetch_p95_ms', 'total_ms']].rename(columns={
+        'nodo': 'Nodo', 'source': 'Origen', 'fingerprint': 'Consulta', 'calls': 'Llamadas',
+        'errors': 'Errores', 'rows': 'Filas', 'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)',
+        'p99_ms': 'p99 (ms)', 'execute_p95_ms': 'Ejecución p95', 'fetch_p95_ms': 'Lectura p95',
+        'total_ms': 'Total (ms)'
+    }).round(2),
+    use_container_width=True, hide_index=True
+)
+
+st.markdown("### Pools de Conexiones")
+df_pools = pd.DataFrame(get_pool_metrics().values())
+st.dataframe(
+    df_pools[['pool', 'size', 'max_size', 'in_use', 'idle', 'utilization', 'checkouts', 'waits',
+              'timeouts', 'checkout_avg_ms', 'checkout_max_ms']].rename(columns={
+        'pool': 'Pool', 'size': 'Abiertas', 'max_size': 'Máximo', 'in_use': 'En uso', 'idle': 'Libres',
+        'utilization': 'Uso', 'checkouts': 'Préstamos', 'waits': 'Esperas', 'timeouts': 'Agotados',
+        'checkout_avg_ms': 'Préstamo prom. (ms)', 'checkout_max_ms': 'Préstamo máx. (ms)'
+    }).round(2),
+    use_container_width=True, hide_index=True
+)
+
+st.markdown("### Cache de Consultas")
+cache_stats = get_cache_stats()
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    st.metric("Hit ratio total", f"{cache_stats['hit_ratio'] * 100:.1f}%")
+with col2:
+    st.metric("Aciertos locales", cache_stats['local_hits'])
+with col3:
+    st.metric("Aciertos Redis", cache_stats['hits'])
+with col4:
+    st.metric("Fallos", cache_stats['misses'])
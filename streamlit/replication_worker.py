@@ -0,0 +1,74 @@
+"""
+Worker de replicación asíncrona: aplica en los esclavos los cambios de datos
+maestros. Con CDC_CONFIG activo lee el binlog de Central (todas las escrituras
+de las tablas maestras) y es el único camino hacia los esclavos: primero vacía
+lo que haya quedado en replication_log y luego sigue solo con el binlog. Sin
+CDC aplica replication_log (OUTBOX_CONFIG).
+
+Corre como servicio aparte (replication-worker en docker-compose.yml).
+Uso:
+    python replication_worker.py
+    python replication_worker.py --cdc-fixture fixtures/binlog_maestras.jsonl --dry-run
+"""
+import argparse
+import logging
+import signal
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import CDC_CONFIG
+from utils.outbox import OutboxWorker
+from utils.replication import CDC_ACTIVE
+from utils.binlog_cdc import BinlogCdc, read_fixture
+
+logger = logging.getLogger(__name__)
+
+
+def replay_fixture(path: str, dry_run: bool):
+    """
+    Aplica (o solo muestra, con dry_run) los eventos de un fixture y termina.
+    No usa ni modifica el punto de control del binlog real.
+    """
+    cdc = BinlogCdc.from_config(persist=False, dry_run=dry_run)
+    cdc.run(read_fixture(path))
+    print(f"Fixture aplicado: {cdc.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cdc-fixture', default=CDC_CONFIG['fixture_path'],
+                        help='Lee los eventos de un fixture JSONL en vez del binlog y termina')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Con --cdc-fixture: muestra las sentencias sin conectarse a las sedes')
+    args = parser.parse_args()
+
+    if args.cdc_fixture:
+        replay_fixture(args.cdc_fixture, args.dry_run)
+        return
+
+    worker = OutboxWorker.from_config()
+    cdc = BinlogCdc.from_config() if CDC_ACTIVE else None
+    if CDC_CONFIG['enabled'] and not CDC_ACTIVE:
+        logger.warning("CDC activo en la configuración pero pymysqlreplication no está instalado: se usa el outbox")
+
+    def handle_signal(signum, frame):
+        logger.info(f"Señal {signum} recibida, deteniendo el worker de replicación")
+        worker.stop()
+        if cdc:
+            cdc.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    if not cdc:
+        worker.run_forever()
+        return
+
+    # El punto de control se fija antes de vaciar el outbox: lo que se escriba
+    # mientras tanto llega por el binlog, después de las entradas viejas del log
+    gtid_set = cdc.wait_for_checkpoint()
+    if gtid_set is not None and worker.drain():
+        cdc.run_binlog(CDC_CONFIG['server_id'], gtid_set)
+
+if __name__ == '__main__':
+    main()
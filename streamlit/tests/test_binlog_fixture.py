@@ -0,0 +1,98 @@
+"""
+Reproduce fixtures/binlog_maestras.jsonl con read_fixture/build_statements,
+el mismo camino que sigue replication_worker.py --cdc-fixture.
+
+Uso:
+    python -m pytest tests
+"""
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.binlog_cdc import BinlogCdc, read_fixture, parse_gtid_set, format_gtid_set
+from utils.outbox import build_statements
+from utils.replication import master_upsert_sql
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'fixtures', 'binlog_maestras.jsonl')
+UUID = '5f1c2a3e-8b7d-11ef-9c41-0242ac14000a'
+
+
+def fixture_entries():
+    transactions = list(read_fixture(FIXTURE))
+    entries = [change for _, changes in transactions for change in changes]
+    return transactions, [{**entry, 'id': index} for index, entry in enumerate(entries)]
+
+
+class BinlogFixtureTest(unittest.TestCase):
+
+    def test_transacciones_por_gtid(self):
+        transactions, _ = fixture_entries()
+        self.assertEqual([gtid for gtid, _ in transactions], [f"{UUID}:{number}" for number in range(41, 46)])
+        # La fila de planilla comparte el GTID 42 pero no es tabla maestra
+        self.assertEqual([change['tabla_afectada'] for change in transactions[1][1]], ['profesor'])
+
+    def test_cambios_en_orden(self):
+        _, entries = fixture_entries()
+        self.assertEqual([(entry['tabla_afectada'], entry['operacion'], entry['registro_id']) for entry in entries], [
+            ('carrera', 'INSERT', 40),
+            ('profesor', 'INSERT', 25),
+            ('carrera', 'UPDATE', 40),
+            ('sede', 'UPDATE', 3),
+            ('profesor', 'DELETE', 25),
+        ])
+
+    def test_sentencias(self):
+        _, entries = fixture_entries()
+        statements, invalid = build_statements(entries)
+        self.assertEqual(invalid, set())
+        self.assertEqual([(query, params) for query, params, _ in statements], [
+            (master_upsert_sql('carrera'), (40, 'Ciencia de Datos', 1)),
+            (master_upsert_sql('profesor'), (25, 'Laura Jiménez', 'ljimenez@ucenfotec.ac.cr', 2)),
+            (master_upsert_sql('carrera'), (40, 'Ciencia de Datos e IA', 1)),
+            (master_upsert_sql('sede'), (3, 'Heredia', 'Barrio Fátima, Heredia')),
+            ("DELETE FROM profesor WHERE id_profesor IN (%s)", (25,)),
+        ])
+        self.assertEqual([log_ids for _, _, log_ids in statements], [[0], [1], [2], [3], [4]])
+
+    def test_ultima_version_por_clave(self):
+        _, entries = fixture_entries()
+        carreras = [entry for entry in entries if entry['tabla_afectada'] == 'carrera']
+        statements, _ = build_statements([{**entry, 'id': index} for index, entry in enumerate(carreras)])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(statements[0][1], (40, 'Ciencia de Datos e IA', 1))
+        self.assertEqual(statements[0][2], [0, 1])
+
+    def test_intercambio_unique_en_orden(self):
+        def profesor(log_id, id_profesor, email):
+            return {'id': log_id, 'tabla_afectada': 'profesor', 'operacion': 'UPDATE', 'registro_id': id_profesor,
+                    'datos_nuevos': {'fila': {'id_profesor': id_profesor, 'nombre': f'Profesor {id_profesor}',
+                                              'email': email, 'id_sede': 1}}}
+        # 1 y 2 intercambian su email pasando por uno temporal
+        statements, _ = build_statements([profesor(0, 1, 'tmp@ucenfotec.ac.cr'),
+                                          profesor(1, 2, 'a@ucenfotec.ac.cr'),
+                                          profesor(2, 1, 'b@ucenfotec.ac.cr')])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(statements[0][1][2::4], ('tmp@ucenfotec.ac.cr', 'a@ucenfotec.ac.cr', 'b@ucenfotec.ac.cr'))
+        self.assertEqual(statements[0][2], [0, 1, 2])
+
+    def test_conjunto_gtid(self):
+        position = parse_gtid_set(f"{UUID.upper()}:1-5:7-41,\n{UUID}:1-3")
+        self.assertEqual(position, {UUID: 41})
+        self.assertEqual(format_gtid_set(position), f"{UUID}:1-41")
+        self.assertEqual(parse_gtid_set(''), {})
+
+    def test_simulacion_avanza_posicion(self):
+        cdc = BinlogCdc.from_config(persist=False, dry_run=True)
+        cdc.position = {UUID: 42}
+        cdc.run(read_fixture(FIXTURE))
+        # Las transacciones 41 y 42 ya estaban aplicadas
+        self.assertEqual(cdc.position, {UUID: 45})
+        self.assertEqual(cdc.stats['transacciones'], 5)
+        self.assertEqual(cdc.stats['cambios'], 3)
+        self.assertEqual(cdc.stats['errores'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,12 +9,32 @@ from .db_connections import (
     RedisConnection,
     get_db_connection,
     get_redis_connection,
+    get_connection_pool,
+    get_pool_metrics,
+    get_circuit_breaker,
+    get_breaker_status,
     test_all_connections,
     execute_distributed_query,
+    execute_distributed_query_parallel,
     execute_real_transfer,
     log_transfer_audit
 )
 
+from .query_cache import (
+    cached_query,
+    cached_dataframe,
+    invalidate_tables,
+    get_cache_stats
+)
+
+from .health_monitor import get_health_status
+
+from .fragment_router import route_query, sede_for_id
+
+from .student_directory import get_student_directory, find_student
+
+from .id_allocator import allocate_id, allocate_ids
+
 from .queries import (
     FRAGMENTATION_QUERIES,
     REPLICATION_QUERIES,
@@ -31,9 +51,12 @@ from .replication import (
     MasterSlaveReplication,
     execute_master_slave_replication,
     execute_profesor_replication,
+    execute_batch_replication,
     ReplicationConnection
 )
 
+from .consistency import verify_replication_consistency, repair_replication
+
 # Definir qué se exporta cuando se hace "from utils import *"
 __all__ = [
     # Conexiones
@@ -41,11 +64,29 @@ __all__ = [
     'RedisConnection',
     'get_db_connection',
     'get_redis_connection',
+    'get_connection_pool',
+    'get_pool_metrics',
+    'get_circuit_breaker',
+    'get_breaker_status',
     'test_all_connections',
     'execute_distributed_query',
+    'execute_distributed_query_parallel',
     'execute_real_transfer',
     'log_transfer_audit',
     
+    # Cache de consultas
+    'cached_query',
+    'cached_dataframe',
+    'invalidate_tables',
+    'get_cache_stats',
+    'get_health_status',
+    'route_query',
+    'sede_for_id',
+    'get_student_directory',
+    'find_student',
+    'allocate_id',
+    'allocate_ids',
+    
     # Queries
     'FRAGMENTATION_QUERIES',
     'REPLICATION_QUERIES',
@@ -59,7 +100,10 @@ __all__ = [
     'MasterSlaveReplication',
     'execute_master_slave_replication',
     'execute_profesor_replication',
-    'ReplicationConnection'
+    'execute_batch_replication',
+    'ReplicationConnection',
+    'verify_replication_consistency',
+    'repair_replication'
 ]
 
 # Versión del módulo
@@ -0,0 +1,255 @@
+"""
+Consultas distribuidas sobre asyncio (aiomysql)
+"""
+import asyncio
+import threading
+import logging
+import time
+from typing import Optional, Dict, Any, List, Tuple, Union
+import pandas as pd
+import streamlit as st
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_CONFIG, TIMEOUT_CONFIG, POOL_CONFIG, MESSAGES
+from utils.connection_pool import pool_size_for
+from utils.metrics import record_query, record_connect
+from utils.db_connections import (DatabaseConnection, get_connection_pool, get_query_executor,
+                                  get_circuit_breaker, get_degraded_sedes)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiomysql
+    AIOMYSQL_AVAILABLE = True
+except ImportError:
+    aiomysql = None
+    AIOMYSQL_AVAILABLE = False
+    logger.warning("Módulo aiomysql no disponible. Se usará el ejecutor con hilos.")
+
+# Una sentencia es (sede, consulta, parámetros)
+Statement = Tuple[str, str, Optional[Tuple]]
+
+
+class AsyncQueryRunner:
+    """Event loop propio en un hilo de fondo con un pool aiomysql por sede."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.pools = {}
+        # Un lock por sede: crear el pool abre una conexión, y una sede caída no
+        # debe frenar la primera consulta a las demás
+        self._pool_locks = {}
+        self.thread = threading.Thread(target=self._run_loop, name='async-db-loop', daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def get_pool(self, sede: str):
+        pool = self.pools.get(sede)
+        if pool is not None:
+            return pool
+        # Solo corre en el hilo del loop: setdefault no necesita otro lock
+        async with self._pool_locks.setdefault(sede, asyncio.Lock()):
+            if sede not in self.pools:
+                config = DB_CONFIG.get(sede)
+                if not config:
+                    raise ValueError(f"Sede '{sede}' no encontrada en la configuración")
+                if not get_circuit_breaker(sede).allow_request():
+                    # Sede caída: no se espera connect_timeout para crear el pool
+                    raise RuntimeError(MESSAGES['circuit_open'].format(sede=config['name']))
+                self.pools[sede] = await aiomysql.create_pool(
+                    host=config['host'],
+                    port=config['port'],
+                    user=config['user'],
+                    password=config['password'],
+                    db=config['database'],
+                    connect_timeout=TIMEOUT_CONFIG['connection_timeout'],
+                    minsize=1,
+                    maxsize=pool_size_for(config, POOL_CONFIG['async_max_connections_share']),
+                    autocommit=True
+                )
+                logger.info(f"Pool asíncrono creado para {sede}")
+            return self.pools[sede]
+
+    def run(self, coro, timeout: Optional[float] = None):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except Exception:
+            future.cancel()
+            raise
+
+
+@st.cache_resource
+def get_async_runner() -> AsyncQueryRunner:
+    logger.info("=== CREANDO EVENT LOOP DE CONSULTAS ASÍNCRONAS ===")
+    return AsyncQueryRunner()
+
+
+async def fetch_all_async(runner: AsyncQueryRunner, sede: str, query: str, params: Optional[Tuple] = None) -> List[Dict]:
+    pool = await runner.get_pool(sede)
+    start = time.perf_counter()
+    conn = await pool.acquire()
+    record_connect('mysql', sede, time.perf_counter() - start)
+    try:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            start = time.perf_counter()
+            await cursor.execute(query, params)
+            executed = time.perf_counter()
+            rows = list(await cursor.fetchall())
+            record_query('mysql', sede, query, executed - start, time.perf_counter() - executed, len(rows))
+            return rows
+    except asyncio.CancelledError:
+        # La consulta quedó a medias: la conexión no se puede devolver al pool
+        conn.close()
+        raise
+    finally:
+        pool.release(conn)
+
+
+async def _timed_statement(runner: AsyncQueryRunner, statement: Statement, timeout: float,
+                           breaker=None) -> Dict[str, Any]:
+    sede, query, params = statement
+    start = time.perf_counter()
+    try:
+        rows = await asyncio.wait_for(fetch_all_async(runner, sede, query, params), timeout)
+        if breaker:
+            breaker.record_success()
+        return {'sede': sede, 'rows': rows, 'error': None, 'timed_out': False,
+                'elapsed': time.perf_counter() - start}
+    except asyncio.TimeoutError:
+        logger.warning(f"Consulta asíncrona en {sede} cancelada tras {timeout}s")
+        return {'sede': sede, 'rows': None, 'error': 'timeout', 'timed_out': True,
+                'elapsed': time.perf_counter() - start}
+    except Exception as e:
+        logger.error(f"Error en consulta asíncrona {sede}: {e}")
+        # Solo los errores de conexión cuentan para el circuito, no los de SQL
+        if breaker and isinstance(e, (aiomysql.OperationalError, OSError)):
+            breaker.record_failure(str(e))
+        return {'sede': sede, 'rows': None, 'error': str(e), 'timed_out': False,
+                'elapsed': time.perf_counter() - start}
+
+
+async def gather_queries(runner: AsyncQueryRunner, statements: Dict[Any, Statement],
+                         timeout: Optional[float] = None, breakers: Optional[Dict[str, Any]] = None) -> Dict[Any, Dict[str, Any]]:
+    timeout = timeout or TIMEOUT_CONFIG['query_timeout']
+    breakers = breakers or {}
+    keys = list(statements.keys())
+    outcomes = await asyncio.gather(*[
+        _timed_statement(runner, statements[key], timeout, breakers.get(statements[key][0]))
+        for key in keys
+    ])
+    return dict(zip(keys, outcomes))
+
+
+def _gather_with_threads(statements: Dict[Any, Statement], timeout: float,
+                         breakers: Dict[str, Any]) -> Dict[Any, Dict[str, Any]]:
+    def run_statement(statement: Statement, pool, breaker) -> Dict[str, Any]:
+        sede, query, params = statement
+        start = time.perf_counter()
+        db = DatabaseConnection(sede, pool=pool, breaker=breaker)
+        try:
+            rows = db.execute_query(query, params)
+            return {'sede': sede, 'rows': rows, 'error': db.last_error if rows is None else None,
+                    'timed_out': False, 'elapsed': time.perf_counter() - start}
+        finally:
+            db.disconnect()
+
+    executor = get_query_executor()
+    start = time.perf_counter()
+    futures = {
+        key: executor.submit(run_statement, statement, get_connection_pool(statement[0]), breakers.get(statement[0]))
+        for key, statement in statements.items()
+    }
+
+    outcomes = {}
+    for key, future in futures.items():
+        try:
+            outcomes[key] = future.result(timeout=max(0.0, start + timeout - time.perf_counter()))
+        except Exception as e:
+            future.cancel()
+            timed_out = not future.done()
+            outcomes[key] = {'sede': statements[key][0], 'rows': None,
+                             'error': 'timeout' if timed_out else str(e), 'timed_out': timed_out,
+                             'elapsed': time.perf_counter() - start}
+    return outcomes
+
+
+def run_distributed_queries(statements: Dict[Any, Statement], timeout: Optional[float] = None) -> Dict[Any, Dict[str, Any]]:
+    """
+    Envoltorio síncrono para los scripts de Streamlit: ejecuta todas las
+    sentencias a la vez y devuelve por clave las filas, el error y el tiempo.
+    Las sentencias de sedes con el circuito abierto no se envían y vuelven
+    marcadas como degraded.
+    """
+    timeout = timeout or TIMEOUT_CONFIG['query_timeout']
+    if not statements:
+        return {}
+
+    sedes = sorted({statement[0] for statement in statements.values()})
+    degraded = set(get_degraded_sedes(sedes))
+    pending = {key: statement for key, statement in statements.items() if statement[0] not in degraded}
+    breakers = {sede: get_circuit_breaker(sede) for sede in sedes if sede not in degraded}
+
+    outcomes = {}
+    if pending:
+        if not AIOMYSQL_AVAILABLE:
+            outcomes = _gather_with_threads(pending, timeout, breakers)
+        else:
+            runner = get_async_runner()
+            # Margen extra: cada sentencia se cancela por su cuenta al vencer el plazo
+            outcomes = runner.run(gather_queries(runner, pending, timeout, breakers), timeout + 5)
+
+    for key, statement in statements.items():
+        if statement[0] in degraded:
+            outcomes[key] = {'sede': statement[0], 'rows': None, 'error': 'circuito abierto',
+                             'timed_out': False, 'degraded': True, 'elapsed': 0.0}
+    return {key: outcomes[key] for key in statements}
+
+
+async def async_execute_distributed_query(runner: AsyncQueryRunner, query: Union[str, Dict[str, str]],
+                                          sedes: Optional[List[str]] = None, params: Optional[Tuple] = None,
+                                          timeout: Optional[float] = None) -> Dict[str, Any]:
+    if sedes is None:
+        sedes = list(query.keys()) if isinstance(query, dict) else list(DB_CONFIG.keys())
+    statements = {
+        sede: (sede, query[sede] if isinstance(query, dict) else query, params)
+        for sede in sedes
+    }
+
+    start = time.perf_counter()
+    outcomes = await gather_queries(runner, statements, timeout)
+    return _distributed_outcome(outcomes, time.perf_counter() - start)
+
+
+def execute_distributed_query_async(query: Union[str, Dict[str, str]], sedes: Optional[List[str]] = None,
+                                    params: Optional[Tuple] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    if sedes is None:
+        sedes = list(query.keys()) if isinstance(query, dict) else list(DB_CONFIG.keys())
+    statements = {
+        sede: (sede, query[sede] if isinstance(query, dict) else query, params)
+        for sede in sedes
+    }
+
+    start = time.perf_counter()
+    outcomes = run_distributed_queries(statements, timeout)
+    return _distributed_outcome(outcomes, time.perf_counter() - start)
+
+
+def _distributed_outcome(outcomes: Dict[str, Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    result = {'results': {}, 'timings': {}, 'failed': {}, 'timed_out': [], 'degraded': [], 'elapsed': elapsed}
+    for sede, outcome in outcomes.items():
+        result['timings'][sede] = outcome['elapsed']
+        if outcome.get('degraded'):
+            result['degraded'].append(sede)
+        elif outcome['timed_out']:
+            result['timed_out'].append(sede)
+        elif outcome['rows'] is None:
+            result['failed'][sede] = outcome['error']
+        else:
+            result['results'][sede] = pd.DataFrame(outcome['rows'])
+    return result
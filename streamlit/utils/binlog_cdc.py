@@ -0,0 +1,429 @@
+"""
+Captura de cambios (CDC) desde el binlog de Central para las tablas maestras
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Iterator, Set, Tuple
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CDC_CONFIG, CONSISTENCY_CONFIG, REPLICATION_CONFIG, get_db_config
+from utils.db_connections import get_db_connection, get_connection_pool, get_circuit_breaker
+from utils.outbox import apply_log_entries, build_statements
+from utils.consistency import ConsistencyVerifier
+from utils.replication import MASTER_COLUMNS
+from utils.metrics import record_operation
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pymysqlreplication import BinLogStreamReader
+    from pymysqlreplication.event import GtidEvent, XidEvent
+    from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+    BINLOG_AVAILABLE = True
+except ImportError:
+    BinLogStreamReader = None
+    BINLOG_AVAILABLE = False
+    logger.warning("Módulo pymysqlreplication no disponible. La captura de cambios solo puede leer fixtures.")
+
+# Una transacción del binlog: su GTID y los cambios de filas de tablas maestras
+Transaction = Tuple[str, List[Dict[str, Any]]]
+
+# Fila de la tabla de puntos de control que corresponde a este lector
+CHECKPOINT_NAME = 'binlog_maestras'
+
+
+def parse_gtid_set(gtid_set: Optional[str]) -> Dict[str, int]:
+    """
+    'uuid:1-5:7-9,uuid2:1-3' -> {uuid: último número de transacción}. Central
+    es el único origen y sus GTID son consecutivos, así que basta con el máximo.
+    """
+    position = {}
+    for part in (gtid_set or '').replace('\n', '').split(','):
+        if ':' not in part:
+            continue
+        uuid, *intervals = part.strip().split(':')
+        ends = [int(interval.split('-')[-1]) for interval in intervals if interval]
+        if ends:
+            position[uuid.lower()] = max(ends + [position.get(uuid.lower(), 0)])
+    return position
+
+
+def format_gtid_set(position: Dict[str, int]) -> str:
+    return ','.join(f"{uuid}:1-{last}" for uuid, last in sorted(position.items()))
+
+
+def parse_lagging(value: Optional[str]) -> Dict[str, float]:
+    """'sancarlos@1718000000,heredia@…' -> {sede: epoch desde el que está atrasada}."""
+    lagging = {}
+    for part in (value or '').split(','):
+        sede, _, since = part.strip().partition('@')
+        if sede:
+            lagging[sede] = float(since) if since else time.time()
+    return lagging
+
+
+def format_lagging(lagging: Dict[str, float]) -> str:
+    return ','.join(f"{sede}@{int(since)}" for sede, since in sorted(lagging.items()))
+
+
+def _gtid_parts(gtid: str) -> Tuple[str, int]:
+    uuid, number = gtid.rsplit(':', 1)
+    return uuid.lower(), int(number)
+
+
+def row_changes(table: str, event_type: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Cambios de un evento de filas con la forma de las entradas de
+    replication_log, para aplicarlos con el mismo código que el outbox. rows
+    tiene el formato de pymysqlreplication: {'values'} en write/delete y
+    {'before_values', 'after_values'} en update.
+    """
+    key_column = MASTER_COLUMNS[table][0]
+    changes = []
+    for row in rows:
+        if event_type == 'update':
+            before, after = row['before_values'], row['after_values']
+            if before[key_column] != after[key_column]:
+                changes.append({'tabla_afectada': table, 'operacion': 'DELETE', 'registro_id': before[key_column],
+                                'datos_nuevos': {'fila': before}})
+            changes.append({'tabla_afectada': table, 'operacion': 'UPDATE', 'registro_id': after[key_column],
+                            'datos_nuevos': {'fila': after}})
+        else:
+            values = row['values']
+            changes.append({'tabla_afectada': table, 'operacion': 'DELETE' if event_type == 'delete' else 'INSERT',
+                            'registro_id': values[key_column], 'datos_nuevos': {'fila': values}})
+    return changes
+
+
+def read_fixture(path: str) -> Iterator[Transaction]:
+    """
+    Transacciones de un fixture JSONL: una línea por evento de filas con
+    {"gtid", "table", "type": "write"|"update"|"delete", "rows"}. Las líneas
+    seguidas con el mismo GTID forman una transacción.
+    """
+    current_gtid, changes = None, []
+    with open(path, encoding='utf-8') as fixture:
+        for number, line in enumerate(fixture, 1):
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event['gtid'] != current_gtid:
+                if current_gtid:
+                    yield current_gtid, changes
+                current_gtid, changes = event['gtid'], []
+            if event['table'] not in MASTER_COLUMNS:
+                logger.debug(f"Línea {number} del fixture ignorada: {event['table']} no es tabla maestra")
+                continue
+            changes.extend(row_changes(event['table'], event['type'], event['rows']))
+    if current_gtid:
+        yield current_gtid, changes
+
+
+class BinlogReader:
+    """
+    Lee el binlog de Central desde un conjunto GTID (auto_position) y entrega
+    una transacción por cada XidEvent (commit). Si la conexión se cae se vuelve
+    a abrir desde la última transacción entregada.
+    """
+
+    _EVENT_TYPES = {'WriteRowsEvent': 'write', 'UpdateRowsEvent': 'update', 'DeleteRowsEvent': 'delete'}
+
+    def __init__(self, gtid_set: str, server_id: int, stop_event: threading.Event, retry_interval: float):
+        if not BINLOG_AVAILABLE:
+            raise RuntimeError("pymysqlreplication no está instalado")
+        config = get_db_config(REPLICATION_CONFIG['master_sede'])
+        self.connection_settings = {'host': config['host'], 'port': config['port'],
+                                    'user': config['user'], 'passwd': config['password']}
+        self.database = config['database']
+        self.position = parse_gtid_set(gtid_set)
+        self.server_id = server_id
+        self.stop_event = stop_event
+        self.retry_interval = retry_interval
+
+    def _open(self):
+        return BinLogStreamReader(
+            connection_settings=self.connection_settings,
+            server_id=self.server_id,
+            auto_position=format_gtid_set(self.position),
+            only_events=[GtidEvent, XidEvent, WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent],
+            only_schemas=[self.database],
+            only_tables=REPLICATION_CONFIG['replicated_tables'],
+            blocking=True,
+            resume_stream=True
+        )
+
+    def __iter__(self) -> Iterator[Transaction]:
+        while not self.stop_event.is_set():
+            stream = None
+            try:
+                stream = self._open()
+                logger.info(f"Leyendo binlog de Central desde {format_gtid_set(self.position) or 'el inicio'}")
+                gtid, changes = None, []
+                for event in stream:
+                    if self.stop_event.is_set():
+                        return
+                    if isinstance(event, GtidEvent):
+                        gtid, changes = event.gtid, []
+                    elif isinstance(event, XidEvent):
+                        if gtid:
+                            uuid, number = _gtid_parts(gtid)
+                            self.position[uuid] = max(number, self.position.get(uuid, 0))
+                            yield gtid, changes
+                        gtid, changes = None, []
+                    elif event.table in MASTER_COLUMNS:
+                        changes.extend(row_changes(event.table, self._EVENT_TYPES[type(event).__name__], event.rows))
+            except Exception as e:
+                logger.error(f"Lectura del binlog interrumpida: {e}")
+                self.stop_event.wait(self.retry_interval)
+            finally:
+                if stream is not None:
+                    stream.close()
+
+
+class BinlogCdc:
+    """
+    Aplica en los esclavos las transacciones leídas del binlog (o de un
+    fixture). Un hilo lee y deja las transacciones en una cola acotada; el
+    aplicador junta hasta batch_size cambios o flush_interval segundos y aplica
+    el lote en todos los esclavos en paralelo, reintentando con espera
+    exponencial los que no respondan. Solo entonces avanza el punto de control
+    (conjunto GTID), así que tras un reinicio se repiten a lo sumo los cambios
+    de un lote, y aplicarlos de nuevo es idempotente. Un esclavo que sigue sin
+    responder tras max_retries queda atrasado: los lotes siguientes lo prueban
+    una sola vez y, cuando vuelve, el verificador de consistencia le copia lo
+    que se perdió; así un esclavo caído no frena a los demás.
+    """
+
+    def __init__(self, checkpoint_table: Optional[str], batch_size: int, flush_interval: float,
+                 queue_transactions: int, retry_initial: float, retry_max: float, checkpoint_interval: float,
+                 max_retries: int, dry_run: bool = False):
+        self.checkpoint_table = checkpoint_table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.checkpoint_interval = checkpoint_interval
+        self.max_retries = max_retries
+        self.dry_run = dry_run
+        self.lagging = {}
+        self.master_sede = REPLICATION_CONFIG['master_sede']
+        self.slave_sedes = list(REPLICATION_CONFIG['slave_sedes'])
+        self.position = {}
+        self.stats = {'transacciones': 0, 'cambios': 0, 'errores': 0, 'lotes': 0}
+        self._saved_at = 0.0
+        self._queue = queue.Queue(maxsize=queue_transactions)
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.slave_sedes), thread_name_prefix='cdc')
+
+    @classmethod
+    def from_config(cls, persist: bool = True, dry_run: bool = False) -> 'BinlogCdc':
+        """persist=False (fixtures) no lee ni escribe el punto de control del binlog real."""
+        return cls(CDC_CONFIG['checkpoint_table'] if persist else None, CDC_CONFIG['batch_size'],
+                   CDC_CONFIG['flush_interval'], CDC_CONFIG['queue_transactions'], CDC_CONFIG['retry_initial'],
+                   CDC_CONFIG['retry_max'], CDC_CONFIG['checkpoint_interval'], CDC_CONFIG['max_retries'], dry_run)
+
+    def stop(self):
+        self._stop.set()
+
+    def load_checkpoint(self) -> str:
+        """
+        Conjunto GTID ya aplicado, guardado en checkpoint_table de Central. Solo
+        la primera vez, sin fila, se empieza por lo que Central ya ejecutó.
+        """
+        with get_db_connection(self.master_sede) as db:
+            if not db:
+                raise RuntimeError("No se pudo leer el punto de control de CDC en Central")
+            db.execute_update(f"""
+                CREATE TABLE IF NOT EXISTS {self.checkpoint_table} (
+                    nombre VARCHAR(64) PRIMARY KEY,
+                    gtid_set TEXT NOT NULL,
+                    transacciones BIGINT NOT NULL DEFAULT 0,
+                    esclavos_atrasados VARCHAR(255) NOT NULL DEFAULT '',
+                    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB
+            """)
+            rows = db.execute_query(f"SELECT gtid_set, esclavos_atrasados FROM {self.checkpoint_table} "
+                                    f"WHERE nombre = %s", (CHECKPOINT_NAME,))
+            if rows is None:
+                raise RuntimeError("No se pudo leer el punto de control de CDC en Central")
+            if rows:
+                self.position = parse_gtid_set(rows[0]['gtid_set'])
+                # El punto de control ya pasó los cambios que estos esclavos se perdieron
+                self.lagging = {sede: since for sede, since in parse_lagging(rows[0]['esclavos_atrasados']).items()
+                                if sede in self.slave_sedes}
+                return format_gtid_set(self.position)
+            rows = db.execute_query("SELECT @@GLOBAL.gtid_executed AS gtid_set")
+        if not rows:
+            raise RuntimeError("No se pudo leer gtid_executed de Central")
+        self.position = parse_gtid_set(rows[0]['gtid_set'])
+        logger.info(f"Sin punto de control de CDC: se empieza en {format_gtid_set(self.position)}")
+        if not self._save_checkpoint():
+            raise RuntimeError("No se pudo guardar el punto de control inicial de CDC")
+        return format_gtid_set(self.position)
+
+    def _save_checkpoint(self) -> bool:
+        if not self.checkpoint_table:
+            return True
+        with get_db_connection(self.master_sede) as db:
+            saved = db.execute_update(
+                f"INSERT INTO {self.checkpoint_table} (nombre, gtid_set, transacciones, esclavos_atrasados) "
+                f"VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE gtid_set = VALUES(gtid_set), "
+                f"transacciones = VALUES(transacciones), esclavos_atrasados = VALUES(esclavos_atrasados)",
+                (CHECKPOINT_NAME, format_gtid_set(self.position), self.stats['transacciones'],
+                 format_lagging(self.lagging))) if db else None
+        if saved is None:
+            # La posición sigue en memoria; si el proceso se reinicia antes del próximo
+            # guardado se repiten cambios ya aplicados, lo que es idempotente
+            logger.warning("No se pudo guardar el punto de control de CDC en Central")
+            return False
+        self._saved_at = time.monotonic()
+        return True
+
+    def wait_for_checkpoint(self) -> Optional[str]:
+        """load_checkpoint reintentado mientras Central no responda; None si se detiene antes."""
+        while not self._stop.is_set():
+            try:
+                return self.load_checkpoint()
+            except RuntimeError as e:
+                logger.error(f"{e}; reintento en {self.retry_max}s")
+                self._stop.wait(self.retry_max)
+        return None
+
+    def run_binlog(self, server_id: int, gtid_set: str):
+        self.run(BinlogReader(gtid_set, server_id, self._stop, self.retry_initial))
+
+    def run(self, source):
+        """Consume las transacciones de source hasta agotarlas (fixture) o hasta stop()."""
+        reader = threading.Thread(target=self._read_loop, args=(source,), name='cdc-reader', daemon=True)
+        reader.start()
+        pending, pending_changes, first_at = [], 0, None
+        while not self._stop.is_set():
+            timeout = self.flush_interval if first_at is None else max(0, first_at + self.flush_interval - time.monotonic())
+            try:
+                transaction = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                transaction = False
+            if transaction:
+                pending.append(transaction)
+                pending_changes += len(transaction[1])
+                first_at = first_at or time.monotonic()
+            finished = transaction is None
+            if pending and (finished or transaction is False or pending_changes >= self.batch_size):
+                if not self._flush(pending):
+                    break
+                pending, pending_changes, first_at = [], 0, None
+            if finished:
+                break
+        self._executor.shutdown(wait=False)
+        logger.info(f"CDC detenido: {self.stats['transacciones']} transacciones, {self.stats['cambios']} cambios, "
+                    f"{self.stats['errores']} con error")
+
+    def _read_loop(self, source):
+        try:
+            for transaction in source:
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(transaction, timeout=self.flush_interval)
+                        break
+                    except queue.Full:
+                        logger.debug("Cola de CDC llena: se frena la lectura del binlog")
+                if self._stop.is_set():
+                    return
+        except Exception as e:
+            logger.error(f"Error leyendo cambios: {e}")
+        self._queue.put(None)
+
+    def _flush(self, transactions: List[Transaction]) -> bool:
+        entries = []
+        for gtid, changes in transactions:
+            uuid, number = _gtid_parts(gtid)
+            if number <= self.position.get(uuid, 0):
+                continue
+            entries.extend(changes)
+        entries = [{**change, 'id': index} for index, change in enumerate(entries)]
+
+        lagging = dict(self.lagging)
+        # Sin cambios el lote vacío solo prueba si los esclavos atrasados volvieron
+        if (entries or self.lagging) and not self._apply(entries):
+            return False
+        for gtid, _ in transactions:
+            uuid, number = _gtid_parts(gtid)
+            self.position[uuid] = max(number, self.position.get(uuid, 0))
+        self.stats['transacciones'] += len(transactions)
+        self.stats['cambios'] += len(entries)
+        self.stats['lotes'] += 1
+        # Guardar el punto de control es a su vez una transacción del binlog: solo
+        # se guarda si el lote trajo cambios o cada checkpoint_interval, para que
+        # ese guardado no provoque otro en cuanto vuelve a leerse
+        if entries or lagging != self.lagging or time.monotonic() - self._saved_at >= self.checkpoint_interval:
+            self._save_checkpoint()
+        return True
+
+    def _apply(self, entries: List[Dict[str, Any]]) -> bool:
+        """Aplica el lote en todos los esclavos; False si el CDC se detuvo antes de terminar."""
+        if self.dry_run:
+            statements, invalid = build_statements(entries)
+            for query, params, _ in statements:
+                logger.info(f"[simulación] {query[:120]} -- {len(params)} parámetros")
+            self.stats['errores'] += len(invalid)
+            return True
+        futures = {sede: self._executor.submit(self._apply_with_retry, sede, entries,
+                                               0 if sede in self.lagging else self.max_retries)
+                   for sede in (self.slave_sedes if entries else sorted(self.lagging))}
+        results = {sede: future.result() for sede, future in futures.items()}
+        if self._stop.is_set():
+            return False
+        for sede, failed in results.items():
+            if failed is None:
+                if sede not in self.lagging:
+                    logger.error(f"CDC: {sede} no responde tras {self.max_retries} reintentos; "
+                                 f"se sigue con los demás esclavos y se pondrá al día al volver")
+                    self.lagging[sede] = time.time()
+                continue
+            if failed:
+                # El verificador de consistencia detecta y repara lo que quede distinto
+                logger.error(f"CDC: {len(failed)} cambios no se pudieron aplicar en {sede}")
+                self.stats['errores'] += len(failed)
+            if sede in self.lagging and self._catch_up(sede):
+                self.lagging.pop(sede, None)
+        return True
+
+    def _catch_up(self, sede: str) -> bool:
+        """
+        Copia a un esclavo que volvió los cambios que se perdió mientras estaba
+        atrasado. Corre entre lotes, así ningún cambio del binlog se aplica
+        en medio de la reparación.
+        """
+        verifier = ConsistencyVerifier(CONSISTENCY_CONFIG['chunk_size'], CONSISTENCY_CONFIG['fanout'],
+                                       CONSISTENCY_CONFIG['leaf_size'], self.master_sede, [sede])
+        report = verifier.verify()
+        repaired = verifier.repair(report)
+        if any(result['error'] for result in report['resultados']) or any(r['fallidas'] for r in repaired):
+            logger.warning(f"CDC: {sede} respondió pero no se pudo poner al día; se reintenta en el próximo lote")
+            return False
+        logger.info(f"CDC: {sede} puesto al día ({sum(r['reparadas'] for r in repaired)} filas reparadas)")
+        return True
+
+    def _apply_with_retry(self, sede: str, entries: List[Dict[str, Any]], retries: int) -> Optional[Set[int]]:
+        """Ids que fallaron por sus datos; None si el esclavo no respondió en retries reintentos o el CDC se detuvo."""
+        pool = get_connection_pool(sede)
+        breaker = get_circuit_breaker(sede)
+        delay = self.retry_initial
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            failed = apply_log_entries(sede, pool, breaker, entries)
+            record_operation('replicacion_cdc', sede, time.perf_counter() - start, error=failed is None)
+            if failed is not None:
+                return failed
+            if attempt == retries or self._stop.is_set():
+                break
+            logger.warning(f"CDC: esclavo {sede} no disponible, reintento en {delay:.1f}s")
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.retry_max)
+        return None
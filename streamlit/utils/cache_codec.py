@@ -0,0 +1,269 @@
+"""
+Serialización binaria de resultados para el cache de Redis
+"""
+import base64
+import json
+import logging
+import zlib
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+    logger.warning("Módulo msgpack no disponible. El cache usará JSON.")
+
+try:
+    import lz4.frame as lz4_frame
+    LZ4_AVAILABLE = True
+except ImportError:
+    lz4_frame = None
+    LZ4_AVAILABLE = False
+
+FORMAT_VERSION = 1
+
+# Cabecera de 3 bytes: versión, serializador y compresión
+SERIALIZER_CODES = {'msgpack': b'm', 'json': b'j'}
+COMPRESSION_CODES = {'none': b'n', 'zlib': b'z', 'lz4': b'l'}
+
+# Tipos extendidos de msgpack
+_EXT_DECIMAL = 1
+_EXT_DATETIME = 2
+_EXT_DATE = 3
+_EXT_TIME = 4
+_EXT_TIMEDELTA = 5
+
+# Marcas equivalentes en JSON: {"$d": "12.50"}
+_JSON_TAGS = {
+    '$d': Decimal,
+    '$dt': datetime.fromisoformat,
+    '$da': date.fromisoformat,
+    '$t': time.fromisoformat,
+    '$td': lambda micros: timedelta(microseconds=micros),
+    '$b': base64.b64decode
+}
+
+
+class CodecError(Exception):
+    pass
+
+
+def _timedelta_micros(value: timedelta) -> int:
+    return (value.days * 86400 + value.seconds) * 1_000_000 + value.microseconds
+
+
+def _msgpack_default(value):
+    if value is pd.NaT:
+        return None
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(value).encode('ascii'))
+    if isinstance(value, datetime):
+        return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode('ascii'))
+    if isinstance(value, date):
+        return msgpack.ExtType(_EXT_DATE, value.isoformat().encode('ascii'))
+    if isinstance(value, time):
+        return msgpack.ExtType(_EXT_TIME, value.isoformat().encode('ascii'))
+    if isinstance(value, timedelta):
+        return msgpack.ExtType(_EXT_TIMEDELTA, str(_timedelta_micros(value)).encode('ascii'))
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytearray):
+        return bytes(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    text = data.decode('ascii')
+    if code == _EXT_DECIMAL:
+        return Decimal(text)
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(text)
+    if code == _EXT_DATE:
+        return date.fromisoformat(text)
+    if code == _EXT_TIME:
+        return time.fromisoformat(text)
+    if code == _EXT_TIMEDELTA:
+        return timedelta(microseconds=int(text))
+    return msgpack.ExtType(code, data)
+
+
+def _json_default(value):
+    if value is pd.NaT:
+        return None
+    if isinstance(value, Decimal):
+        return {'$d': str(value)}
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$da': value.isoformat()}
+    if isinstance(value, time):
+        return {'$t': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {'$td': _timedelta_micros(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$b': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _json_object_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        decoder = _JSON_TAGS.get(tag)
+        if decoder is not None:
+            return decoder(value)
+    return obj
+
+
+def _encode_series(name, series: pd.Series) -> Dict[str, Any]:
+    dtype = series.dtype
+    # Columnas numéricas y de fechas sin zona horaria: buffer crudo de numpy
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufMm':
+        return {'n': name, 't': dtype.str, 'b': series.to_numpy().tobytes()}
+    return {'n': name, 't': str(dtype), 'v': series.tolist()}
+
+
+def _decode_series(spec: Dict[str, Any]):
+    if 'b' in spec:
+        return np.frombuffer(spec['b'], dtype=np.dtype(spec['t']))
+    if spec['t'] == 'object':
+        return pd.Series(spec['v'], dtype=object)
+    try:
+        return pd.Series(spec['v'], dtype=spec['t'])
+    except (TypeError, ValueError):
+        return pd.Series(spec['v'], dtype=object)
+
+
+def _encode_dataframe(df: pd.DataFrame) -> Dict[str, Any]:
+    wire = {'__df__': [_encode_series(name, df[name]) for name in df.columns], 'len': len(df)}
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        wire['index'] = _encode_series(df.index.name, df.index.to_series())
+    return wire
+
+
+def _decode_dataframe(wire: Dict[str, Any]) -> pd.DataFrame:
+    columns = wire['__df__']
+    data = {}
+    for spec in columns:
+        values = _decode_series(spec)
+        data[spec['n']] = values.to_numpy() if isinstance(values, pd.Series) else values
+    if 'index' in wire:
+        index = pd.Index(_decode_series(wire['index']), name=wire['index']['n'])
+    else:
+        index = pd.RangeIndex(wire['len'])
+    return pd.DataFrame(data, index=index)
+
+
+def _encode_rows(rows: List[Dict]) -> Dict[str, Any]:
+    # Las claves se guardan una sola vez; cada fila queda como lista de valores
+    columns = list(rows[0].keys())
+    return {'__rows__': columns, 'data': [[row.get(column) for column in columns] for row in rows]}
+
+
+def _is_row_list(value) -> bool:
+    return (isinstance(value, list) and value
+            and all(isinstance(row, dict) for row in value)
+            and all(row.keys() == value[0].keys() for row in value))
+
+
+def _to_wire(value):
+    if isinstance(value, pd.DataFrame):
+        return _encode_dataframe(value)
+    if _is_row_list(value):
+        return _encode_rows(value)
+    if isinstance(value, dict):
+        return {key: _to_wire(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_wire(item) for item in value]
+    return value
+
+
+def _from_wire(value):
+    if isinstance(value, dict):
+        if '__df__' in value:
+            return _decode_dataframe(value)
+        if '__rows__' in value:
+            columns = value['__rows__']
+            return [dict(zip(columns, row)) for row in value['data']]
+        return {key: _from_wire(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_from_wire(item) for item in value]
+    return value
+
+
+class CacheCodec:
+    """
+    Convierte resultados (listas de filas, DataFrames o estructuras que los
+    contengan) a bytes. Los DataFrames van por columnas y las filas sin repetir
+    las claves; por encima del umbral el contenido se comprime.
+    """
+
+    def __init__(self, serializer: str = 'msgpack', compression: str = 'zlib',
+                 compress_threshold: int = 1024, compression_level: int = 1):
+        if serializer == 'msgpack' and not MSGPACK_AVAILABLE:
+            serializer = 'json'
+        if compression == 'lz4' and not LZ4_AVAILABLE:
+            compression = 'zlib'
+        if serializer not in SERIALIZER_CODES:
+            raise ValueError(f"Serializador desconocido: {serializer}")
+        if compression not in COMPRESSION_CODES:
+            raise ValueError(f"Compresión desconocida: {compression}")
+
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.compression_level = compression_level
+
+    def _serialize(self, wire) -> bytes:
+        if self.serializer == 'msgpack':
+            return msgpack.packb(wire, default=_msgpack_default, use_bin_type=True)
+        return json.dumps(wire, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+    def encode(self, value) -> bytes:
+        payload = self._serialize(_to_wire(value))
+
+        compression = 'none'
+        if self.compression != 'none' and len(payload) >= self.compress_threshold:
+            if self.compression == 'lz4':
+                payload = lz4_frame.compress(payload)
+            else:
+                payload = zlib.compress(payload, self.compression_level)
+            compression = self.compression
+
+        header = bytes([FORMAT_VERSION]) + SERIALIZER_CODES[self.serializer] + COMPRESSION_CODES[compression]
+        return header + payload
+
+    def decode(self, data: bytes):
+        """La cabecera indica cómo se codificó, no la configuración actual."""
+        if len(data) < 3 or data[0] != FORMAT_VERSION:
+            raise CodecError("Formato de cache desconocido")
+        serializer, compression, payload = data[1:2], data[2:3], data[3:]
+
+        if compression == COMPRESSION_CODES['zlib']:
+            payload = zlib.decompress(payload)
+        elif compression == COMPRESSION_CODES['lz4']:
+            if not LZ4_AVAILABLE:
+                raise CodecError("Entrada comprimida con lz4 y el módulo no está disponible")
+            payload = lz4_frame.decompress(payload)
+        elif compression != COMPRESSION_CODES['none']:
+            raise CodecError("Compresión desconocida en la entrada")
+
+        if serializer == SERIALIZER_CODES['msgpack']:
+            if not MSGPACK_AVAILABLE:
+                raise CodecError("Entrada en msgpack y el módulo no está disponible")
+            wire = msgpack.unpackb(payload, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+        elif serializer == SERIALIZER_CODES['json']:
+            wire = json.loads(payload, object_hook=_json_object_hook)
+        else:
+            raise CodecError("Serializador desconocido en la entrada")
+
+        return _from_wire(wire)
@@ -0,0 +1,117 @@
+"""
+Circuit breaker por sede
+"""
+import threading
+import logging
+import time
+from typing import Callable, Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'cerrado'
+OPEN = 'abierto'
+HALF_OPEN = 'semiabierto'
+
+
+class CircuitBreaker:
+    """
+    Tras failure_threshold fallos seguidos el circuito se abre y las llamadas
+    fallan de inmediato. Mientras está abierto un hilo de fondo prueba el nodo
+    cada probe_interval segundos; la primera prueba exitosa lo vuelve a cerrar.
+    """
+
+    def __init__(self, name: str, probe: Callable[[], bool], failure_threshold: int = 3,
+                 probe_interval: float = 5):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = probe_interval
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._changed_at = time.time()
+        self._last_error = None
+        self._rejected = 0
+        self._probe_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                logger.info(f"Circuito de {self.name} cerrado: el nodo responde")
+                self._set_state(CLOSED)
+
+    def record_failure(self, error: Optional[str] = None):
+        with self._lock:
+            self._failures += 1
+            self._last_error = error
+            must_open = self._state == CLOSED and self._failures >= self.failure_threshold
+            if must_open:
+                logger.warning(f"Circuito de {self.name} abierto tras {self._failures} fallos: {error}")
+                self._set_state(OPEN)
+                self._opened_at = time.time()
+        if must_open:
+            self._start_probe()
+
+    def trip(self, error: Optional[str] = None):
+        """Abre el circuito sin esperar más fallos (p. ej. lo decide el monitor de salud)."""
+        with self._lock:
+            self._failures = max(self._failures, self.failure_threshold)
+        self.record_failure(error)
+
+    def _set_state(self, state: str):
+        self._state = state
+        self._changed_at = time.time()
+
+    def _start_probe(self):
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, name=f'breaker-{self.name}', daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self._state == CLOSED:
+                    return
+                self._set_state(HALF_OPEN)
+            try:
+                healthy = self.probe()
+            except Exception as e:
+                healthy = False
+                logger.debug(f"Prueba de {self.name} fallida: {e}")
+
+            if healthy:
+                self.record_success()
+                return
+            with self._lock:
+                self._set_state(OPEN)
+                self._opened_at = time.time()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self._state,
+                'failures': self._failures,
+                'rejected': self._rejected,
+                'opened_at': self._opened_at,
+                'changed_at': self._changed_at,
+                'last_error': self._last_error
+            }
@@ -0,0 +1,197 @@
+"""
+Pool de conexiones MySQL por sede
+"""
+import mysql.connector
+from mysql.connector.errors import PoolError
+from typing import Dict, Any, Tuple
+from collections import deque
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Pool de conexiones reutilizables con validación al préstamo y métricas."""
+
+    def __init__(self, name: str, connect_args: Dict[str, Any], max_size: int,
+                 checkout_timeout: float = 10, validation_interval: float = 30,
+                 max_idle_time: float = 300):
+        self.name = name
+        self.connect_args = connect_args
+        self.max_size = max(1, int(max_size))
+        self.checkout_timeout = checkout_timeout
+        self.validation_interval = validation_interval
+        self.max_idle_time = max_idle_time
+
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._created = 0
+        self._in_use = 0
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'validation_failures': 0,
+            'checkout_time_total': 0.0,
+            'checkout_time_max': 0.0
+        }
+
+    def _create_connection(self):
+        connection = mysql.connector.connect(**self.connect_args)
+        with self._lock:
+            self._stats['connections_created'] += 1
+        logger.info(f"Nueva conexión creada en pool {self.name}")
+        return connection
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_valid(self, connection) -> bool:
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def checkout(self):
+        return self.checkout_verified()[0]
+
+    def checkout_verified(self) -> Tuple[Any, bool]:
+        """
+        Como checkout, pero indica además si el préstamo habló con el servidor:
+        conexión nueva o validada con ping. Una ociosa hace menos de
+        validation_interval se entrega sin tocar la red.
+        """
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+
+        while True:
+            connection = None
+            idle_since = None
+            must_create = False
+
+            with self._available:
+                while True:
+                    if self._idle:
+                        connection, idle_since = self._idle.pop()
+                        break
+                    if self._created < self.max_size:
+                        self._created += 1
+                        must_create = True
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolError(f"Pool {self.name} agotado: {self.max_size} conexiones en uso")
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._available.wait(remaining)
+
+            verified = must_create
+            if must_create:
+                try:
+                    connection = self._create_connection()
+                except Exception:
+                    with self._available:
+                        self._created -= 1
+                        self._available.notify()
+                    raise
+            else:
+                idle = time.monotonic() - idle_since
+                verified = idle >= self.validation_interval
+                if idle > self.max_idle_time or (verified and not self._is_valid(connection)):
+                    self._close_quietly(connection)
+                    with self._available:
+                        self._created -= 1
+                        self._stats['validation_failures'] += 1
+                        self._stats['connections_discarded'] += 1
+                        self._available.notify()
+                    continue
+
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._in_use += 1
+                self._stats['checkouts'] += 1
+                self._stats['checkout_time_total'] += elapsed
+                self._stats['checkout_time_max'] = max(self._stats['checkout_time_max'], elapsed)
+            return connection, verified
+
+    def checkin(self, connection, discard: bool = False):
+        if connection is None:
+            return
+
+        if not discard:
+            try:
+                if connection.in_transaction:
+                    connection.rollback()
+            except Exception as e:
+                logger.warning(f"Conexión descartada del pool {self.name}: {e}")
+                discard = True
+
+        with self._available:
+            self._in_use -= 1
+            if discard:
+                self._created -= 1
+                self._stats['connections_discarded'] += 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._available.notify()
+
+        if discard:
+            self._close_quietly(connection)
+
+    def close_all(self):
+        with self._available:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._created -= len(idle)
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            checkouts = self._stats['checkouts']
+            return {
+                'pool': self.name,
+                'max_size': self.max_size,
+                'size': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'utilization': self._in_use / self.max_size,
+                'checkouts': checkouts,
+                'waits': self._stats['waits'],
+                'timeouts': self._stats['timeouts'],
+                'connections_created': self._stats['connections_created'],
+                'connections_discarded': self._stats['connections_discarded'],
+                'validation_failures': self._stats['validation_failures'],
+                'checkout_avg_ms': (self._stats['checkout_time_total'] / checkouts * 1000) if checkouts else 0.0,
+                'checkout_max_ms': self._stats['checkout_time_max'] * 1000
+            }
+
+
+def build_connect_args(config: Dict[str, Any], connection_timeout: int) -> Dict[str, Any]:
+    return {
+        'host': config['host'],
+        'port': config['port'],
+        'user': config['user'],
+        'password': config['password'],
+        'database': config['database'],
+        'connection_timeout': connection_timeout
+    }
+
+
+def pool_size_for(config: Dict[str, Any], share: float, default_max_connections: int = 100) -> int:
+    return max(1, int(config.get('max_connections', default_max_connections) * share))
+
@@ -0,0 +1,204 @@
+"""
+Verificación de consistencia master/esclavos por checksums de tramos de clave
+"""
+import logging
+import math
+import time
+from typing import Optional, Dict, Any, List, Tuple
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CONSISTENCY_CONFIG, REPLICATION_CONFIG
+from utils.async_db import run_distributed_queries
+from utils.db_connections import get_connection_pool, get_circuit_breaker
+from utils.outbox import apply_log_entries
+from utils.replication import MASTER_COLUMNS, BATCH_CHUNK_SIZE, master_row_checksum_sql
+
+logger = logging.getLogger(__name__)
+
+# Las claves son INT: el primer nivel cubre todo el rango positivo
+_MAX_KEY = 2147483647
+
+
+def chunk_checksum_sql(table: str) -> str:
+    """Conteo y checksum por subtramo de ancho fijo dentro de [inicio, fin]; solo devuelve subtramos con filas."""
+    key = MASTER_COLUMNS[table][0]
+    return (f"SELECT ({key} - %s) DIV %s AS tramo, COUNT(*) AS filas, "
+            f"COALESCE(BIT_XOR({master_row_checksum_sql(table)}), 0) AS checksum "
+            f"FROM {table} WHERE {key} BETWEEN %s AND %s GROUP BY tramo")
+
+
+def row_checksum_sql(table: str) -> str:
+    key = MASTER_COLUMNS[table][0]
+    return (f"SELECT {key} AS clave, {master_row_checksum_sql(table)} AS checksum "
+            f"FROM {table} WHERE {key} BETWEEN %s AND %s")
+
+
+class ConsistencyVerifier:
+    """
+    Compara master y esclavos sin traer las tablas: primero un checksum por
+    tramo de chunk_size claves (una consulta por tabla y nodo), luego solo los
+    tramos distintos se dividen en fanout subtramos, y así hasta leaf_size
+    claves, donde se comparan los CRC32 fila por fila. Todas las consultas de
+    un nivel van en paralelo a los nodos. El resultado es el conjunto mínimo
+    de filas a copiar desde master y de claves a borrar en cada esclavo.
+    """
+
+    def __init__(self, chunk_size: int, fanout: int, leaf_size: int, master_sede: str, slave_sedes: List[str]):
+        self.chunk_size = chunk_size
+        self.fanout = fanout
+        self.leaf_size = leaf_size
+        self.master_sede = master_sede
+        self.slave_sedes = list(slave_sedes)
+        self.queries = 0
+
+    @classmethod
+    def from_config(cls) -> 'ConsistencyVerifier':
+        return cls(CONSISTENCY_CONFIG['chunk_size'], CONSISTENCY_CONFIG['fanout'], CONSISTENCY_CONFIG['leaf_size'],
+                   REPLICATION_CONFIG['master_sede'], REPLICATION_CONFIG['slave_sedes'])
+
+    def _run(self, statements: Dict[Tuple, Tuple[str, str, Tuple]]) -> Dict[Tuple, Optional[List[Dict]]]:
+        self.queries += len(statements)
+        outcomes = run_distributed_queries(statements)
+        for key, outcome in outcomes.items():
+            if outcome['rows'] is None:
+                logger.warning(f"Verificación: sin respuesta de {outcome['sede']}: {outcome['error']}")
+        return {key: outcome['rows'] for key, outcome in outcomes.items()}
+
+    def verify(self, tables: Optional[List[str]] = None) -> Dict[str, Any]:
+        start = time.perf_counter()
+        self.queries = 0
+        tables = tables or REPLICATION_CONFIG['replicated_tables']
+        results = {(table, sede): {'tabla': table, 'sede': sede, 'tramos': 0, 'tramos_distintos': 0,
+                                   'upsert': [], 'delete': [], 'error': None}
+                   for table in tables for sede in self.slave_sedes}
+
+        # (tabla, esclavo, inicio, fin, ancho de subtramo, nivel)
+        pending = [(table, sede, 0, _MAX_KEY, self.chunk_size, 0) for table in tables for sede in self.slave_sedes]
+        leaves = []
+        while pending:
+            statements = {}
+            for table, sede, low, high, width, _ in pending:
+                for node in (self.master_sede, sede):
+                    statements[(table, node, low, high)] = (node, chunk_checksum_sql(table), (low, width, low, high))
+            rows = self._run(statements)
+
+            next_pending = []
+            for table, sede, low, high, width, level in pending:
+                result = results[(table, sede)]
+                master_rows, slave_rows = rows[(table, self.master_sede, low, high)], rows[(table, sede, low, high)]
+                if master_rows is None or slave_rows is None:
+                    result['error'] = f"sin respuesta de {self.master_sede if master_rows is None else sede}"
+                    continue
+                master_chunks = {int(row['tramo']): (int(row['filas']), int(row['checksum'])) for row in master_rows}
+                slave_chunks = {int(row['tramo']): (int(row['filas']), int(row['checksum'])) for row in slave_rows}
+                differing = sorted(chunk for chunk in set(master_chunks) | set(slave_chunks)
+                                   if master_chunks.get(chunk) != slave_chunks.get(chunk))
+                if level == 0:
+                    result['tramos'] = len(set(master_chunks) | set(slave_chunks))
+                    result['tramos_distintos'] = len(differing)
+                for chunk in differing:
+                    chunk_low = low + chunk * width
+                    chunk_high = min(high, chunk_low + width - 1)
+                    if width <= self.leaf_size:
+                        leaves.append((table, sede, chunk_low, chunk_high))
+                    else:
+                        next_pending.append((table, sede, chunk_low, chunk_high,
+                                             math.ceil(width / self.fanout), level + 1))
+            pending = next_pending
+
+        self._compare_rows(leaves, results)
+        self._fetch_master_rows(results)
+
+        outcome = {
+            'resultados': list(results.values()),
+            'consistente': all(not r['upsert'] and not r['delete'] and not r['error'] for r in results.values()),
+            'consultas': self.queries,
+            'segundos': time.perf_counter() - start
+        }
+        logger.info(f"Verificación de consistencia: {outcome['consultas']} consultas en {outcome['segundos']:.2f}s, "
+                    f"{'consistente' if outcome['consistente'] else 'con diferencias'}")
+        return outcome
+
+    def _compare_rows(self, leaves: List[Tuple[str, str, int, int]], results: Dict[Tuple[str, str], Dict]):
+        if not leaves:
+            return
+        statements = {}
+        for table, sede, low, high in leaves:
+            for node in (self.master_sede, sede):
+                statements[(table, node, low, high)] = (node, row_checksum_sql(table), (low, high))
+        rows = self._run(statements)
+
+        for table, sede, low, high in leaves:
+            result = results[(table, sede)]
+            master_rows, slave_rows = rows[(table, self.master_sede, low, high)], rows[(table, sede, low, high)]
+            if master_rows is None or slave_rows is None:
+                result['error'] = f"sin respuesta de {self.master_sede if master_rows is None else sede}"
+                continue
+            master_sums = {row['clave']: int(row['checksum']) for row in master_rows}
+            slave_sums = {row['clave']: int(row['checksum']) for row in slave_rows}
+            result['upsert'].extend(key for key, checksum in master_sums.items() if slave_sums.get(key) != checksum)
+            result['delete'].extend(key for key in slave_sums if key not in master_sums)
+
+    def _fetch_master_rows(self, results: Dict[Tuple[str, str], Dict]):
+        """Reemplaza las claves a copiar por las filas completas de master (un IN por tabla y lote)."""
+        keys_by_table = {}
+        for (table, _), result in results.items():
+            keys_by_table.setdefault(table, set()).update(result['upsert'])
+        statements = {}
+        for table, keys in keys_by_table.items():
+            columns = MASTER_COLUMNS[table]
+            keys = sorted(keys)
+            for index, start in enumerate(range(0, len(keys), BATCH_CHUNK_SIZE)):
+                chunk = keys[start:start + BATCH_CHUNK_SIZE]
+                statements[(table, index)] = (self.master_sede, f"SELECT {', '.join(columns)} FROM {table} "
+                                              f"WHERE {columns[0]} IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+        if not statements:
+            return
+        rows = self._run(statements)
+
+        master_rows = {}
+        for (table, _), chunk_rows in rows.items():
+            for row in chunk_rows or []:
+                master_rows[(table, row[MASTER_COLUMNS[table][0]])] = row
+        for (table, _), result in results.items():
+            missing = [key for key in result['upsert'] if (table, key) not in master_rows]
+            if missing:
+                result['error'] = f"no se leyeron {len(missing)} filas de {self.master_sede}"
+            result['upsert'] = [master_rows[(table, key)] for key in result['upsert'] if (table, key) in master_rows]
+
+    def repair(self, report: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Aplica el conjunto de reparación en cada esclavo: primero los borrados
+        (liberan emails únicos) y luego los upserts, en una transacción por tabla y sede.
+        """
+        repaired = []
+        for result in report['resultados']:
+            table, sede = result['tabla'], result['sede']
+            key_column = MASTER_COLUMNS[table][0]
+            entries = [{'tabla_afectada': table, 'operacion': 'DELETE', 'registro_id': key, 'datos_nuevos': None}
+                       for key in result['delete']]
+            entries += [{'tabla_afectada': table, 'operacion': 'UPDATE', 'registro_id': row[key_column],
+                         'datos_nuevos': {'fila': row}} for row in result['upsert']]
+            if not entries:
+                continue
+            entries = [{**entry, 'id': index} for index, entry in enumerate(entries)]
+            failed = apply_log_entries(sede, get_connection_pool(sede), get_circuit_breaker(sede), entries)
+            repaired.append({
+                'tabla': table,
+                'sede': sede,
+                'reparadas': 0 if failed is None else len(entries) - len(failed),
+                'fallidas': len(entries) if failed is None else len(failed),
+                'error': 'sin conexión' if failed is None else None
+            })
+            logger.info(f"Reparación de {table} en {sede}: {repaired[-1]['reparadas']} de {len(entries)} cambios")
+        return repaired
+
+
+def verify_replication_consistency(tables: Optional[List[str]] = None) -> Dict[str, Any]:
+    return ConsistencyVerifier.from_config().verify(tables)
+
+
+def repair_replication(report: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return ConsistencyVerifier.from_config().repair(report)
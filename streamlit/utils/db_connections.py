@@ -3,59 +3,101 @@ Módulo de gestión de conexiones a bases de datos
 """
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import OperationalError, InterfaceError, PoolError
 import pandas as pd
 import streamlit as st
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Iterator
 import time
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import logging
 from datetime import datetime, date, timedelta
 import time 
 import json
+import functools
+import re
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DB_CONFIG, TIMEOUT_CONFIG, MESSAGES, REDIS_CONFIG, REDIS_ENABLED
+from config import (DB_CONFIG, TIMEOUT_CONFIG, MESSAGES, REDIS_CONFIG, REDIS_ENABLED,
+                    POOL_CONFIG, REPLICATION_USER_CONFIG, FANOUT_CONFIG, CIRCUIT_BREAKER_CONFIG)
+from utils.connection_pool import ConnectionPool, build_connect_args, pool_size_for
+from utils.circuit_breaker import CircuitBreaker, CLOSED
+from utils.metrics import record_query, record_connect, record_operation
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _notify_error(message: str):
+    # Los hilos del fan-out no tienen contexto de script: solo se registra en el log
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.error(message)
+
 class DatabaseConnection:
     
-    def __init__(self, sede: str):
+    def __init__(self, sede: str, pool: Optional[ConnectionPool] = None,
+                 breaker: Optional[CircuitBreaker] = None):
         self.sede = sede
         self.config = DB_CONFIG.get(sede)
         if not self.config:
             raise ValueError(f"Sede '{sede}' no encontrada en la configuración")
         
+        self.pool = pool
+        self.breaker = breaker
         self.connection = None
         self.cursor = None
+        self.last_error = None
+        self.last_insert_id = None
+        self.last_commit_latency = None
+        self._broken = False
+        self._transaction_depth = 0
+        self._written_tables = set()
         
     def connect(self) -> bool:
         for attempt in range(TIMEOUT_CONFIG['retry_attempts']):
+            if self.breaker and not self.breaker.allow_request():
+                # Sede caída: se falla de inmediato en vez de esperar los reintentos
+                self.last_error = MESSAGES['circuit_open'].format(sede=self.config['name'])
+                logger.debug(self.last_error)
+                return False
+            
+            connect_start = time.perf_counter()
             try:
-                self.connection = mysql.connector.connect(
-                    host=self.config['host'],
-                    port=self.config['port'],
-                    user=self.config['user'],
-                    password=self.config['password'],
-                    database=self.config['database'],
-                    connection_timeout=TIMEOUT_CONFIG['connection_timeout']
-                )
+                verified = True
+                if self.pool:
+                    self.connection, verified = self.pool.checkout_verified()
+                else:
+                    self.connection = mysql.connector.connect(
+                        **build_connect_args(self.config, TIMEOUT_CONFIG['connection_timeout'])
+                    )
                 
-                if self.connection.is_connected():
+                if self.pool or self.connection.is_connected():
+                    record_connect('mysql', self.sede, time.perf_counter() - connect_start)
+                    self._broken = False
                     self.cursor = self.connection.cursor(dictionary=True)
-                    logger.info(f"Conexión exitosa a {self.config['name']}")
+                    # Una conexión del pool entregada sin ping no prueba que el nodo
+                    # responda: el éxito se anota al completar la primera consulta
+                    if verified:
+                        self._record_success()
+                    logger.debug(f"Conexión obtenida para {self.config['name']}")
                     return True
                     
             except Error as e:
+                record_connect('mysql', self.sede, time.perf_counter() - connect_start, error=True)
                 logger.warning(f"Intento {attempt + 1} fallido para {self.sede}: {e}")
+                # Pool agotado no significa que el nodo esté caído
+                if self.breaker and not isinstance(e, PoolError):
+                    self.breaker.record_failure(str(e))
                 if attempt < TIMEOUT_CONFIG['retry_attempts'] - 1:
                     time.sleep(TIMEOUT_CONFIG['retry_delay'])
                 else:
                     logger.error(f"No se pudo conectar a {self.sede} después de {TIMEOUT_CONFIG['retry_attempts']} intentos")
-                    st.error(MESSAGES['connection_error'].format(sede=self.config['name'], error=str(e)))
+                    self.last_error = str(e)
+                    _notify_error(MESSAGES['connection_error'].format(sede=self.config['name'], error=str(e)))
         
         return False
     
@@ -63,50 +105,343 @@ class DatabaseConnection:
         try:
             if self.cursor:
                 self.cursor.close()
-            if self.connection and self.connection.is_connected():
+        except Error as e:
+            logger.error(f"Error al cerrar cursor de {self.sede}: {e}")
+            self._broken = True
+        finally:
+            self.cursor = None
+        
+        try:
+            if self.pool:
+                self.pool.checkin(self.connection, discard=self._broken)
+            elif self.connection and self.connection.is_connected():
                 self.connection.close()
                 logger.info(f"Desconexión exitosa de {self.config['name']}")
         except Error as e:
             logger.error(f"Error al desconectar de {self.sede}: {e}")
+        finally:
+            self.connection = None
+    
+    def _ensure_connection(self) -> bool:
+        # Las conexiones del pool se validan al préstamo, no hace falta un ping por consulta
+        if self.connection and (self.pool or self.connection.is_connected()):
+            return True
+        if self.connection:
+            self.disconnect()
+        return self.connect()
+    
+    def _record_success(self):
+        if self.breaker:
+            self.breaker.record_success()
+    
+    def _mark_if_broken(self, error: Error):
+        if isinstance(error, (OperationalError, InterfaceError)):
+            self._broken = True
+            if self.breaker:
+                self.breaker.record_failure(str(error))
+    
+    def _track_write(self, query: str):
+        from utils.query_cache import extract_written_table
+        table = extract_written_table(query)
+        if table:
+            self._written_tables.add(table)
+    
+    def _flush_invalidations(self):
+        if not self._written_tables:
+            return
+        from utils.query_cache import invalidate_tables
+        tables, self._written_tables = self._written_tables, set()
+        invalidate_tables(self.sede, tables)
+    
+    def _commit(self):
+        # Dentro de transaction() el commit se hace una sola vez al cerrar el bloque
+        if self._transaction_depth:
+            return
+        start = time.perf_counter()
+        self.connection.commit()
+        self.last_commit_latency = time.perf_counter() - start
+        self._flush_invalidations()
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa varias sentencias en un único commit. Un bloque anidado crea un
+        SAVEPOINT que se revierte por separado si falla.
+        """
+        if self._transaction_depth:
+            savepoint = f"sp_{self._transaction_depth}"
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+            self._transaction_depth += 1
+            try:
+                yield self
+            except Exception:
+                self._transaction_depth -= 1
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                raise
+            else:
+                self._transaction_depth -= 1
+                self.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+            return
+        
+        if not self._ensure_connection():
+            raise InterfaceError(f"Sin conexión a {self.sede}: {self.last_error}")
+        
+        if self.connection.in_transaction:
+            # Cierra la transacción implícita abierta por lecturas previas
+            self.connection.commit()
+        self.connection.start_transaction()
+        self._transaction_depth = 1
+        try:
+            yield self
+        except Exception as e:
+            self._transaction_depth = 0
+            self._written_tables.clear()
+            logger.error(f"Transacción revertida en {self.sede}: {e}")
+            try:
+                self.connection.rollback()
+            except Error:
+                self._broken = True
+            raise
+        
+        self._transaction_depth = 0
+        start = time.perf_counter()
+        try:
+            self.connection.commit()
+        except Error as e:
+            logger.error(f"Error en commit de {self.sede}: {e}")
+            self._written_tables.clear()
+            self.last_error = str(e)
+            self._mark_if_broken(e)
+            try:
+                self.connection.rollback()
+            except Error:
+                self._broken = True
+            raise
+        self.last_commit_latency = time.perf_counter() - start
+        self._flush_invalidations()
+        logger.info(f"Transacción confirmada en {self.sede} ({self.last_commit_latency * 1000:.1f} ms de commit)")
     
     def execute_query(self, query: str, params: Optional[Tuple] = None) -> Optional[List[Dict]]:
+        start = None
         try:
-            if not self.connection or not self.connection.is_connected():
-                if not self.connect():
-                    return None
+            if not self._ensure_connection():
+                return None
             
             logger.debug(f"Ejecutando consulta en {self.sede}: {query[:100]}...")
             
+            start = time.perf_counter()
             self.cursor.execute(query, params)
+            executed = time.perf_counter()
             results = self.cursor.fetchall()
+            record_query('mysql', self.sede, query, executed - start, time.perf_counter() - executed, len(results))
+            self._record_success()
             
             logger.info(f"Consulta exitosa en {self.sede}: {len(results)} registros")
             return results
             
         except Error as e:
+            if start is not None:
+                record_query('mysql', self.sede, query, time.perf_counter() - start, error=True)
             logger.error(f"Error en consulta {self.sede}: {e}")
-            st.error(MESSAGES['query_error'].format(error=str(e)))
+            self.last_error = str(e)
+            self._mark_if_broken(e)
+            if self._transaction_depth:
+                raise
+            _notify_error(MESSAGES['query_error'].format(error=str(e)))
             return None
     
     def execute_update(self, query: str, params: Optional[Tuple] = None) -> Optional[int]:
+        start = None
         try:
-            if not self.connection or not self.connection.is_connected():
-                if not self.connect():
-                    return None
+            if not self._ensure_connection():
+                return None
             
+            start = time.perf_counter()
             self.cursor.execute(query, params)
-            self.connection.commit()
+            self.last_insert_id = self.cursor.lastrowid
+            self._track_write(query)
+            self._commit()
             
             affected_rows = self.cursor.rowcount
+            record_query('mysql', self.sede, query, time.perf_counter() - start, rows=affected_rows)
+            self._record_success()
             logger.info(f"Update exitoso en {self.sede}: {affected_rows} filas afectadas")
             return affected_rows
             
         except Error as e:
+            if start is not None:
+                record_query('mysql', self.sede, query, time.perf_counter() - start, error=True)
             logger.error(f"Error en update {self.sede}: {e}")
-            self.connection.rollback()
-            st.error(MESSAGES['query_error'].format(error=str(e)))
+            self.last_error = str(e)
+            self._mark_if_broken(e)
+            if self._transaction_depth:
+                raise
+            self._written_tables.clear()
+            try:
+                self.connection.rollback()
+            except Error:
+                self._broken = True
+            _notify_error(MESSAGES['query_error'].format(error=str(e)))
+            return None
+    
+    def execute_many(self, query: str, seq_params: List[Tuple], chunk_size: int = 500) -> Optional[int]:
+        total = 0
+        try:
+            if not self._ensure_connection():
+                return None
+            
+            for start in range(0, len(seq_params), chunk_size):
+                chunk = seq_params[start:start + chunk_size]
+                chunk_start = time.perf_counter()
+                # executemany reescribe los INSERT simples como un único INSERT multi-fila
+                self.cursor.executemany(query, chunk)
+                self._track_write(query)
+                self._commit()
+                total += self.cursor.rowcount
+                record_query('mysql', self.sede, query, time.perf_counter() - chunk_start, rows=self.cursor.rowcount)
+                self._record_success()
+            
+            logger.info(f"executemany exitoso en {self.sede}: {total} filas afectadas")
+            return total
+            
+        except Error as e:
+            logger.error(f"Error en executemany {self.sede} tras {total} filas: {e}")
+            self.last_error = str(e)
+            self._mark_if_broken(e)
+            if self._transaction_depth:
+                raise
+            self._written_tables.clear()
+            try:
+                self.connection.rollback()
+            except Error:
+                self._broken = True
+            _notify_error(MESSAGES['query_error'].format(error=str(e)))
             return None
     
+    def bulk_insert(self, table: str, rows: List[Dict[str, Any]], chunk_size: int = 500,
+                    id_column: Optional[str] = None) -> Optional[List[int]]:
+        """
+        Inserta las filas con INSERT multi-fila, un commit por bloque. Devuelve los
+        ids generados (AUTO_INCREMENT asigna un rango consecutivo por INSERT simple)
+        o, si las filas ya traen id_column, esos mismos ids.
+        """
+        if not rows:
+            return []
+        
+        columns = list(rows[0].keys())
+        # Rellenar con NULL las columnas que falten pisaría los DEFAULT de la tabla
+        for index, row in enumerate(rows):
+            if row.keys() != rows[0].keys():
+                raise ValueError(f"La fila {index} no tiene las mismas columnas que la primera: "
+                                 f"{sorted(row.keys())} frente a {sorted(columns)}")
+        for identifier in [table] + columns:
+            if not _IDENTIFIER_RE.match(identifier):
+                raise ValueError(f"Identificador SQL no válido: {identifier}")
+        
+        column_list = ', '.join(f"`{column}`" for column in columns)
+        row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        
+        ids = []
+        try:
+            if not self._ensure_connection():
+                return None
+            
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                query = f"INSERT INTO `{table}` ({column_list}) VALUES " + ', '.join([row_placeholder] * len(chunk))
+                params = tuple(row[column] for row in chunk for column in columns)
+                
+                chunk_start = time.perf_counter()
+                self.cursor.execute(query, params)
+                self._written_tables.add(table.lower())
+                self._commit()
+                record_query('mysql', self.sede, query, time.perf_counter() - chunk_start, rows=len(chunk))
+                self._record_success()
+                
+                if id_column in columns:
+                    ids.extend(row[id_column] for row in chunk)
+                else:
+                    first_id = self.cursor.lastrowid
+                    if first_id:
+                        ids.extend(range(first_id, first_id + len(chunk)))
+            
+            logger.info(f"Inserción masiva en {self.sede}.{table}: {len(rows)} filas en "
+                        f"{(len(rows) + chunk_size - 1) // chunk_size} sentencias")
+            return ids
+            
+        except Error as e:
+            logger.error(f"Error en inserción masiva {self.sede}.{table} tras {len(ids)} filas: {e}")
+            self.last_error = str(e)
+            self._mark_if_broken(e)
+            if self._transaction_depth:
+                raise
+            self._written_tables.clear()
+            try:
+                self.connection.rollback()
+            except Error:
+                self._broken = True
+            _notify_error(MESSAGES['query_error'].format(error=str(e)))
+            return None
+    
+    def _iter_batches(self, query: str, params: Optional[Tuple], batch_size: int) -> Iterator[Tuple[List[str], List[Tuple]]]:
+        if not self._ensure_connection():
+            return
+        
+        cursor = None
+        exhausted = False
+        start = time.perf_counter()
+        execute_time = fetch_time = 0.0
+        total = 0
+        try:
+            # Cursor sin buffer: el servidor envía las filas a medida que se leen
+            cursor = self.connection.cursor(buffered=False)
+            cursor.execute(query, params)
+            execute_time = time.perf_counter() - start
+            columns = list(cursor.column_names)
+            
+            while True:
+                # Solo se mide la lectura: el tiempo del consumidor entre lotes no cuenta
+                fetch_start = time.perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                fetch_time += time.perf_counter() - fetch_start
+                if not rows:
+                    exhausted = True
+                    break
+                total += len(rows)
+                yield columns, rows
+            
+            record_query('mysql', self.sede, query, execute_time, fetch_time, total)
+            self._record_success()
+            logger.info(f"Lectura por lotes en {self.sede}: {total} registros")
+            
+        except Error as e:
+            record_query('mysql', self.sede, query, execute_time or time.perf_counter() - start, fetch_time,
+                         total, error=True)
+            logger.error(f"Error en lectura por lotes {self.sede}: {e}")
+            self.last_error = str(e)
+            self._mark_if_broken(e)
+            _notify_error(MESSAGES['query_error'].format(error=str(e)))
+        finally:
+            if cursor is not None:
+                try:
+                    if not exhausted and not self._broken:
+                        # El consumidor se detuvo antes: se descartan las filas restantes
+                        # por lotes para poder reutilizar la conexión
+                        while cursor.fetchmany(batch_size):
+                            pass
+                    cursor.close()
+                except Error:
+                    self._broken = True
+    
+    def iter_query(self, query: str, params: Optional[Tuple] = None, batch_size: int = 1000) -> Iterator[Dict]:
+        for columns, rows in self._iter_batches(query, params, batch_size):
+            for row in rows:
+                yield dict(zip(columns, row))
+    
+    def iter_dataframes(self, query: str, params: Optional[Tuple] = None, batch_size: int = 5000) -> Iterator[pd.DataFrame]:
+        for columns, rows in self._iter_batches(query, params, batch_size):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+    
     def get_dataframe(self, query: str, params: Optional[Tuple] = None) -> Optional[pd.DataFrame]:
         results = self.execute_query(query, params)
         if results is not None:
@@ -114,11 +449,60 @@ class DatabaseConnection:
         return None
 
 
+def _timed_redis(method):
+    """Registra la duración de cada comando de RedisConnection en las métricas."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.is_connected:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            record_query('redis', 'redis', method.__name__, time.perf_counter() - start)
+    return wrapper
+
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Versiones de tags del cache: una clave que no existe (expulsada por LRU) se crea
+# con ARGV[1], mayor que cualquier versión emitida antes, nunca desde 0; con
+# ARGV[2] = '1' las que existen se incrementan
+_TAG_VERSIONS_SCRIPT = """
+local versions = {}
+for i, key in ipairs(KEYS) do
+    local version = redis.call('get', key)
+    if not version then
+        redis.call('set', key, ARGV[1])
+        version = ARGV[1]
+    elseif ARGV[2] == '1' then
+        version = redis.call('incr', key)
+    end
+    versions[i] = tostring(version)
+end
+return versions
+"""
+
+# INCRBY solo si la clave existe; 0 si no (un contador perdido no se recrea desde cero)
+_INCR_EXISTING_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
 class RedisConnection:
     
     def __init__(self):
         logger.info("=== INICIANDO RedisConnection.__init__ ===")
         self.redis_client = None
+        self.raw_client = None
         self.is_connected = False
         
         logger.info(f"REDIS_ENABLED = {REDIS_ENABLED}")
@@ -144,8 +528,12 @@ class RedisConnection:
             logger.info(f"Configuración Redis: {REDIS_CONFIG}")
             
             self.redis_client = redis.Redis(**REDIS_CONFIG)
+            # Cliente sin decodificar para valores binarios (cache de resultados)
+            self.raw_client = redis.Redis(**{**REDIS_CONFIG, 'decode_responses': False})
             
+            connect_start = time.perf_counter()
             ping_result = self.redis_client.ping()
+            record_connect('redis', 'redis', time.perf_counter() - connect_start)
             
             self.is_connected = True
             logger.info("Conexión exitosa a Redis Cache")
@@ -159,16 +547,200 @@ class RedisConnection:
             self.is_connected = False
             return False
     
+    @_timed_redis
     def get(self, key: str) -> Optional[str]:
         if not self.is_connected:
             return None
         try:
             value = self.redis_client.get(key)
-            return value.decode('utf-8') if value else None
+            return value.decode('utf-8') if isinstance(value, bytes) else value
         except Exception as e:
             logger.warning(f"Error al obtener del cache: {e}")
             return None
     
+    @_timed_redis
+    def mget(self, keys: List[str]) -> Optional[List[Optional[str]]]:
+        if not self.is_connected:
+            return None
+        try:
+            return self.redis_client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Error al obtener claves del cache: {e}")
+            return None
+    
+    @_timed_redis
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        if not self.is_connected:
+            return None
+        try:
+            return self.raw_client.get(key)
+        except Exception as e:
+            logger.warning(f"Error al obtener del cache: {e}")
+            return None
+    
+    @_timed_redis
+    def mget_bytes(self, keys: List[str]) -> Optional[List[Optional[bytes]]]:
+        if not self.is_connected:
+            return None
+        try:
+            return self.raw_client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Error al obtener claves del cache: {e}")
+            return None
+    
+    @_timed_redis
+    def set_bytes(self, key: str, value: bytes, expiry: int = 300) -> bool:
+        if not self.is_connected:
+            return False
+        try:
+            self.raw_client.setex(key, expiry, value)
+            return True
+        except Exception as e:
+            logger.warning(f"Error al guardar en cache: {e}")
+            return False
+    
+    @_timed_redis
+    def tag_versions(self, keys: List[str], seed: int, increment: bool = False) -> Optional[List[int]]:
+        """
+        Versión de cada clave (incrementada si increment); las que faltan se
+        crean con seed. None si Redis falla.
+        """
+        if not self.is_connected:
+            return None
+        try:
+            versions = self.redis_client.eval(_TAG_VERSIONS_SCRIPT, len(keys), *keys, seed, '1' if increment else '0')
+            return [int(version) for version in versions]
+        except Exception as e:
+            logger.warning(f"Error al leer versiones del cache: {e}")
+            return None
+    
+    @_timed_redis
+    def incr_by(self, key: str, amount: int) -> Optional[int]:
+        if not self.is_connected:
+            return None
+        try:
+            return self.redis_client.incrby(key, amount)
+        except Exception as e:
+            logger.warning(f"Error al incrementar {key} en Redis: {e}")
+            return None
+    
+    @_timed_redis
+    def incr_if_exists(self, key: str, amount: int) -> Optional[int]:
+        """Como incr_by pero devuelve 0 sin crear la clave si no existe; None si Redis falla."""
+        if not self.is_connected:
+            return None
+        try:
+            return int(self.redis_client.eval(_INCR_EXISTING_SCRIPT, 1, key, amount))
+        except Exception as e:
+            logger.warning(f"Error al incrementar {key} en Redis: {e}")
+            return None
+    
+    @_timed_redis
+    def set_if_absent(self, key: str, value: str) -> Optional[bool]:
+        """SET NX sin expiración: True si la clave no existía."""
+        if not self.is_connected:
+            return None
+        try:
+            return bool(self.redis_client.set(key, value, nx=True))
+        except Exception as e:
+            logger.warning(f"Error al inicializar {key} en Redis: {e}")
+            return None
+    
+    @_timed_redis
+    def set_hashes(self, hashes: Dict[str, Dict[str, str]], expiry: int = 300) -> bool:
+        if not self.is_connected:
+            return False
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, values in hashes.items():
+                pipe.delete(key)
+                pipe.hset(key, mapping=values)
+                pipe.expire(key, expiry)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning(f"Error al guardar hashes en cache: {e}")
+            return False
+    
+    @_timed_redis
+    def get_hashes(self, keys: List[str]) -> Optional[List[Dict[str, str]]]:
+        if not self.is_connected:
+            return None
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            return pipe.execute()
+        except Exception as e:
+            logger.warning(f"Error al obtener hashes del cache: {e}")
+            return None
+
+    @_timed_redis
+    def update_hashes(self, hashes: Dict[str, Dict[str, str]], replace: bool = False) -> bool:
+        """Como set_hashes pero sin expiración: para índices persistentes en Redis."""
+        if not self.is_connected:
+            return False
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, values in hashes.items():
+                if replace:
+                    pipe.delete(key)
+                pipe.hset(key, mapping=values)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning(f"Error al actualizar hashes en Redis: {e}")
+            return False
+
+    @_timed_redis
+    def scan_keys(self, pattern: str, count: int = 1000) -> Optional[List[str]]:
+        if not self.is_connected:
+            return None
+        try:
+            return list(self.redis_client.scan_iter(match=pattern, count=count))
+        except Exception as e:
+            logger.warning(f"Error al recorrer claves de Redis: {e}")
+            return None
+
+    @_timed_redis
+    def delete_many(self, keys: List[str]) -> int:
+        if not self.is_connected or not keys:
+            return 0
+        try:
+            return self.redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Error al eliminar claves de Redis: {e}")
+            return 0
+
+    @_timed_redis
+    def acquire_lock(self, key: str, token: str, lease_ms: int) -> bool:
+        if not self.is_connected:
+            return False
+        try:
+            return bool(self.redis_client.set(key, token, nx=True, px=lease_ms))
+        except Exception as e:
+            logger.warning(f"Error al tomar el bloqueo {key}: {e}")
+            return False
+    
+    @_timed_redis
+    def release_lock(self, key: str, token: str):
+        # Solo lo libera quien lo tomó: si el lease venció puede tenerlo otro
+        if not self.is_connected:
+            return
+        try:
+            self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+        except Exception as e:
+            logger.warning(f"Error al liberar el bloqueo {key}: {e}")
+    
+    def pubsub(self):
+        """Suscripción con un cliente propio sin socket_timeout: listen() bloquea."""
+        if not self.is_connected:
+            return None
+        import redis
+        client = redis.Redis(**{**REDIS_CONFIG, 'socket_timeout': None})
+        return client.pubsub(ignore_subscribe_messages=True)
+    
+    @_timed_redis
     def set(self, key: str, value: str, expiry: int = 300):
         if not self.is_connected:
             return
@@ -178,6 +750,7 @@ class RedisConnection:
         except Exception as e:
             logger.warning(f"Error al guardar en cache: {e}")
     
+    @_timed_redis
     def delete(self, key: str):
         if not self.is_connected:
             return
@@ -205,9 +778,77 @@ class RedisConnection:
             logger.warning(f"Error al obtener info de Redis: {e}")
             return {}
 
+@st.cache_resource
+def get_connection_pool(sede: str) -> ConnectionPool:
+    config = DB_CONFIG.get(sede)
+    if not config:
+        raise ValueError(f"Sede '{sede}' no encontrada en la configuración")
+    
+    max_size = pool_size_for(config, POOL_CONFIG['max_connections_share'])
+    logger.info(f"=== CREANDO POOL DE CONEXIONES {sede} (máx. {max_size}) ===")
+    return ConnectionPool(
+        name=sede,
+        connect_args=build_connect_args(config, TIMEOUT_CONFIG['connection_timeout']),
+        max_size=max_size,
+        checkout_timeout=POOL_CONFIG['checkout_timeout'],
+        validation_interval=POOL_CONFIG['validation_interval'],
+        max_idle_time=POOL_CONFIG['max_idle_time']
+    )
+
+@st.cache_resource
+def get_replication_pool() -> ConnectionPool:
+    config = REPLICATION_USER_CONFIG['central_read_only']
+    max_size = pool_size_for(config, POOL_CONFIG['replication_max_connections_share'])
+    logger.info(f"=== CREANDO POOL DE REPLICACIÓN (máx. {max_size}) ===")
+    return ConnectionPool(
+        name='replicacion',
+        connect_args=build_connect_args(config, TIMEOUT_CONFIG['connection_timeout']),
+        max_size=max_size,
+        checkout_timeout=POOL_CONFIG['checkout_timeout'],
+        validation_interval=POOL_CONFIG['validation_interval'],
+        max_idle_time=POOL_CONFIG['max_idle_time']
+    )
+
+def _probe_sede(sede: str) -> bool:
+    connection = mysql.connector.connect(
+        **build_connect_args(DB_CONFIG[sede], CIRCUIT_BREAKER_CONFIG['probe_timeout'])
+    )
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    finally:
+        connection.close()
+
+@st.cache_resource
+def get_circuit_breaker(sede: str) -> CircuitBreaker:
+    if sede not in DB_CONFIG:
+        raise ValueError(f"Sede '{sede}' no encontrada en la configuración")
+    return CircuitBreaker(
+        name=sede,
+        probe=lambda: _probe_sede(sede),
+        failure_threshold=CIRCUIT_BREAKER_CONFIG['failure_threshold'],
+        probe_interval=CIRCUIT_BREAKER_CONFIG['probe_interval']
+    )
+
+def get_breaker_status() -> Dict[str, Dict[str, Any]]:
+    return {sede: get_circuit_breaker(sede).get_status() for sede in DB_CONFIG.keys()}
+
+def get_degraded_sedes(sedes: Optional[List[str]] = None) -> List[str]:
+    """Sedes con el circuito abierto: los fan-out las omiten y las reportan aparte."""
+    sedes = sedes if sedes is not None else list(DB_CONFIG.keys())
+    return [sede for sede in sedes if get_circuit_breaker(sede).state != CLOSED]
+
+def get_pool_metrics() -> Dict[str, Dict[str, Any]]:
+    metrics = {sede: get_connection_pool(sede).get_metrics() for sede in DB_CONFIG.keys()}
+    metrics['replicacion'] = get_replication_pool().get_metrics()
+    return metrics
+
 @contextmanager
 def get_db_connection(sede: str):
-    db = DatabaseConnection(sede)
+    db = DatabaseConnection(sede, pool=get_connection_pool(sede), breaker=get_circuit_breaker(sede))
     try:
         if db.connect():
             yield db
@@ -267,12 +908,106 @@ def get_nginx_status() -> Dict[str, Any]:
     }
 
 
-def execute_distributed_query(query: str, sedes: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+@st.cache_resource
+def get_query_executor() -> ThreadPoolExecutor:
+    logger.info(f"=== CREANDO EJECUTOR DE CONSULTAS DISTRIBUIDAS ({FANOUT_CONFIG['max_workers']} hilos) ===")
+    return ThreadPoolExecutor(max_workers=FANOUT_CONFIG['max_workers'], thread_name_prefix='fanout')
+
+def _query_sede_dataframe(sede: str, pool: ConnectionPool, breaker: CircuitBreaker, query: str,
+                          params: Optional[Tuple],
+                          deadline: Optional[float] = None) -> Tuple[Optional[pd.DataFrame], Optional[str], float]:
+    """
+    Con deadline (instante de perf_counter) la consulta corre con
+    max_execution_time hasta ese instante: MySQL la corta y la conexión vuelve
+    al pool aunque quien esperaba ya la haya dado por vencida.
+    """
+    start = time.perf_counter()
+    if deadline is not None and start >= deadline:
+        # Esperó en la cola del ejecutor más que su plazo: ni se pide conexión
+        return None, 'plazo vencido antes de empezar', 0.0
+    db = DatabaseConnection(sede, pool=pool, breaker=breaker)
+    limited = False
+    try:
+        if not db.connect():
+            return None, db.last_error or 'sin conexión', time.perf_counter() - start
+        if deadline is not None:
+            remaining_ms = max(1, int((deadline - time.perf_counter()) * 1000))
+            limited = db.execute_update("SET SESSION max_execution_time = %s", (remaining_ms,)) is not None
+        df = db.get_dataframe(query, params)
+        return df, db.last_error if df is None else None, time.perf_counter() - start
+    finally:
+        if limited:
+            db.execute_update("SET SESSION max_execution_time = DEFAULT")
+        db.disconnect()
+
+def execute_distributed_query_parallel(query: str, sedes: Optional[List[str]] = None,
+                                       params: Optional[Tuple] = None,
+                                       deadlines: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Ejecuta la consulta en todas las sedes a la vez. Cada sede tiene su propio
+    plazo; las que no responden a tiempo o fallan se reportan aparte y el
+    resultado es parcial. Las sedes con el circuito abierto ni se consultan y
+    quedan en 'degraded'.
+    """
+    if sedes is None:
+        sedes = list(DB_CONFIG.keys())
+    deadlines = deadlines or {}
+    
+    degraded = get_degraded_sedes(sedes)
+    executor = get_query_executor()
+    
+    start = time.perf_counter()
+    sede_deadlines = {sede: deadlines.get(sede, FANOUT_CONFIG['sede_deadlines'].get(sede, TIMEOUT_CONFIG['query_timeout']))
+                      for sede in sedes if sede not in degraded}
+    futures = {
+        sede: executor.submit(_query_sede_dataframe, sede, get_connection_pool(sede),
+                              get_circuit_breaker(sede), query, params, start + deadline)
+        for sede, deadline in sede_deadlines.items()
+    }
+    
+    outcome = {'results': {}, 'timings': {}, 'failed': {}, 'timed_out': [], 'degraded': degraded, 'elapsed': 0.0}
+    
+    for sede, future in futures.items():
+        deadline = sede_deadlines[sede]
+        remaining = max(0.0, start + deadline - time.perf_counter())
+        try:
+            df, error, elapsed = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            # Si ya empezó, max_execution_time la corta en el servidor
+            future.cancel()
+            outcome['timed_out'].append(sede)
+            outcome['timings'][sede] = time.perf_counter() - start
+            logger.warning(f"Consulta distribuida: {sede} excedió su plazo de {deadline}s")
+            continue
+        except Exception as e:
+            outcome['failed'][sede] = str(e)
+            outcome['timings'][sede] = time.perf_counter() - start
+            continue
+        
+        outcome['timings'][sede] = elapsed
+        if df is None:
+            outcome['failed'][sede] = error
+        else:
+            outcome['results'][sede] = df
+    
+    outcome['elapsed'] = time.perf_counter() - start
+    logger.info(f"Consulta distribuida en {len(sedes)} sedes: {outcome['elapsed']:.3f}s "
+                f"(fallidas: {list(outcome['failed'])}, sin respuesta: {outcome['timed_out']}, "
+                f"degradadas: {degraded})")
+    return outcome
+
+def execute_distributed_query(query: str, sedes: Optional[List[str]] = None, parallel: bool = True) -> Dict[str, pd.DataFrame]:
     if sedes is None:
         sedes = list(DB_CONFIG.keys())
     
     results = {}
     
+    if parallel:
+        outcome = execute_distributed_query_parallel(query, sedes)
+        for sede in sedes:
+            results[sede] = outcome['results'].get(sede, pd.DataFrame())
+        return results
+    
     for sede in sedes:
         with get_db_connection(sede) as db:
             if db:
@@ -285,6 +1020,8 @@ def execute_distributed_query(query: str, sedes: Optional[List[str]] = None) ->
     return results
 
 def execute_real_transfer(student_data: Dict, from_sede: str, to_sede: str, progress_bar, status_container) -> tuple:
+    start = time.perf_counter()
+    route = f"{from_sede.lower().replace(' ', '')}->{to_sede.lower().replace(' ', '')}"
     try:
         from_key = from_sede.lower().replace(' ', '')
         to_key = to_sede.lower().replace(' ', '')
@@ -298,17 +1035,41 @@ def execute_real_transfer(student_data: Dict, from_sede: str, to_sede: str, prog
         
         progress_bar.progress(0.2)
 
+        # Importación diferida: student_directory depende de este módulo
+        from utils.student_directory import get_student_directory
+        directory = get_student_directory()
+
+        # El destino se consulta siempre: que el directorio no tenga la fila no prueba que no exista
         existing_student = None
         with get_db_connection(to_key) as db_destino:
-            if db_destino:
-                check_query = """
-                SELECT id_estudiante, estado, sede_actual FROM estudiante 
-                WHERE nombre = %s AND email = %s
-                """
-                result = db_destino.get_dataframe(check_query, 
-                    (student_data['nombre'], student_data['email']))
-                if not result.empty:
-                    existing_student = result.iloc[0]
+            if not db_destino:
+                raise Exception(f"No se pudo consultar la sede {to_sede}")
+            check_query = """
+            SELECT id_estudiante, estado, sede_actual FROM estudiante 
+            WHERE nombre = %s AND email = %s
+            """
+            result = db_destino.get_dataframe(check_query, 
+                (student_data['nombre'], student_data['email']))
+            if result is None:
+                raise Exception(f"No se pudo consultar la sede {to_sede}")
+            if not result.empty:
+                existing_student = result.iloc[0]
+
+        target_id = None
+        if existing_student is None:
+            from utils.id_allocator import allocate_id
+            # El estudiante conserva su id en la sede destino salvo que allí esté ocupado;
+            # sin id global no se transfiere (AUTO_INCREMENT podría repetir ids de otras sedes)
+            target_id = int(student_data['id_estudiante'])
+            with get_db_connection(to_key) as db_destino:
+                taken = db_destino.execute_query(
+                    "SELECT 1 AS ocupado FROM estudiante WHERE id_estudiante = %s", (target_id,)) if db_destino else None
+            if taken is None:
+                raise Exception(f"No se pudo consultar la sede {to_sede}")
+            if taken:
+                target_id = allocate_id('estudiante')
+                if target_id is None:
+                    raise Exception("No se pudo asignar un id global (Redis no disponible)")
 
         progress_bar.progress(0.4)
 
@@ -342,20 +1103,24 @@ def execute_real_transfer(student_data: Dict, from_sede: str, to_sede: str, prog
                         (sede_destino_id, existing_id))
                     new_student_id = existing_id
                 else:
-                    query_insert = """
-                    INSERT INTO estudiante (nombre, email, id_sede, estado, sede_actual, fecha_transferencia) 
-                    VALUES (%s, %s, %s, 'activo', %s, NOW())
-                    """
-                    db_destino.execute_update(query_insert, 
-                        (student_data['nombre'], student_data['email'], 
-                         sede_destino_id, sede_destino_id))
-                    
-                    try:
-                        result = db_destino.get_dataframe("SELECT LAST_INSERT_ID() as new_id")
-                        if not result.empty:
-                            new_student_id = int(result.iloc[0]['new_id'])
-                    except:
-                        pass
+                    def insert_with_id(id_estudiante):
+                        # IGNORE: un id anterior a los ids globales puede estar ocupado en el destino
+                        query_insert_id = """
+                        INSERT IGNORE INTO estudiante 
+                        (id_estudiante, nombre, email, id_sede, estado, sede_actual, fecha_transferencia) 
+                        VALUES (%s, %s, %s, %s, 'activo', %s, NOW())
+                        """
+                        affected = db_destino.execute_update(query_insert_id, 
+                            (id_estudiante, student_data['nombre'], student_data['email'], 
+                             sede_destino_id, sede_destino_id))
+                        return id_estudiante if affected else None
+
+                    new_student_id = insert_with_id(target_id)
+                    if new_student_id is None:
+                        # Otra sesión ocupó el id entre la consulta y el INSERT
+                        allocated_id = allocate_id('estudiante')
+                        if allocated_id is not None:
+                            new_student_id = insert_with_id(allocated_id)
 
         progress_bar.progress(0.8)
 
@@ -378,11 +1143,17 @@ def execute_real_transfer(student_data: Dict, from_sede: str, to_sede: str, prog
                     db.execute_update(audit_query, 
                         (new_student_id, sede_origen_id, sede_destino_id, motivo))
 
+        if new_student_id:
+            directory.record_transfer(student_data['email'], from_key, int(student_data['id_estudiante']),
+                                      to_key, new_student_id)
+
         progress_bar.progress(1.0)
+        record_operation('transferencia', route, time.perf_counter() - start)
         
         return True, new_student_id
         
     except Exception as e:
+        record_operation('transferencia', route, time.perf_counter() - start, error=True)
         with status_container:
             st.error(f"❌ Error en transferencia: {str(e)}")
         return False, None
@@ -0,0 +1,245 @@
+"""
+Agregación distribuida: estados parciales por sede combinados en la aplicación
+"""
+import logging
+import math
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Tuple
+import pandas as pd
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import AGGREGATION_CONFIG, get_sede_info
+from utils.async_db import run_distributed_queries
+from utils.fragment_router import route_query
+
+logger = logging.getLogger(__name__)
+
+COUNT = 'count'
+SUM = 'sum'
+AVG = 'avg'
+MIN = 'min'
+MAX = 'max'
+APPROX_COUNT_DISTINCT = 'approx_count_distinct'
+
+# Partes del estado parcial que cada agregado pide a las sedes
+_PARTIALS = {
+    COUNT: [('count', 'COUNT({})')],
+    SUM: [('sum', 'SUM({})')],
+    AVG: [('sum', 'SUM({})'), ('count', 'COUNT({})')],
+    MIN: [('min', 'MIN({})')],
+    MAX: [('max', 'MAX({})')]
+}
+
+
+def _partial_column(name: str, part: str) -> str:
+    return f"{name}__{part}"
+
+
+def _number(value: Any) -> Any:
+    return float(value) if isinstance(value, Decimal) else value
+
+
+class HyperLogLog:
+    """
+    Registros HLL de 2^p cubetas sobre un hash de 32 bits (los 8 primeros
+    dígitos hexadecimales de MD5). Las sedes calculan los registros en SQL y
+    aquí solo se combinan con max() y se estima la cardinalidad.
+    """
+
+    def __init__(self, precision: int):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = [0] * self.m
+
+    @staticmethod
+    def register_sql(expression: str, precision: int) -> Tuple[str, str]:
+        """(hash, rho) en SQL: cubeta = hash >> (32 - p), rho = posición del primer 1 en el resto."""
+        shift = 32 - precision
+        mask = (1 << shift) - 1
+        hash_sql = f"CAST(CONV(SUBSTRING(MD5({expression}), 1, 8), 16, 10) AS UNSIGNED)"
+        rho_sql = (f"MAX(CASE WHEN (__hash & {mask}) = 0 THEN {shift + 1} "
+                   f"ELSE {shift} - FLOOR(LOG2(__hash & {mask})) END)")
+        return hash_sql, rho_sql
+
+    def add_register(self, bucket: int, rho: int):
+        bucket = int(bucket)
+        self.registers[bucket] = max(self.registers[bucket], int(rho))
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = [max(a, b) for a, b in zip(self.registers, other.registers)]
+
+    def estimate(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            # Corrección para cardinalidades pequeñas (conteo lineal)
+            return int(round(self.m * math.log(self.m / zeros)))
+        return int(round(raw))
+
+
+class DistributedAggregate:
+    """
+    Reescribe una agregación en estados parciales por sede:
+    SUM -> SUM, COUNT -> COUNT, AVG -> SUM + COUNT, MIN/MAX -> MIN/MAX y
+    COUNT DISTINCT -> registros HyperLogLog. spec es un diccionario con:
+    - tables: tablas que toca (deciden las sedes con el enrutador de fragmentos)
+    - from: cláusula FROM ... [WHERE ...] que se ejecuta en cada sede
+    - group_by: [(expresión, alias)]
+    - aggregates: {nombre: (tipo, expresión)}
+    - derived: {nombre: ('ratio', numerador, denominador, escala)}
+    - order_by: [(columna, descendente)]
+    """
+
+    def __init__(self, spec: Dict[str, Any], hll_precision: Optional[int] = None):
+        self.spec = spec
+        self.group_by = list(spec.get('group_by', []))
+        self.aggregates = dict(spec['aggregates'])
+        self.derived = dict(spec.get('derived', {}))
+        self.order_by = list(spec.get('order_by', []))
+        self.hll_precision = hll_precision or AGGREGATION_CONFIG['hll_precision']
+
+        unknown = [kind for kind, _ in self.aggregates.values() if kind not in _PARTIALS and kind != APPROX_COUNT_DISTINCT]
+        if unknown:
+            raise ValueError(f"Agregados no soportados: {', '.join(unknown)}")
+
+    def _group_clause(self, extra: Optional[List[str]] = None) -> str:
+        columns = [alias for _, alias in self.group_by] + (extra or [])
+        return f"\nGROUP BY {', '.join(columns)}" if columns else ''
+
+    def partial_sql(self) -> str:
+        columns = [f"{expression} AS {alias}" for expression, alias in self.group_by]
+        columns.append("COUNT(*) AS __rows")
+        for name, (kind, expression) in self.aggregates.items():
+            for part, template in _PARTIALS.get(kind, []):
+                columns.append(f"{template.format(expression)} AS {_partial_column(name, part)}")
+        return f"SELECT {', '.join(columns)}\n{self.spec['from']}{self._group_clause()}"
+
+    def hll_sql(self, name: str) -> str:
+        expression = self.aggregates[name][1]
+        hash_sql, rho_sql = HyperLogLog.register_sql(expression, self.hll_precision)
+        inner = [f"{group_expression} AS {alias}" for group_expression, alias in self.group_by]
+        inner.append(f"{hash_sql} AS __hash")
+        outer = [alias for _, alias in self.group_by]
+        outer.append(f"__hash >> {32 - self.hll_precision} AS __bucket")
+        outer.append(f"{rho_sql} AS __rho")
+        return (f"SELECT {', '.join(outer)}\n"
+                f"FROM (SELECT {', '.join(inner)}\n{self.spec['from']}) parcial\n"
+                f"WHERE __hash IS NOT NULL{self._group_clause(['__bucket'])}")
+
+    def statements(self, sedes: List[str]) -> Dict[Tuple[str, str], Tuple[str, str, None]]:
+        statements = {('partial', sede): (sede, self.partial_sql(), None) for sede in sedes}
+        for name, (kind, _) in self.aggregates.items():
+            if kind == APPROX_COUNT_DISTINCT:
+                sql = self.hll_sql(name)
+                statements.update({(name, sede): (sede, sql, None) for sede in sedes})
+        return statements
+
+    def _group_key(self, sede: str, row: Dict[str, Any], by_sede: bool) -> Tuple:
+        key = tuple(row[alias] for _, alias in self.group_by)
+        return ((sede,) + key) if by_sede else key
+
+    def combine(self, partials: Dict[str, List[Dict[str, Any]]], registers: Dict[str, Dict[str, List[Dict[str, Any]]]],
+                by_sede: bool = False) -> pd.DataFrame:
+        states = {}
+        for sede, rows in partials.items():
+            for row in rows or []:
+                state = states.setdefault(self._group_key(sede, row, by_sede), {})
+                state['__rows'] = state.get('__rows', 0) + row['__rows']
+                for name, (kind, _) in self.aggregates.items():
+                    if kind == APPROX_COUNT_DISTINCT:
+                        state.setdefault(name, HyperLogLog(self.hll_precision))
+                        continue
+                    for part, _ in _PARTIALS[kind]:
+                        value = row[_partial_column(name, part)]
+                        if value is None:
+                            continue
+                        column = _partial_column(name, part)
+                        current = state.get(column)
+                        if current is None:
+                            state[column] = value
+                        elif part == 'min':
+                            state[column] = min(current, value)
+                        elif part == 'max':
+                            state[column] = max(current, value)
+                        else:
+                            state[column] = current + value
+
+        for name, by_node in registers.items():
+            for sede, rows in by_node.items():
+                for row in rows or []:
+                    state = states.get(self._group_key(sede, row, by_sede))
+                    if state is not None:
+                        state[name].add_register(row['__bucket'], row['__rho'])
+
+        result = []
+        for key, state in states.items():
+            record = {}
+            if by_sede:
+                record['sede'] = get_sede_info(key[0])['name']
+                key = key[1:]
+            record.update({alias: value for (_, alias), value in zip(self.group_by, key)})
+            for name, (kind, _) in self.aggregates.items():
+                if kind == APPROX_COUNT_DISTINCT:
+                    record[name] = state[name].estimate()
+                elif kind == AVG:
+                    total, count = state.get(_partial_column(name, 'sum')), state.get(_partial_column(name, 'count'))
+                    record[name] = _number(total) / count if count else None
+                elif kind == COUNT:
+                    record[name] = state.get(_partial_column(name, 'count'), 0)
+                else:
+                    record[name] = _number(state.get(_partial_column(name, kind)))
+            for name, (operation, numerator, denominator, scale) in self.derived.items():
+                if operation != 'ratio':
+                    raise ValueError(f"Columna derivada no soportada: {operation}")
+                base = record.get(denominator)
+                record[name] = round(_number(record[numerator]) * scale / base, 2) if base else None
+            result.append(record)
+
+        for column, descending in reversed(self.order_by):
+            present = [record for record in result if record.get(column) is not None]
+            missing = [record for record in result if record.get(column) is None]
+            result = sorted(present, key=lambda record: record[column], reverse=descending) + missing
+
+        columns = (['sede'] if by_sede else []) + [alias for _, alias in self.group_by] + \
+            list(self.aggregates) + list(self.derived)
+        return pd.DataFrame(result, columns=columns)
+
+
+def run_distributed_aggregate(spec: Dict[str, Any], sedes: Optional[List[str]] = None,
+                              timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Ejecuta los parciales en paralelo en las sedes que tienen fragmentos de las
+    tablas y devuelve el resultado global, el desglose por sede y las sedes que
+    no respondieron (en ese caso el global queda incompleto).
+    """
+    aggregate = DistributedAggregate(spec)
+    sedes = sedes or route_query(spec['tables'])
+    outcomes = run_distributed_queries(aggregate.statements(sedes), timeout)
+
+    partials = {sede: outcomes[('partial', sede)]['rows'] for sede in sedes}
+    registers = {}
+    for (kind, sede), outcome in outcomes.items():
+        if kind != 'partial':
+            registers.setdefault(kind, {})[sede] = outcome['rows']
+
+    failed = {}
+    for (kind, sede), outcome in outcomes.items():
+        if outcome['rows'] is None and sede not in failed:
+            failed[sede] = outcome.get('error') or 'sin respuesta'
+    if failed:
+        logger.warning(f"Agregación distribuida incompleta, sin datos de: {', '.join(failed)}")
+
+    # Con un parcial faltante el HLL de esa sede queda vacío: se omite la sede completa
+    complete = {sede: rows for sede, rows in partials.items() if sede not in failed}
+    complete_registers = {name: {sede: rows for sede, rows in by_node.items() if sede not in failed}
+                          for name, by_node in registers.items()}
+    return {
+        'data': aggregate.combine(complete, complete_registers),
+        'por_sede': aggregate.combine(complete, complete_registers, by_sede=True),
+        'sedes': [sede for sede in sedes if sede not in failed],
+        'fallidas': failed,
+        'degraded': [sede for (kind, sede), outcome in outcomes.items() if kind == 'partial' and outcome.get('degraded')]
+    }
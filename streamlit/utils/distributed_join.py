@@ -0,0 +1,99 @@
+"""
+Join entre sedes: reducción por semi-join y hash join en memoria
+"""
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import JOIN_CONFIG
+from utils.async_db import run_distributed_queries
+from utils.fragment_router import route_query
+
+logger = logging.getLogger(__name__)
+
+
+class JoinLimitExceeded(Exception):
+    """El lado remoto devolvió más filas de las permitidas por JOIN_CONFIG['max_probe_rows']."""
+
+
+def _batches(keys: List[Any], size: int) -> List[List[Any]]:
+    return [keys[start:start + size] for start in range(0, len(keys), size)]
+
+
+def distributed_hash_join(left_rows: List[Dict[str, Any]], left_key: str, right_sql: str, right_key: str,
+                          right_tables: List[str], how: str = 'inner', sedes: Optional[List[str]] = None,
+                          sede_column: Optional[str] = 'sede_key', batch_size: Optional[int] = None,
+                          max_probe_rows: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    left_rows es el lado pequeño, ya en memoria: se construye la tabla hash con
+    él y sus claves se envían a las sedes del lado derecho como
+    WHERE ... IN (...) en lotes de batch_size (right_sql lleva {keys} donde
+    va la lista). Las filas remotas solo se usan para sondear la tabla hash, y
+    si superan max_probe_rows se aborta en vez de llenar la memoria.
+    Las columnas del lado derecho que ya existen en el izquierdo llevan el
+    sufijo _der; sede_column guarda la sede de la fila remota.
+    """
+    if how not in ('inner', 'left'):
+        raise ValueError(f"Tipo de join no soportado: {how}")
+    batch_size = batch_size or JOIN_CONFIG['batch_size']
+    max_probe_rows = max_probe_rows or JOIN_CONFIG['max_probe_rows']
+
+    build = {}
+    for row in left_rows:
+        if row.get(left_key) is not None:
+            build.setdefault(row[left_key], []).append(row)
+
+    keys = list(build.keys())
+    sedes = sedes or route_query(right_tables)
+    statements = {}
+    for index, batch in enumerate(_batches(keys, batch_size)):
+        sql = right_sql.format(keys=', '.join(['%s'] * len(batch)))
+        for sede in sedes:
+            statements[(index, sede)] = (sede, sql, tuple(batch))
+
+    outcomes = run_distributed_queries(statements) if statements else {}
+
+    failed = {}
+    probe_rows = 0
+    matches = {}
+    left_columns = set(left_rows[0].keys()) if left_rows else set()
+    for (index, sede), outcome in outcomes.items():
+        if outcome['rows'] is None:
+            failed[sede] = outcome.get('error') or 'sin respuesta'
+            continue
+        probe_rows += len(outcome['rows'])
+        if probe_rows > max_probe_rows:
+            raise JoinLimitExceeded(f"El join devolvió más de {max_probe_rows} filas remotas; "
+                                    f"filtre más el lado izquierdo o suba JOIN_CONFIG['max_probe_rows']")
+        for right in outcome['rows']:
+            left_matches = build.get(right.get(right_key))
+            if not left_matches:
+                continue
+            renamed = {(f"{column}_der" if column in left_columns else column): value
+                       for column, value in right.items()}
+            if sede_column:
+                renamed[sede_column] = sede
+            for left in left_matches:
+                matches.setdefault(id(left), []).append({**left, **renamed})
+
+    if failed:
+        logger.warning(f"Join distribuido incompleto, sin datos de: {', '.join(failed)}")
+
+    result = []
+    for row in left_rows:
+        joined = matches.get(id(row))
+        if joined:
+            result.extend(joined)
+        elif how == 'left':
+            result.append(dict(row))
+
+    info = {
+        'sedes': [sede for sede in sedes if sede not in failed],
+        'fallidas': failed,
+        'claves': len(keys),
+        'lotes': len(_batches(keys, batch_size)),
+        'filas_remotas': probe_rows
+    }
+    return result, info
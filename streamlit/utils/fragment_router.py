@@ -0,0 +1,163 @@
+"""
+Catálogo de fragmentos y enrutador de consultas por sede
+"""
+import logging
+from typing import Optional, Dict, Any, List, Iterable, Sequence
+import streamlit as st
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import FRAGMENT_CONFIG, REPLICATION_CONFIG
+from utils.queries_fragmentacion import SEDE_METADATA_REAL
+from utils.db_connections import get_degraded_sedes
+
+logger = logging.getLogger(__name__)
+
+REPLICADA = 'replicada'
+FRAGMENTADA = 'fragmentada'
+EXCLUSIVA = 'exclusiva'
+
+
+def build_fragment_catalog(metadata: Dict[str, Dict[str, Any]] = SEDE_METADATA_REAL,
+                           replication: Dict[str, Any] = REPLICATION_CONFIG,
+                           fragments: Dict[str, Any] = FRAGMENT_CONFIG) -> Dict[str, Dict[str, Any]]:
+    """
+    Tabla -> dónde vive. Las replicadas salen de REPLICATION_CONFIG (maestro y
+    esclavos), las fragmentadas de 'tablas_fragmentadas' de cada sede con el
+    predicado id_sede = <id de la sede>, y las exclusivas de 'tablas_exclusivas'
+    cuando una sola sede las declara.
+    """
+    catalog = {}
+    master = replication['master_sede']
+    for table in replication['replicated_tables']:
+        catalog[table] = {
+            'tipo': REPLICADA,
+            'nodos': [master] + list(replication['slave_sedes']),
+            'maestro': master
+        }
+
+    for sede, info in metadata.items():
+        for table in info.get('tablas_fragmentadas', []):
+            if table in catalog and catalog[table]['tipo'] == REPLICADA:
+                continue
+            entry = catalog.setdefault(table, {
+                'tipo': FRAGMENTADA,
+                'nodos': [],
+                'predicados': {},
+                'padre': fragments['derived_tables'].get(table)
+            })
+            entry['nodos'].append(sede)
+            entry['predicados'][sede] = {'id_sede': info['id_sede']}
+
+    owners = {}
+    for sede, info in metadata.items():
+        for table in info.get('tablas_exclusivas', []):
+            owners.setdefault(table, []).append(sede)
+    owners.setdefault(replication['replication_log_table'], []).append(master)
+    for table, sedes in owners.items():
+        if table not in catalog and len(sedes) == 1:
+            catalog[table] = {'tipo': EXCLUSIVA, 'nodos': sedes}
+    return catalog
+
+
+def _as_values(value: Any) -> List[Any]:
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return list(value)
+    return [value]
+
+
+class FragmentRouter:
+    """
+    Decide a qué nodos enviar una consulta según las tablas que toca y los
+    predicados de igualdad/IN sobre las columnas de fragmento:
+    - solo tablas replicadas: una réplica sana (primero los esclavos)
+    - tablas fragmentadas: solo los nodos cuyo fragmento cumple el predicado
+    - tablas exclusivas: el nodo que las tiene
+    sede_actual se trata como id_sede: la fila activa del estudiante vive en esa
+    sede; en las demás solo quedan copias marcadas como transferidas.
+    """
+
+    def __init__(self, catalog: Dict[str, Dict[str, Any]], fragment_columns: Sequence[str]):
+        self.catalog = catalog
+        self.fragment_columns = list(fragment_columns)
+        self._sede_by_id = {}
+        for entry in catalog.values():
+            for sede, predicate in entry.get('predicados', {}).items():
+                self._sede_by_id[predicate['id_sede']] = sede
+
+    def sede_for_id(self, id_sede: int) -> Optional[str]:
+        return self._sede_by_id.get(int(id_sede))
+
+    def table_info(self, table: str) -> Dict[str, Any]:
+        if table not in self.catalog:
+            raise ValueError(f"Tabla '{table}' no está en el catálogo de fragmentos")
+        return self.catalog[table]
+
+    def replica_for(self, tables: Iterable[str], prefer: Optional[str] = None) -> str:
+        """Una sola réplica para tablas replicadas; se evita el maestro y las sedes degradadas."""
+        tables = list(tables)
+        nodes = None
+        for table in tables:
+            table_nodes = self.table_info(table)['nodos']
+            nodes = list(table_nodes) if nodes is None else [node for node in nodes if node in table_nodes]
+        if not nodes:
+            raise ValueError(f"Ningún nodo tiene réplica de todas las tablas: {', '.join(tables)}")
+        master = REPLICATION_CONFIG['master_sede']
+        ordered = sorted(nodes, key=lambda node: (node != prefer, node == master))
+        degraded = set(get_degraded_sedes(ordered))
+        healthy = [node for node in ordered if node not in degraded]
+        return (healthy or ordered)[0]
+
+    def route(self, tables: Iterable[str], predicates: Optional[Dict[str, Any]] = None,
+              prefer: Optional[str] = None) -> List[str]:
+        tables = list(tables)
+        predicates = predicates or {}
+        entries = {table: self.table_info(table) for table in tables}
+
+        exclusive = {node for entry in entries.values() if entry['tipo'] == EXCLUSIVA for node in entry['nodos']}
+        fragmented = [entry for entry in entries.values() if entry['tipo'] == FRAGMENTADA]
+
+        if not fragmented and not exclusive:
+            return [self.replica_for(tables, prefer)]
+
+        candidates = None
+        for entry in fragmented:
+            nodes = entry['nodos']
+            candidates = nodes if candidates is None else [node for node in candidates if node in nodes]
+
+        ids = None
+        for column in self.fragment_columns:
+            if column in predicates and predicates[column] is not None:
+                values = {int(value) for value in _as_values(predicates[column])}
+                ids = values if ids is None else ids & values
+        if candidates is not None and ids is not None:
+            candidates = [node for node in candidates
+                          if any(entry['predicados'][node]['id_sede'] in ids for entry in fragmented)]
+
+        if exclusive:
+            if len(exclusive) > 1:
+                raise ValueError(f"Las tablas {', '.join(tables)} viven en nodos distintos: "
+                                 f"{', '.join(sorted(exclusive))}")
+            node = next(iter(exclusive))
+            if candidates is not None and node not in candidates:
+                raise ValueError(f"Los fragmentos pedidos no están en {node}, donde viven las tablas exclusivas")
+            candidates = [node]
+
+        logger.debug(f"Consulta sobre {', '.join(tables)} con {predicates} enviada a {candidates}")
+        return list(candidates)
+
+
+@st.cache_resource
+def get_fragment_router() -> FragmentRouter:
+    return FragmentRouter(build_fragment_catalog(), FRAGMENT_CONFIG['fragment_columns'])
+
+
+def route_query(tables: Iterable[str], predicates: Optional[Dict[str, Any]] = None,
+                prefer: Optional[str] = None) -> List[str]:
+    return get_fragment_router().route(tables, predicates, prefer)
+
+
+def sede_for_id(id_sede: int) -> Optional[str]:
+    return get_fragment_router().sede_for_id(id_sede)
+
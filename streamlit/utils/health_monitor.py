@@ -0,0 +1,269 @@
+"""
+Monitor de salud en segundo plano: sondea los nodos y publica su estado en Redis
+"""
+import threading
+import logging
+import time
+from typing import Dict, Any
+import mysql.connector
+import streamlit as st
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_CONFIG, HEALTH_CONFIG, REPLICATION_CONFIG, CDC_CONFIG
+from utils.connection_pool import build_connect_args
+from utils.db_connections import get_redis_connection, get_circuit_breaker
+from utils.replication import CDC_ACTIVE
+from utils.binlog_cdc import CHECKPOINT_NAME, parse_gtid_set, parse_lagging
+
+logger = logging.getLogger(__name__)
+
+# Entradas del outbox sin aplicar y cuánto lleva esperando la más antigua
+_PENDING_QUERY = f"""
+    SELECT COUNT(*) as pendientes,
+           COALESCE(TIMESTAMPDIFF(MICROSECOND, MIN(timestamp_operacion), NOW()), 0) / 1000000 as retraso
+    FROM {REPLICATION_CONFIG['replication_log_table']}
+    WHERE estado_replicacion = 'pendiente'
+"""
+
+_CDC_CHECKPOINT_QUERY = f"""
+    SELECT gtid_set, esclavos_atrasados, @@GLOBAL.gtid_executed as gtid_executed,
+           TIMESTAMPDIFF(MICROSECOND, actualizado, NOW()) / 1000000 as desde_guardado
+    FROM {CDC_CONFIG['checkpoint_table']}
+    WHERE nombre = %s
+"""
+
+
+def _parse_hash(values: Dict[str, str]) -> Dict[str, Any]:
+    parsed = {}
+    for field, value in values.items():
+        if field == 'disponible':
+            parsed[field] = value == '1'
+        elif field in ('rtt_ms', 'lag_seconds', 'checked_at'):
+            parsed[field] = float(value) if value != '' else None
+        elif field == 'pendientes':
+            parsed[field] = int(value) if value != '' else None
+        else:
+            parsed[field] = value or None
+    return parsed
+
+
+def _to_hash(values: Dict[str, Any]) -> Dict[str, str]:
+    encoded = {}
+    for field, value in values.items():
+        if isinstance(value, bool):
+            encoded[field] = '1' if value else '0'
+        else:
+            encoded[field] = '' if value is None else str(value)
+    return encoded
+
+
+class HealthMonitor:
+    """
+    Un hilo por proceso que cada interval segundos mide el RTT de los nodos
+    MySQL, Redis y el Load Balancer, estima el retraso de replicación y
+    publica todo en hashes de Redis con la hora de la medición.
+    """
+
+    def __init__(self, redis_conn, breakers: Dict[str, Any], interval: float, probe_timeout: float,
+                 key_prefix: str, lb_url: str):
+        self.redis = redis_conn
+        self.breakers = breakers
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.key_prefix = key_prefix
+        self.lb_url = lb_url.rstrip('/')
+
+        self._connections = {}
+        self._snapshot = {'nodes': {}, 'replication': {}}
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+        self._thread.start()
+
+    def node_key(self, name: str) -> str:
+        return f"{self.key_prefix}:node:{name}"
+
+    def replication_key(self, sede: str) -> str:
+        return f"{self.key_prefix}:replication:{sede}"
+
+    def _run(self):
+        while True:
+            try:
+                self.check_now()
+            except Exception as e:
+                logger.error(f"Error en el monitor de salud: {e}")
+            time.sleep(self.interval)
+
+    def _connection(self, sede: str):
+        connection = self._connections.get(sede)
+        if connection is None:
+            connection = mysql.connector.connect(**build_connect_args(DB_CONFIG[sede], self.probe_timeout))
+            connection.autocommit = True
+            self._connections[sede] = connection
+        return connection
+
+    def _drop_connection(self, sede: str):
+        connection = self._connections.pop(sede, None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _probe_mysql(self, sede: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            cursor = self._connection(sede).cursor()
+            ping_start = time.perf_counter()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            rtt = (time.perf_counter() - ping_start) * 1000
+            self.breakers[sede].record_success()
+            return {'disponible': True, 'rtt_ms': round(rtt, 2), 'error': None}
+        except Exception as e:
+            self._drop_connection(sede)
+            self.breakers[sede].record_failure(str(e))
+            return {'disponible': False, 'rtt_ms': round((time.perf_counter() - start) * 1000, 2), 'error': str(e)}
+
+    def _probe_redis(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            self.redis.redis_client.ping()
+            return {'disponible': True, 'rtt_ms': round((time.perf_counter() - start) * 1000, 2), 'error': None}
+        except Exception as e:
+            return {'disponible': False, 'rtt_ms': None, 'error': str(e)}
+
+    def _probe_load_balancer(self) -> Dict[str, Any]:
+        try:
+            import requests
+            response = requests.get(f"{self.lb_url}/health", timeout=self.probe_timeout)
+            return {
+                'disponible': response.status_code == 200,
+                'rtt_ms': round(response.elapsed.total_seconds() * 1000, 2),
+                'error': None if response.status_code == 200 else f"HTTP {response.status_code}"
+            }
+        except ImportError:
+            return {'disponible': False, 'rtt_ms': None, 'error': 'módulo requests no disponible'}
+        except Exception as e:
+            return {'disponible': False, 'rtt_ms': None, 'error': str(e)}
+
+    def _cdc_lag(self) -> Dict[str, float]:
+        """
+        Retraso de CDC por esclavo según el punto de control frente a
+        gtid_executed de Central. Si el punto de control va por detrás, el
+        retraso es el tiempo desde que se guardó; el propio guardado es una
+        transacción y el punto de control se guarda a lo sumo cada
+        checkpoint_interval sin cambios, así que es una cota superior. Un
+        esclavo atrasado cuenta desde que dejó de recibir cambios.
+        """
+        cursor = self._connection(REPLICATION_CONFIG['master_sede']).cursor(dictionary=True)
+        cursor.execute(_CDC_CHECKPOINT_QUERY, (CHECKPOINT_NAME,))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None:
+            return {}
+
+        applied = parse_gtid_set(row['gtid_set'])
+        behind = sum(max(0, last - applied.get(uuid, 0))
+                     for uuid, last in parse_gtid_set(row['gtid_executed']).items())
+        base = float(row['desde_guardado']) if behind > 1 else 0.0
+        lagging = parse_lagging(row['esclavos_atrasados'])
+        now = time.time()
+        return {sede: max(base, now - lagging[sede]) if sede in lagging else base
+                for sede in REPLICATION_CONFIG['slave_sedes']}
+
+    def _replication_lag(self, nodes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Retraso por esclavo: con el outbox, cuánto lleva esperando la entrada
+        pendiente más antigua de replication_log (se marca procesada cuando
+        la aplicaron todos los esclavos, así que es el del más lento); con
+        CDC, la posición del punto de control frente a la del binlog.
+        """
+        master = REPLICATION_CONFIG['master_sede']
+        if not nodes.get(master, {}).get('disponible'):
+            return {}
+
+        try:
+            cursor = self._connection(master).cursor(dictionary=True)
+            cursor.execute(_PENDING_QUERY)
+            row = cursor.fetchone()
+            cursor.close()
+            pendientes = row['pendientes']
+            outbox_lag = float(row['retraso'])
+            cdc_lag = self._cdc_lag() if CDC_ACTIVE else {}
+        except Exception as e:
+            logger.warning(f"No se pudo leer el estado de replicación del maestro: {e}")
+            self._drop_connection(master)
+            return {}
+
+        replication = {}
+        for sede in REPLICATION_CONFIG['slave_sedes']:
+            # El retraso se mide en el maestro y sigue creciendo con el esclavo caído
+            lag = round(max(outbox_lag, cdc_lag.get(sede, 0.0)), 3)
+            error = None if nodes.get(sede, {}).get('disponible') else 'nodo no disponible'
+            replication[sede] = {'lag_seconds': lag, 'pendientes': pendientes, 'error': error}
+        return replication
+
+    def check_now(self) -> Dict[str, Any]:
+        with self._check_lock:
+            checked_at = time.time()
+            nodes = {sede: self._probe_mysql(sede) for sede in DB_CONFIG.keys()}
+            nodes['redis'] = self._probe_redis()
+            nodes['load_balancer'] = self._probe_load_balancer()
+            replication = self._replication_lag(nodes)
+
+            for values in list(nodes.values()) + list(replication.values()):
+                values['checked_at'] = checked_at
+
+            with self._lock:
+                self._snapshot = {'nodes': nodes, 'replication': replication}
+            self._publish(nodes, replication)
+            return self._snapshot
+
+    def _publish(self, nodes: Dict[str, Dict[str, Any]], replication: Dict[str, Dict[str, Any]]):
+        hashes = {self.node_key(name): _to_hash(values) for name, values in nodes.items()}
+        hashes.update({self.replication_key(sede): _to_hash(values) for sede, values in replication.items()})
+        # Si el monitor se detiene, el estado publicado caduca en vez de quedar viejo
+        self.redis.set_hashes(hashes, int(self.interval * 3))
+
+    def read_status(self) -> Dict[str, Any]:
+        """Estado publicado en Redis; si Redis no responde, el último del proceso."""
+        names = list(DB_CONFIG.keys()) + ['redis', 'load_balancer']
+        sedes = REPLICATION_CONFIG['slave_sedes']
+        published = self.redis.get_hashes([self.node_key(name) for name in names] +
+                                          [self.replication_key(sede) for sede in sedes])
+        if not published or not any(published[:len(names)]):
+            with self._lock:
+                return {'nodes': dict(self._snapshot['nodes']), 'replication': dict(self._snapshot['replication'])}
+
+        nodes = {name: _parse_hash(values) for name, values in zip(names, published) if values}
+        replication = {sede: _parse_hash(values) for sede, values in zip(sedes, published[len(names):]) if values}
+        with self._lock:
+            # Redis no se mide a sí mismo cuando está caído: se completa con lo local
+            for name, values in self._snapshot['nodes'].items():
+                nodes.setdefault(name, values)
+        return {'nodes': nodes, 'replication': replication}
+
+
+@st.cache_resource
+def get_health_monitor() -> HealthMonitor:
+    logger.info(f"=== INICIANDO MONITOR DE SALUD (cada {HEALTH_CONFIG['interval']}s) ===")
+    # El monitor alimenta los circuitos: un nodo caído se detecta sin esperar a una página
+    breakers = {sede: get_circuit_breaker(sede) for sede in DB_CONFIG.keys()}
+    return HealthMonitor(get_redis_connection(), breakers, HEALTH_CONFIG['interval'],
+                         HEALTH_CONFIG['probe_timeout'], HEALTH_CONFIG['key_prefix'], HEALTH_CONFIG['lb_url'])
+
+
+def get_health_status() -> Dict[str, Any]:
+    monitor = get_health_monitor()
+    status = monitor.read_status()
+    if not status['nodes']:
+        # Primera visita antes de la primera ronda del monitor
+        status = monitor.check_now()
+
+    checked = [values['checked_at'] for values in status['nodes'].values() if values.get('checked_at')]
+    status['age'] = time.time() - min(checked) if checked else None
+    return status
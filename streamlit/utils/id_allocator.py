@@ -0,0 +1,132 @@
+"""
+Asignación de ids únicos entre sedes por bloques reservados en Redis
+"""
+import logging
+import threading
+from typing import Optional, Dict, Any, List
+import streamlit as st
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import ID_ALLOCATOR_CONFIG
+from utils.db_connections import RedisConnection, get_redis_connection
+from utils.async_db import run_distributed_queries
+from utils.fragment_router import route_query
+
+logger = logging.getLogger(__name__)
+
+
+class IdAllocator:
+    """
+    Cada entidad tiene un contador en Redis; el proceso reserva bloques de
+    block_size ids con un solo INCRBY y los reparte desde memoria, así el id se
+    conoce antes del INSERT sin ir a Redis ni a MySQL por cada fila. Los ids de
+    un bloque que no se usen antes de reiniciar el proceso quedan como huecos.
+    El contador arranca reseed_margin ids por encima del mayor id existente en
+    todas las sedes, y vuelve a arrancar así cada vez que falta en Redis
+    (expulsado por LRU o FLUSHDB): el margen cubre los bloques que otros
+    procesos tengan reservados y aún no hayan insertado.
+    """
+
+    def __init__(self, redis_conn: RedisConnection, key_prefix: str, block_size: int, max_id: int,
+                 entities: Dict[str, str], reseed_margin: int = 0):
+        self.redis = redis_conn
+        self.key_prefix = key_prefix
+        self.block_size = block_size
+        self.max_id = max_id
+        self.entities = dict(entities)
+        self.reseed_margin = reseed_margin
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._high_water = {}
+
+    def counter_key(self, entity: str) -> str:
+        return f"{self.key_prefix}:{entity}"
+
+    def _seed(self, entity: str) -> bool:
+        """Inicializa el contador con MAX(id) de todas las sedes más el margen si no existe."""
+        key = self.counter_key(entity)
+        column = self.entities[entity]
+        sql = f"SELECT COALESCE(MAX({column}), 0) AS max_id FROM {entity}"
+        sedes = route_query([entity])
+        outcomes = run_distributed_queries({sede: (sede, sql, None) for sede in sedes})
+        failed = [sede for sede, outcome in outcomes.items() if outcome['rows'] is None]
+        if failed:
+            # Sin el máximo de todas las sedes el contador podría repetir ids existentes
+            logger.warning(f"No se pudo inicializar el contador de {entity}, sin respuesta de: {', '.join(failed)}")
+            return False
+        highest = max(int(outcome['rows'][0]['max_id']) for outcome in outcomes.values())
+        # Tampoco por debajo de lo que este proceso ya repartió
+        start = max(highest, self._high_water.get(entity, 0)) + self.reseed_margin
+        created = self.redis.set_if_absent(key, str(start))
+        if created is None:
+            return False
+        if created:
+            logger.warning(f"Contador de ids de {entity} (re)inicializado en {start}")
+        return True
+
+    def _reserve(self, entity: str, count: int) -> Optional[List[int]]:
+        size = max(self.block_size, count)
+        # El INCRBY solo avanza un contador existente; si Redis lo perdió se siembra de nuevo
+        for _ in range(2):
+            end = self.redis.incr_if_exists(self.counter_key(entity), size)
+            if end is None:
+                return None
+            if end:
+                break
+            if not self._seed(entity):
+                return None
+        else:
+            return None
+        if end > self.max_id:
+            logger.error(f"Contador de ids de {entity} fuera del rango INT: {end}")
+            return None
+        self._high_water[entity] = end
+        return [end - size + 1, end + 1]
+
+    def allocate(self, entity: str, count: int = 1) -> Optional[List[int]]:
+        """
+        count ids nuevos de la entidad, o None si Redis no está disponible. En
+        ese caso no se inserta: un id de AUTO_INCREMENT puede caer dentro de un
+        bloque ya reservado por otro proceso o repetirse en otra sede.
+        """
+        if entity not in self.entities:
+            raise ValueError(f"Entidad sin asignador de ids: {entity}")
+        if not self.redis.is_connected:
+            return None
+        with self._lock:
+            block = self._blocks.get(entity)
+            ids = []
+            while len(ids) < count:
+                if block is None or block[0] >= block[1]:
+                    block = self._reserve(entity, count - len(ids))
+                    if block is None:
+                        self._blocks.pop(entity, None)
+                        return None
+                    self._blocks[entity] = block
+                take = min(count - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + take))
+                block[0] += take
+            return ids
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {entity: {'disponibles': block[1] - block[0], 'siguiente': block[0]}
+                    for entity, block in self._blocks.items()}
+
+
+@st.cache_resource
+def get_id_allocator() -> IdAllocator:
+    return IdAllocator(get_redis_connection(), ID_ALLOCATOR_CONFIG['key_prefix'], ID_ALLOCATOR_CONFIG['block_size'],
+                       ID_ALLOCATOR_CONFIG['max_id'], ID_ALLOCATOR_CONFIG['entities'],
+                       ID_ALLOCATOR_CONFIG['reseed_margin'])
+
+
+def allocate_id(entity: str) -> Optional[int]:
+    ids = get_id_allocator().allocate(entity)
+    return ids[0] if ids else None
+
+
+def allocate_ids(entity: str, count: int) -> Optional[List[int]]:
+    return get_id_allocator().allocate(entity, count)
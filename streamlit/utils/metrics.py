@@ -0,0 +1,275 @@
+"""
+Métricas de latencia de consultas: histogramas log-lineales por sede y consulta
+"""
+import hashlib
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import METRICS_CONFIG
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%(?:\([A-Za-z_][A-Za-z0-9_]*\))?s')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_VALUES_GROUP = r'\(\s*\?(?:\s*,\s*\?)*\s*\)'
+_VALUES_LIST_RE = re.compile(rf'({_VALUES_GROUP})(?:\s*,\s*{_VALUES_GROUP})+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+OVERFLOW_FINGERPRINT = '<otras consultas>'
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """SQL con los literales y parámetros reemplazados por ?: una entrada por forma de consulta."""
+    text = _STRING_RE.sub('?', sql)
+    text = _PLACEHOLDER_RE.sub('?', text)
+    text = _NUMBER_RE.sub('?', text)
+    text = _WHITESPACE_RE.sub(' ', text).strip().rstrip(';').strip()
+    text = _IN_LIST_RE.sub('IN (...)', text)
+    return _VALUES_LIST_RE.sub(r'\1, ...', text)
+
+
+def fingerprint_id(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class LatencyHistogram:
+    """
+    Histograma log-lineal al estilo HDR en microsegundos: exacto hasta
+    2 * 2^sub_bits µs y luego 2^sub_bits cubetas por potencia de dos, con un
+    error relativo acotado (~6% con sub_bits=4) y memoria fija por rango.
+    """
+
+    def __init__(self, sub_bits: int = 4):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.buckets = {}
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def _index(self, value: int) -> int:
+        if value < 2 * self.sub_count:
+            return value
+        shift = value.bit_length() - (self.sub_bits + 1)
+        top = value >> shift
+        return 2 * self.sub_count + (shift - 1) * self.sub_count + (top - self.sub_count)
+
+    def _bounds(self, index: int) -> Tuple[int, int]:
+        if index < 2 * self.sub_count:
+            return index, index
+        shift = (index - 2 * self.sub_count) // self.sub_count + 1
+        top = (index - 2 * self.sub_count) % self.sub_count + self.sub_count
+        return top << shift, ((top + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value = max(0, int(seconds * 1_000_000))
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_us += value
+        self.min_us = value if self.min_us is None else min(self.min_us, value)
+        self.max_us = max(self.max_us, value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total_us += other.total_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile(self, p: float) -> float:
+        """Percentil en milisegundos (punto medio de la cubeta)."""
+        if not self.count:
+            return 0.0
+        target = max(1, int(round(p / 100 * self.count)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                low, high = self._bounds(index)
+                return min((low + high) / 2, self.max_us) / 1000
+        return self.max_us / 1000
+
+    def copy(self) -> 'LatencyHistogram':
+        histogram = LatencyHistogram(self.sub_bits)
+        histogram.merge(self)
+        return histogram
+
+    def mean(self) -> float:
+        return self.total_us / self.count / 1000 if self.count else 0.0
+
+    def cumulative(self, bounds_ms: List[float]) -> List[int]:
+        """Cantidad de muestras <= cada límite (para exportar en otros formatos)."""
+        counts = [0] * len(bounds_ms)
+        for index, count in self.buckets.items():
+            upper_ms = self._bounds(index)[1] / 1000
+            for position, bound in enumerate(bounds_ms):
+                if upper_ms <= bound:
+                    counts[position] += count
+        return counts
+
+
+class _QueryStats:
+
+    def __init__(self, source: str, node: str, text: str):
+        self.source = source
+        self.node = node
+        self.fingerprint = text
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.execute = LatencyHistogram()
+        self.fetch = LatencyHistogram()
+        self.total = LatencyHistogram()
+
+
+class MetricsRegistry:
+    """Registro del proceso; los hilos del fan-out y las sesiones escriben en el mismo."""
+
+    def __init__(self, max_fingerprints: int = 1000):
+        self.max_fingerprints = max_fingerprints
+        self._queries = {}
+        self._connects = {}
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record_query(self, source: str, node: str, sql: str, execute_s: float, fetch_s: float = 0.0,
+                     rows: int = 0, error: bool = False):
+        text = fingerprint(sql) if source != 'redis' else sql
+        with self._lock:
+            key = (source, node, text)
+            stats = self._queries.get(key)
+            if stats is None:
+                if len(self._queries) >= self.max_fingerprints:
+                    key = (source, node, OVERFLOW_FINGERPRINT)
+                    stats = self._queries.get(key)
+                if stats is None:
+                    stats = self._queries[key] = _QueryStats(source, node, key[2])
+            stats.calls += 1
+            stats.rows += rows
+            if error:
+                stats.errors += 1
+            stats.execute.record(execute_s)
+            stats.fetch.record(fetch_s)
+            stats.total.record(execute_s + fetch_s)
+
+    def _record_timing(self, store: Dict, key: Tuple[str, str], seconds: float, error: bool):
+        with self._lock:
+            stats = store.get(key)
+            if stats is None:
+                stats = store[key] = {'histogram': LatencyHistogram(), 'calls': 0, 'errors': 0}
+            stats['calls'] += 1
+            if error:
+                stats['errors'] += 1
+            stats['histogram'].record(seconds)
+
+    def record_connect(self, source: str, node: str, seconds: float, error: bool = False):
+        self._record_timing(self._connects, (source, node), seconds, error)
+
+    def record_operation(self, operation: str, node: str, seconds: float, error: bool = False):
+        """Operaciones de varios pasos: aplicar una réplica en un esclavo, una transferencia, etc."""
+        self._record_timing(self._operations, (operation, node), seconds, error)
+
+    def query_stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = list(self._queries.values())
+            result = []
+            for stats in items:
+                total = stats.total
+                result.append({
+                    'source': stats.source,
+                    'node': stats.node,
+                    'fingerprint': stats.fingerprint,
+                    'fingerprint_id': fingerprint_id(stats.fingerprint),
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'rows': stats.rows,
+                    'p50_ms': total.percentile(50),
+                    'p95_ms': total.percentile(95),
+                    'p99_ms': total.percentile(99),
+                    'max_ms': total.max_us / 1000,
+                    'mean_ms': total.mean(),
+                    'total_ms': total.total_us / 1000,
+                    'execute_p95_ms': stats.execute.percentile(95),
+                    'fetch_p95_ms': stats.fetch.percentile(95)
+                })
+            return result
+
+    def _timing_stats(self, store: Dict, label: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    label: name,
+                    'node': node,
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'p50_ms': stats['histogram'].percentile(50),
+                    'p95_ms': stats['histogram'].percentile(95),
+                    'p99_ms': stats['histogram'].percentile(99),
+                    'max_ms': stats['histogram'].max_us / 1000
+                }
+                for (name, node), stats in store.items()
+            ]
+
+    def connect_stats(self) -> List[Dict[str, Any]]:
+        return self._timing_stats(self._connects, 'source')
+
+    def operation_stats(self) -> List[Dict[str, Any]]:
+        return self._timing_stats(self._operations, 'operation')
+
+    def histograms(self) -> Dict[Tuple[str, str], LatencyHistogram]:
+        """Latencia total agregada por (origen, nodo)."""
+        with self._lock:
+            merged = {}
+            for stats in self._queries.values():
+                histogram = merged.setdefault((stats.source, stats.node), LatencyHistogram())
+                histogram.merge(stats.total)
+            return merged
+
+    def timings(self, kind: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Copia de los histogramas de conexión ('connect') u operaciones ('operation')."""
+        store = self._connects if kind == 'connect' else self._operations
+        with self._lock:
+            return {
+                key: {'histogram': stats['histogram'].copy(), 'calls': stats['calls'], 'errors': stats['errors']}
+                for key, stats in store.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._connects.clear()
+            self._operations.clear()
+
+
+# Un registro por proceso, compartido por todas las sesiones y los hilos de fondo
+_registry = MetricsRegistry(METRICS_CONFIG['max_fingerprints'])
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+def record_query(source: str, node: str, sql: str, execute_s: float, fetch_s: float = 0.0,
+                 rows: int = 0, error: bool = False):
+    if METRICS_CONFIG['enabled']:
+        _registry.record_query(source, node, sql, execute_s, fetch_s, rows, error)
+
+
+def record_connect(source: str, node: str, seconds: float, error: bool = False):
+    if METRICS_CONFIG['enabled']:
+        _registry.record_connect(source, node, seconds, error)
+
+
+def record_operation(operation: str, node: str, seconds: float, error: bool = False):
+    if METRICS_CONFIG['enabled']:
+        _registry.record_operation(operation, node, seconds, error)
@@ -0,0 +1,268 @@
+"""
+Exportación de métricas en formato de texto de Prometheus (endpoint HTTP y/o archivo)
+"""
+import threading
+import logging
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+import streamlit as st
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_CONFIG, METRICS_CONFIG
+from utils.circuit_breaker import CLOSED, OPEN, HALF_OPEN
+from utils.db_connections import get_connection_pool, get_replication_pool, get_circuit_breaker
+from utils.health_monitor import get_health_monitor
+from utils.metrics import MetricsRegistry, LatencyHistogram, get_metrics_registry
+from utils.query_cache import get_query_cache
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'cenfotec'
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Exposition:
+    """Acumula familias de métricas y las escribe en el formato de texto 0.0.4."""
+
+    def __init__(self):
+        self._families = {}
+
+    def add(self, name: str, kind: str, help_text: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        family = self._families.setdefault(f"{PREFIX}_{name}", {'kind': kind, 'help': help_text, 'samples': []})
+        family['samples'].append((f"{PREFIX}_{name}", labels or {}, value))
+
+    def add_histogram(self, name: str, help_text: str, histogram: LatencyHistogram, bounds_ms: List[float],
+                      labels: Dict[str, Any]):
+        full_name = f"{PREFIX}_{name}"
+        family = self._families.setdefault(full_name, {'kind': 'histogram', 'help': help_text, 'samples': []})
+        for bound, count in zip(bounds_ms, histogram.cumulative(bounds_ms)):
+            family['samples'].append((f"{full_name}_bucket", {**labels, 'le': _format_value(bound / 1000)}, count))
+        family['samples'].append((f"{full_name}_bucket", {**labels, 'le': '+Inf'}, histogram.count))
+        family['samples'].append((f"{full_name}_sum", labels, histogram.total_us / 1_000_000))
+        family['samples'].append((f"{full_name}_count", labels, histogram.count))
+
+    def render(self) -> str:
+        lines = []
+        for name, family in self._families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for sample, labels, value in family['samples']:
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    """
+    Genera la exposición a partir de los objetos del proceso (pools, circuitos,
+    cache, monitor de salud y registro de latencias). Los objetos se resuelven al
+    crear el exportador, así el hilo HTTP no depende del contexto de Streamlit.
+    """
+
+    def __init__(self, registry: MetricsRegistry, pools: Dict[str, Any], breakers: Dict[str, Any],
+                 query_cache=None, health_monitor=None, buckets_ms: Optional[List[float]] = None):
+        self.registry = registry
+        self.pools = pools
+        self.breakers = breakers
+        self.query_cache = query_cache
+        self.health_monitor = health_monitor
+        self.buckets_ms = sorted(buckets_ms or METRICS_CONFIG['histogram_buckets_ms'])
+        self._server = None
+        self._threads = []
+
+    def render(self) -> str:
+        exposition = _Exposition()
+        for section in (self._pool_metrics, self._breaker_metrics, self._cache_metrics,
+                        self._latency_metrics, self._health_metrics):
+            try:
+                section(exposition)
+            except Exception as e:
+                logger.warning(f"No se pudieron exportar las métricas de {section.__name__}: {e}")
+                exposition.add('exporter_errors', 'gauge', 'Secciones que fallaron en la última exportación',
+                               1, {'section': section.__name__.strip('_')})
+        exposition.add('exporter_timestamp_seconds', 'gauge', 'Hora de la exportación', time.time())
+        return exposition.render()
+
+    def _pool_metrics(self, exposition: _Exposition):
+        for name, pool in self.pools.items():
+            metrics = pool.get_metrics()
+            labels = {'pool': name}
+            exposition.add('pool_connections', 'gauge', 'Conexiones abiertas del pool por estado',
+                           metrics['in_use'], {**labels, 'state': 'in_use'})
+            exposition.add('pool_connections', 'gauge', 'Conexiones abiertas del pool por estado',
+                           metrics['idle'], {**labels, 'state': 'idle'})
+            exposition.add('pool_max_connections', 'gauge', 'Tamaño máximo del pool', metrics['max_size'], labels)
+            exposition.add('pool_utilization_ratio', 'gauge', 'Conexiones en uso / máximo',
+                           metrics['utilization'], labels)
+            exposition.add('pool_checkouts_total', 'counter', 'Préstamos de conexión', metrics['checkouts'], labels)
+            exposition.add('pool_waits_total', 'counter', 'Préstamos que esperaron una conexión libre',
+                           metrics['waits'], labels)
+            exposition.add('pool_timeouts_total', 'counter', 'Préstamos que agotaron checkout_timeout',
+                           metrics['timeouts'], labels)
+            exposition.add('pool_checkout_max_seconds', 'gauge', 'Mayor tiempo de préstamo observado',
+                           metrics['checkout_max_ms'] / 1000, labels)
+
+    def _breaker_metrics(self, exposition: _Exposition):
+        for sede, breaker in self.breakers.items():
+            status = breaker.get_status()
+            for state in (CLOSED, OPEN, HALF_OPEN):
+                exposition.add('circuit_breaker_state', 'gauge', 'Estado del circuito por sede (1 = estado actual)',
+                               1 if status['state'] == state else 0, {'sede': sede, 'state': state})
+            exposition.add('circuit_breaker_failures', 'gauge', 'Fallos seguidos registrados',
+                           status['failures'], {'sede': sede})
+            exposition.add('circuit_breaker_rejected_total', 'counter', 'Llamadas rechazadas con el circuito abierto',
+                           status['rejected'], {'sede': sede})
+
+    def _cache_metrics(self, exposition: _Exposition):
+        if self.query_cache is None:
+            return
+        stats = self.query_cache.get_stats()
+        for event in ('local_hits', 'hits', 'misses', 'stale_served', 'early_refreshes', 'refreshes',
+                      'lock_waits', 'invalidations', 'errors'):
+            exposition.add('cache_events_total', 'counter', 'Eventos del cache de consultas',
+                           stats.get(event, 0), {'event': event})
+        for tier, field in (('local', 'local_hit_ratio'), ('redis', 'redis_hit_ratio'), ('total', 'hit_ratio')):
+            exposition.add('cache_hit_ratio', 'gauge', 'Proporción de aciertos del cache por nivel',
+                           stats.get(field, 0.0), {'tier': tier})
+        if stats.get('local'):
+            exposition.add('cache_local_bytes', 'gauge', 'Bytes ocupados por el LRU local', stats['local']['bytes'])
+            exposition.add('cache_local_entries', 'gauge', 'Entradas en el LRU local', stats['local']['entries'])
+            exposition.add('cache_local_evictions_total', 'counter', 'Desalojos del LRU local',
+                           stats['local']['evictions'])
+
+    def _latency_metrics(self, exposition: _Exposition):
+        totals = {}
+        for stats in self.registry.query_stats():
+            node_totals = totals.setdefault((stats['source'], stats['node']), {'errors': 0, 'rows': 0})
+            node_totals['errors'] += stats['errors']
+            node_totals['rows'] += stats['rows']
+
+        for (source, node), histogram in self.registry.histograms().items():
+            labels = {'source': source, 'node': node}
+            exposition.add_histogram('query_duration_seconds', 'Latencia de consultas (ejecución + lectura)',
+                                     histogram, self.buckets_ms, labels)
+            exposition.add('query_errors_total', 'counter', 'Consultas con error',
+                           totals.get((source, node), {}).get('errors', 0), labels)
+            exposition.add('query_rows_total', 'counter', 'Filas leídas',
+                           totals.get((source, node), {}).get('rows', 0), labels)
+
+        for (source, node), stats in self.registry.timings('connect').items():
+            labels = {'source': source, 'node': node}
+            exposition.add_histogram('connect_duration_seconds', 'Tiempo de conexión o préstamo del pool',
+                                     stats['histogram'], self.buckets_ms, labels)
+            exposition.add('connect_errors_total', 'counter', 'Conexiones fallidas', stats['errors'], labels)
+
+        for (operation, node), stats in self.registry.timings('operation').items():
+            labels = {'operation': operation, 'node': node}
+            exposition.add_histogram('operation_duration_seconds',
+                                     'Duración de réplicas aplicadas en esclavos y transferencias',
+                                     stats['histogram'], self.buckets_ms, labels)
+            exposition.add('operation_errors_total', 'counter', 'Operaciones fallidas', stats['errors'], labels)
+
+    def _health_metrics(self, exposition: _Exposition):
+        if self.health_monitor is None:
+            return
+        status = self.health_monitor.read_status()
+        for node, values in status['nodes'].items():
+            exposition.add('node_up', 'gauge', 'Disponibilidad del nodo según el monitor de salud',
+                           1 if values.get('disponible') else 0, {'node': node})
+            if values.get('rtt_ms') is not None:
+                exposition.add('node_rtt_seconds', 'gauge', 'RTT de la última sonda',
+                               values['rtt_ms'] / 1000, {'node': node})
+        for sede, values in status['replication'].items():
+            if values.get('lag_seconds') is not None:
+                exposition.add('replication_lag_seconds', 'gauge', 'Retraso estimado del esclavo respecto al maestro',
+                               values['lag_seconds'], {'sede': sede})
+        # replication_log es uno solo para todos los esclavos: se exporta una vez y
+        # sin etiqueta de sede, para que sumar la serie no multiplique el total
+        pendientes = [values['pendientes'] for values in status['replication'].values()
+                      if values.get('pendientes') is not None]
+        if pendientes:
+            exposition.add('replication_pending', 'gauge', 'Filas pendientes en replication_log', pendientes[0])
+
+    def serve(self, host: str, port: int):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"metrics {self.address_string()} {format % args}")
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            # Otro proceso (o una recarga de Streamlit) ya tiene el puerto
+            logger.warning(f"No se pudo abrir el endpoint de métricas en {host}:{port}: {e}")
+            return
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+
+    def write_textfile(self, path: str, interval: float):
+        """Reescribe el archivo cada interval segundos (para el textfile collector de node_exporter)."""
+        def run():
+            while True:
+                try:
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(self.render())
+                    os.replace(tmp_path, path)
+                except Exception as e:
+                    logger.error(f"Error escribiendo métricas en {path}: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='metrics-textfile', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+
+@st.cache_resource
+def get_metrics_exporter() -> Optional[MetricsExporter]:
+    if not METRICS_CONFIG['enabled']:
+        return None
+
+    logger.info("=== INICIANDO EXPORTADOR DE MÉTRICAS ===")
+    pools = {sede: get_connection_pool(sede) for sede in DB_CONFIG.keys()}
+    pools['replicacion'] = get_replication_pool()
+    exporter = MetricsExporter(
+        registry=get_metrics_registry(),
+        pools=pools,
+        breakers={sede: get_circuit_breaker(sede) for sede in DB_CONFIG.keys()},
+        query_cache=get_query_cache(),
+        health_monitor=get_health_monitor()
+    )
+    if METRICS_CONFIG.get('export_port'):
+        exporter.serve(METRICS_CONFIG.get('export_host', '0.0.0.0'), METRICS_CONFIG['export_port'])
+    if METRICS_CONFIG.get('export_textfile'):
+        exporter.write_textfile(METRICS_CONFIG['export_textfile'], METRICS_CONFIG.get('export_interval', 15))
+    return exporter
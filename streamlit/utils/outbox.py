@@ -0,0 +1,322 @@
+"""
+Replicación asíncrona: worker que aplica replication_log (outbox) en los esclavos
+"""
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Optional, Dict, Any, List, Set, Tuple
+from mysql.connector.errors import InterfaceError, OperationalError
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import OUTBOX_CONFIG, REPLICATION_CONFIG
+from utils.db_connections import DatabaseConnection, get_db_connection, get_connection_pool, get_circuit_breaker
+from utils.replication import MASTER_COLUMNS, master_upsert_sql
+from utils.metrics import record_operation
+
+logger = logging.getLogger(__name__)
+
+_LOG_TABLE = REPLICATION_CONFIG['replication_log_table']
+
+_TAIL_QUERY = f"""
+    SELECT id, tabla_afectada, operacion, registro_id, datos_nuevos
+    FROM {_LOG_TABLE}
+    WHERE id > %s AND estado_replicacion = 'pendiente'
+    ORDER BY id
+    LIMIT %s
+"""
+
+# Filas confirmadas tarde (su transacción terminó después de que el watermark las pasó)
+_SWEEP_QUERY = f"""
+    SELECT id, tabla_afectada, operacion, registro_id, datos_nuevos
+    FROM {_LOG_TABLE}
+    WHERE id <= %s AND estado_replicacion = 'pendiente'
+    ORDER BY id
+    LIMIT %s
+"""
+
+
+def _payload(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    datos = entry.get('datos_nuevos')
+    if isinstance(datos, (bytes, bytearray)):
+        datos = datos.decode('utf-8')
+    if isinstance(datos, str):
+        try:
+            datos = json.loads(datos)
+        except ValueError:
+            return None
+    return datos.get('fila') if isinstance(datos, dict) else None
+
+
+def build_statements(entries: List[Dict[str, Any]]) -> Tuple[List[Tuple[str, Tuple, List[int]]], Set[int]]:
+    """
+    Sentencias para un lote del log, en orden: las entradas consecutivas de la
+    misma tabla y tipo se juntan en un upsert multi-fila (o un DELETE ... IN).
+    Las filas del upsert siguen el orden del log y solo se funden las versiones
+    seguidas de una misma clave: adelantar la última versión de una clave
+    rompería intercambios de columnas UNIQUE (profesor.email) a mitad de lote.
+    Devuelve también los id del log que no se pueden aplicar (tabla no
+    replicada o fila incompleta).
+    """
+    statements = []
+    invalid = set()
+    groups = itertools.groupby(entries, key=lambda entry: (entry['tabla_afectada'], entry['operacion'] == 'DELETE'))
+    for (table, is_delete), group in groups:
+        group = list(group)
+        if table not in MASTER_COLUMNS:
+            invalid.update(entry['id'] for entry in group)
+            continue
+        columns = MASTER_COLUMNS[table]
+        log_ids = [entry['id'] for entry in group]
+        if is_delete:
+            keys = list(dict.fromkeys(entry['registro_id'] for entry in group))
+            sql = f"DELETE FROM {table} WHERE {columns[0]} IN ({', '.join(['%s'] * len(keys))})"
+            statements.append((sql, tuple(keys), log_ids))
+            continue
+
+        rows = []
+        applied_ids = []
+        for entry in group:
+            row = _payload(entry)
+            if not row or any(column not in row for column in columns):
+                invalid.add(entry['id'])
+                continue
+            if rows and rows[-1][columns[0]] == row[columns[0]]:
+                rows[-1] = row
+            else:
+                rows.append(row)
+            applied_ids.append(entry['id'])
+        if rows:
+            params = tuple(row[column] for row in rows for column in columns)
+            statements.append((master_upsert_sql(table, len(rows)), params, applied_ids))
+    return statements, invalid
+
+
+def apply_log_entries(sede: str, pool, breaker, entries: List[Dict[str, Any]]) -> Optional[Set[int]]:
+    """
+    Aplica entradas del log (o con su misma forma) en una transacción del
+    esclavo. Devuelve los id que fallaron por sus datos, o None si el problema
+    es de conexión y hay que reintentar. Si el lote falla por datos se aplica
+    entrada por entrada para aislar las malas.
+    """
+    statements, invalid = build_statements(entries)
+    db = DatabaseConnection(sede, pool=pool, breaker=breaker)
+    try:
+        if not db.connect():
+            return None
+        try:
+            with db.transaction():
+                for query, params, _ in statements:
+                    db.execute_update(query, params)
+            return invalid
+        except (InterfaceError, OperationalError):
+            return None
+        except Exception as e:
+            if len(entries) == 1:
+                logger.error(f"Entrada {entries[0]['id']} del log no se pudo aplicar en {sede}: {e}")
+                return invalid | {entries[0]['id']}
+            logger.warning(f"Lote del log falló en {sede} ({e}); se aplica entrada por entrada")
+    finally:
+        db.disconnect()
+
+    failed = set(invalid)
+    for entry in entries:
+        if entry['id'] in invalid:
+            continue
+        result = apply_log_entries(sede, pool, breaker, [entry])
+        if result is None:
+            return None
+        failed |= result
+    return failed
+
+
+class OutboxWorker:
+    """
+    Un hilo lee replication_log por watermark de id (las filas 'pendiente' con
+    id mayor al último leído) y reparte cada lote en la cola de cada esclavo;
+    las colas tienen tamaño fijo, así un esclavo lento frena la lectura en vez
+    de acumular memoria. Un hilo por esclavo aplica sus lotes con reintentos y,
+    cuando todos los esclavos aplicaron un lote, sus filas quedan 'procesado'
+    (o 'error' las que no se pudieron aplicar). Aplicar es idempotente, así que
+    tras un reinicio se vuelve a empezar desde las filas pendientes.
+    """
+
+    def __init__(self, slave_sedes: List[str], batch_size: int, queue_batches: int, poll_interval: float,
+                 sweep_interval: float, retry_initial: float, retry_max: float):
+        self.master_sede = REPLICATION_CONFIG['master_sede']
+        self.slave_sedes = list(slave_sedes)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.queues = {sede: queue.Queue(maxsize=queue_batches) for sede in self.slave_sedes}
+        self.watermark = 0
+        self._lock = threading.Lock()
+        self._batches = {}
+        self._in_flight = set()
+        self._batch_ids = itertools.count(1)
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+        self._threads = []
+        self.stats = {'lotes': 0, 'procesadas': 0, 'errores': 0}
+
+    @classmethod
+    def from_config(cls) -> 'OutboxWorker':
+        return cls(REPLICATION_CONFIG['slave_sedes'], OUTBOX_CONFIG['batch_size'], OUTBOX_CONFIG['queue_batches'],
+                   OUTBOX_CONFIG['poll_interval'], OUTBOX_CONFIG['sweep_interval'],
+                   OUTBOX_CONFIG['retry_initial'], OUTBOX_CONFIG['retry_max'])
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._apply_loop, args=(sede,), name=f'outbox-{sede}', daemon=True)
+                         for sede in self.slave_sedes]
+        self._threads.append(threading.Thread(target=self._tail_loop, name='outbox-tail', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Worker de replicación iniciado para {', '.join(self.slave_sedes)}")
+
+    def stop(self):
+        self._stop.set()
+
+    def drain(self) -> bool:
+        """
+        Aplica lo que quede pendiente en replication_log y se detiene. Se usa al
+        pasar a CDC, antes de que el binlog aplique cambios más nuevos de las
+        mismas filas. False si se detuvo antes de vaciar el log.
+        """
+        # Cada lectura revisa también las filas confirmadas tarde
+        self.sweep_interval = 0
+        self.start()
+        while not self._idle.wait(1):
+            if self._stop.is_set():
+                break
+        drained = self._idle.is_set()
+        self.stop()
+        for thread in self._threads:
+            thread.join(timeout=self.retry_max)
+        logger.info(f"Outbox {'vaciado' if drained else 'sin vaciar'}: {self.stats['procesadas']} procesadas, "
+                    f"{self.stats['errores']} con error")
+        return drained
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.wait(60):
+                logger.info(f"Worker de replicación: watermark {self.watermark}, {self.stats['procesadas']} procesadas, "
+                            f"{self.stats['errores']} con error, colas "
+                            f"{ {sede: q.qsize() for sede, q in self.queues.items()} }")
+        except KeyboardInterrupt:
+            self.stop()
+        for thread in self._threads:
+            thread.join(timeout=self.retry_max)
+        logger.info("Worker de replicación detenido")
+
+    def _read_log(self, query: str, params: Tuple) -> Optional[List[Dict[str, Any]]]:
+        with get_db_connection(self.master_sede) as db:
+            if not db:
+                return None
+            return db.execute_query(query, params)
+
+    def _mark(self, ids: List[int], estado: str):
+        if not ids:
+            return
+        with get_db_connection(self.master_sede) as db:
+            if not db:
+                # Quedan 'pendiente': el barrido las vuelve a aplicar (aplicar es idempotente)
+                logger.warning(f"No se pudieron marcar {len(ids)} filas del log como {estado}")
+                return
+            for start in range(0, len(ids), self.batch_size):
+                chunk = ids[start:start + self.batch_size]
+                db.execute_update(f"UPDATE {_LOG_TABLE} SET estado_replicacion = %s "
+                                  f"WHERE id IN ({', '.join(['%s'] * len(chunk))})", (estado, *chunk))
+
+    def _tail_loop(self):
+        last_sweep = time.monotonic()
+        while not self._stop.is_set():
+            entries = self._read_log(_TAIL_QUERY, (self.watermark, self.batch_size))
+            if entries is None:
+                self._stop.wait(self.retry_initial)
+                continue
+            if entries:
+                self.watermark = max(self.watermark, entries[-1]['id'])
+
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                late = self._read_log(_SWEEP_QUERY, (self.watermark, self.batch_size)) or []
+                known = {entry['id'] for entry in entries}
+                entries = [entry for entry in late if entry['id'] not in known] + entries
+
+            with self._lock:
+                entries = [entry for entry in entries if entry['id'] not in self._in_flight]
+                if not entries and not self._in_flight:
+                    self._idle.set()
+            if not entries:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._dispatch(sorted(entries, key=lambda entry: entry['id']))
+
+    def _dispatch(self, entries: List[Dict[str, Any]]):
+        batch_id = next(self._batch_ids)
+        ids = [entry['id'] for entry in entries]
+        with self._lock:
+            self._batches[batch_id] = {'ids': ids, 'restantes': set(self.slave_sedes), 'errores': set()}
+            self._in_flight.update(ids)
+        for sede, pending in self.queues.items():
+            while not self._stop.is_set():
+                try:
+                    pending.put((batch_id, entries), timeout=self.poll_interval)
+                    break
+                except queue.Full:
+                    logger.debug(f"Cola de {sede} llena: se frena la lectura del log")
+
+    def _apply_loop(self, sede: str):
+        pool = get_connection_pool(sede)
+        breaker = get_circuit_breaker(sede)
+        pending = self.queues[sede]
+        while not self._stop.is_set():
+            try:
+                batch_id, entries = pending.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            failed = self._apply_with_retry(sede, pool, breaker, entries)
+            if failed is None:
+                return
+            self._complete(batch_id, sede, failed)
+
+    def _apply_with_retry(self, sede: str, pool, breaker, entries: List[Dict[str, Any]]) -> Optional[Set[int]]:
+        """Reintenta con espera exponencial mientras el esclavo no responda; None si el worker se detiene."""
+        delay = self.retry_initial
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            failed = apply_log_entries(sede, pool, breaker, entries)
+            record_operation('replicacion_outbox', sede, time.perf_counter() - start, error=failed is None)
+            if failed is not None:
+                return failed
+            logger.warning(f"Esclavo {sede} no disponible, reintento en {delay:.1f}s")
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.retry_max)
+        return None
+
+    def _complete(self, batch_id: int, sede: str, failed: Set[int]):
+        with self._lock:
+            batch = self._batches[batch_id]
+            batch['restantes'].discard(sede)
+            batch['errores'].update(failed)
+            if batch['restantes']:
+                return
+            del self._batches[batch_id]
+
+        processed = [log_id for log_id in batch['ids'] if log_id not in batch['errores']]
+        self._mark(processed, 'procesado')
+        self._mark(sorted(batch['errores']), 'error')
+        with self._lock:
+            self._in_flight.difference_update(batch['ids'])
+            self.stats['lotes'] += 1
+            self.stats['procesadas'] += len(processed)
+            self.stats['errores'] += len(batch['errores'])
+        logger.info(f"Lote {batch_id} del log aplicado en todos los esclavos: {len(processed)} procesadas, "
+                    f"{len(batch['errores'])} con error")
@@ -202,6 +202,69 @@ ANALYSIS_QUERIES = {
     """
 }
 
+# Las mismas analíticas como agregaciones distribuidas (utils.distributed_agg):
+# cada sede devuelve estados parciales y el resultado global se combina en la app.
+# Los id_* se repiten entre sedes, por eso se agrupa y cuenta por nombre/email
+DISTRIBUTED_ANALYSIS_QUERIES = {
+    'student_distribution': {
+        'tables': ['estudiante', 'matricula', 'curso', 'carrera', 'sede'],
+        'from': """
+            FROM estudiante e
+            JOIN sede s ON e.id_sede = s.id_sede
+            JOIN matricula m ON e.id_estudiante = m.id_estudiante
+            JOIN curso cu ON m.id_curso = cu.id_curso
+            JOIN carrera ca ON cu.id_carrera = ca.id_carrera
+        """,
+        'group_by': [('s.nombre', 'sede'), ('ca.nombre', 'carrera')],
+        'aggregates': {'estudiantes': ('approx_count_distinct', 'e.email')},
+        'order_by': [('sede', False), ('estudiantes', True)]
+    },
+    
+    'payment_trends': {
+        'tables': ['pago'],
+        'from': """
+            FROM pago
+            WHERE fecha >= DATE_SUB(NOW(), INTERVAL 6 MONTH)
+        """,
+        'group_by': [("DATE_FORMAT(fecha, '%Y-%m')", 'mes'), ('concepto', 'concepto')],
+        'aggregates': {
+            'numero_pagos': ('count', '*'),
+            'total': ('sum', 'monto'),
+            'promedio': ('avg', 'monto')
+        },
+        'order_by': [('mes', True)]
+    },
+    
+    'attendance_analysis': {
+        'tables': ['asistencia', 'matricula', 'curso'],
+        'from': """
+            FROM asistencia a
+            JOIN matricula m ON a.id_matricula = m.id_matricula
+            JOIN curso c ON m.id_curso = c.id_curso
+        """,
+        'group_by': [('c.nombre', 'curso')],
+        'aggregates': {
+            'clases_totales': ('count', 'a.id_asistencia'),
+            'presentes': ('sum', 'CASE WHEN a.presente = 1 THEN 1 ELSE 0 END')
+        },
+        'derived': {'porcentaje_asistencia': ('ratio', 'presentes', 'clases_totales', 100)},
+        'order_by': [('porcentaje_asistencia', True)]
+    },
+    
+    'grade_summary': {
+        'tables': ['nota'],
+        'from': "FROM nota n",
+        'aggregates': {
+            'total_notas': ('count', 'n.id_nota'),
+            'promedio_general': ('avg', 'n.nota'),
+            'nota_minima': ('min', 'n.nota'),
+            'nota_maxima': ('max', 'n.nota'),
+            'aprobados': ('count', 'CASE WHEN n.nota >= 70 THEN 1 END')
+        },
+        'derived': {'porcentaje_aprobacion': ('ratio', 'aprobados', 'total_notas', 100)}
+    }
+}
+
 USER_VIEW_QUERIES = {
     'student_view': """
         CREATE OR REPLACE VIEW vista_estudiante AS
@@ -373,6 +436,7 @@ __all__ = [
     'TRANSACTION_QUERIES',
     'MONITORING_QUERIES',
     'ANALYSIS_QUERIES',
+    'DISTRIBUTED_ANALYSIS_QUERIES',
     'USER_VIEW_QUERIES',
     'build_date_filter',
     'build_pagination',
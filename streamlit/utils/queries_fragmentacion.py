@@ -243,7 +243,12 @@ CONSULTAS_COMPARACION_SEDES_REAL = {
                 3 as id_sede
             FROM estudiante 
             WHERE id_sede = 3;
-        """
+        """,
+        'agregado': {
+            'tables': ['estudiante'],
+            'from': "FROM estudiante e",
+            'aggregates': {'total_estudiantes': ('count', '*')}
+        }
     },
     'matriculas_por_sede': {
         'nombre': 'Comparación de Matrículas por Sede',
@@ -263,7 +268,20 @@ CONSULTAS_COMPARACION_SEDES_REAL = {
                 COUNT(DISTINCT m.id_estudiante) as estudiantes_unicos,
                 COUNT(DISTINCT m.id_curso) as cursos_diferentes
             FROM matricula m;
-        """
+        """,
+        'agregado': {
+            'tables': ['matricula', 'estudiante', 'curso'],
+            'from': """
+                FROM matricula m
+                JOIN estudiante e ON m.id_estudiante = e.id_estudiante
+                JOIN curso c ON m.id_curso = c.id_curso
+            """,
+            'aggregates': {
+                'total_matriculas': ('count', 'm.id_matricula'),
+                'estudiantes_unicos': ('approx_count_distinct', 'e.email'),
+                'cursos_diferentes': ('approx_count_distinct', 'c.nombre')
+            }
+        }
     },
     'rendimiento_por_sede': {
         'nombre': 'Comparación de Rendimiento Académico',
@@ -287,7 +305,18 @@ CONSULTAS_COMPARACION_SEDES_REAL = {
                 COUNT(CASE WHEN n.nota < 70 THEN 1 END) as reprobados,
                 ROUND((COUNT(CASE WHEN n.nota >= 70 THEN 1 END) * 100.0 / COUNT(n.id_nota)), 2) as porcentaje_aprobacion
             FROM nota n;
-        """
+        """,
+        'agregado': {
+            'tables': ['nota'],
+            'from': "FROM nota n",
+            'aggregates': {
+                'total_notas': ('count', 'n.id_nota'),
+                'promedio_general': ('avg', 'n.nota'),
+                'aprobados': ('count', 'CASE WHEN n.nota >= 70 THEN 1 END'),
+                'reprobados': ('count', 'CASE WHEN n.nota < 70 THEN 1 END')
+            },
+            'derived': {'porcentaje_aprobacion': ('ratio', 'aprobados', 'total_notas', 100)}
+        }
     }
 }
 
@@ -464,6 +493,7 @@ SEDE_METADATA_REAL = {
         'responsabilidades': ['Planillas', 'Pagarés', 'Datos Maestros'],
         'tablas_exclusivas': ['planilla', 'pagare'],
         'tablas_compartidas': ['sede', 'carrera', 'profesor'],
+        'tablas_fragmentadas': ['estudiante', 'matricula', 'nota', 'asistencia', 'pago', 'curso'],
         'puerto': 3306
     },
     'sancarlos': {
@@ -475,6 +505,7 @@ SEDE_METADATA_REAL = {
         'responsabilidades': ['Estudiantes (id_sede=2)', 'Matrículas', 'Notas', 'Asistencia'],
         'tablas_exclusivas': ['estudiante', 'matricula', 'nota', 'asistencia'],
         'tablas_replicadas': ['sede', 'carrera', 'profesor'],
+        'tablas_fragmentadas': ['estudiante', 'matricula', 'nota', 'asistencia', 'pago', 'curso'],
         'puerto': 3307
     },
     'heredia': {
@@ -486,6 +517,7 @@ SEDE_METADATA_REAL = {
         'responsabilidades': ['Estudiantes (id_sede=3)', 'Matrículas', 'Notas', 'Asistencia'],
         'tablas_exclusivas': ['estudiante', 'matricula', 'nota', 'asistencia'],
         'tablas_replicadas': ['sede', 'carrera', 'profesor'],
+        'tablas_fragmentadas': ['estudiante', 'matricula', 'nota', 'asistencia', 'pago', 'curso'],
         'puerto': 3308
     }
 }
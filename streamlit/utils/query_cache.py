@@ -0,0 +1,590 @@
+"""
+Cache de resultados de consultas en Redis con invalidación por tabla
+"""
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Callable, Union
+import pandas as pd
+import streamlit as st
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CACHE_CONFIG, REDIS_CONFIG, MESSAGES
+from utils.db_connections import get_db_connection, get_redis_connection
+from utils.cache_codec import CacheCodec
+
+logger = logging.getLogger(__name__)
+
+_READ_TABLES_RE = re.compile(r'\b(?:FROM|JOIN)\s+`?([A-Za-z_][A-Za-z0-9_]*)`?', re.IGNORECASE)
+_WRITE_TABLES_RE = re.compile(r'^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?([A-Za-z_][A-Za-z0-9_]*)`?',
+                              re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+CachedValue = Union[List[Dict], pd.DataFrame]
+
+_SHADOW_SUFFIX = ':shadow'
+
+
+def _version_epoch() -> int:
+    """Valor inicial de una versión de tag: microsegundos desde la época Unix."""
+    return time.time_ns() // 1000
+
+
+def normalize_sql(sql: str) -> str:
+    return _WHITESPACE_RE.sub(' ', sql).strip().rstrip(';').strip()
+
+
+def extract_read_tables(sql: str) -> List[str]:
+    return sorted({table.lower() for table in _READ_TABLES_RE.findall(sql)})
+
+
+def extract_written_table(sql: str) -> Optional[str]:
+    match = _WRITE_TABLES_RE.match(sql)
+    return match.group(1).lower() if match else None
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _detach(value: CachedValue) -> CachedValue:
+    # Lo que guarda el LRU es compartido entre sesiones: cada uno recibe su copia
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    return [dict(row) for row in value]
+
+
+class LocalCache:
+    """
+    LRU en memoria del proceso acotado por bytes (tamaño de la entrada
+    codificada). Lo comparten todas las sesiones del servidor.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._by_tag = {}
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, sede: str, rows: CachedValue, versions: Dict[str, int], size: int, ttl: int):
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'sede': sede,
+                'rows': rows,
+                'versions': versions,
+                'size': size,
+                'validated_at': now,
+                'expires_at': now + ttl
+            }
+            self._bytes += size
+            for tag in versions:
+                self._by_tag.setdefault((sede, tag), set()).add(key)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def mark_validated(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['validated_at'] = time.monotonic()
+
+    def discard(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def evict_tables(self, sede: str, tables: Iterable[str]) -> int:
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._by_tag.get((sede, table), set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+        for tag in entry['versions']:
+            keys = self._by_tag.get((entry['sede'], tag))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[(entry['sede'], tag)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self._evictions
+            }
+
+
+class QueryCache:
+    """
+    Cada entrada guarda la versión de las tablas que lee; escribir en una tabla
+    incrementa su versión y deja inválidas todas las entradas que la usaban.
+
+    Delante de Redis hay un LRU local. Sus entradas se sirven sin ir a Redis
+    mientras las versiones conocidas coincidan y no haya pasado el intervalo
+    de revalidación; después se comparan con Redis leyendo solo las versiones.
+
+    Las entradas tienen un TTL suave (el pedido) y uno duro (más stale_ttl).
+    Entre ambos se sirven vencidas mientras un único proceso, con el bloqueo
+    de refresco, vuelve a consultar MySQL en segundo plano.
+    """
+
+    def __init__(self, redis_conn, prefix: str, default_ttl: int,
+                 local_max_bytes: int = 0, local_revalidate_interval: float = 2,
+                 codec: Optional[CacheCodec] = None, loader: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 stale_ttl: int = 0, refresh_lease_ms: int = 10000, lock_wait: float = 2,
+                 early_refresh_beta: float = 1.0, hot_key_idle: int = 600):
+        self.redis = redis_conn
+        self.codec = codec or CacheCodec()
+        self.loader = loader
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.local = LocalCache(local_max_bytes) if local_max_bytes > 0 else None
+        self.local_revalidate_interval = local_revalidate_interval
+        self.stale_ttl = stale_ttl
+        self.refresh_lease_ms = refresh_lease_ms
+        self.lock_wait = lock_wait
+        self.early_refresh_beta = early_refresh_beta
+        self.hot_key_idle = hot_key_idle
+        self._known_versions = {}
+        self._hot_keys = {}
+        self._listener = None
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'local_revalidations': 0, 'hits': 0, 'misses': 0,
+                       'stale': 0, 'stale_served': 0, 'early_refreshes': 0, 'refreshes': 0,
+                       'lock_waits': 0, 'invalidations': 0, 'errors': 0}
+
+    def key_for(self, sede: str, sql: str, params: Optional[Tuple], kind: str = 'rows') -> str:
+        payload = kind + '|' + normalize_sql(sql) + '|' + json.dumps(list(params) if params else [], default=_json_default)
+        return f"{self.prefix}:{sede}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+    def tag_key(self, sede: str, table: str) -> str:
+        return f"{self.prefix}:tag:{sede}:{table}"
+
+    def lock_key(self, key: str) -> str:
+        return f"{key}:lock"
+
+    def shadow_key(self, key: str) -> str:
+        return f"{key}{_SHADOW_SUFFIX}"
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _remember_versions(self, sede: str, versions: Dict[str, int]):
+        # Las versiones solo crecen: nunca se retrocede a un valor leído antes
+        with self._lock:
+            for tag, version in versions.items():
+                known = self._known_versions.get((sede, tag), 0)
+                self._known_versions[(sede, tag)] = max(known, version)
+
+    def _seed_versions(self, sede: str, versions: Dict[str, Optional[int]]) -> Optional[Dict[str, int]]:
+        """
+        Completa las versiones de tags cuya clave no existe en Redis (expulsada
+        por LRU). Reiniciarlas en 0 podría repetir una versión ya usada y volver
+        válida una entrada vieja; se crean con la época actual en microsegundos,
+        mayor que cualquier versión anterior (que crece de a uno).
+        """
+        missing = [tag for tag, version in versions.items() if version is None]
+        if not missing:
+            return versions
+        seeded = self.redis.tag_versions([self.tag_key(sede, tag) for tag in missing], _version_epoch())
+        if seeded is None:
+            return None
+        logger.info(f"Tags sin versión en Redis ({sede}): {missing}; se inician por época")
+        return {**versions, **dict(zip(missing, seeded))}
+
+    def _matches_known(self, sede: str, versions: Dict[str, int]) -> bool:
+        with self._lock:
+            return all(self._known_versions.get((sede, tag)) == version for tag, version in versions.items())
+
+    def _lookup_local(self, key: str, sede: str) -> Optional[CachedValue]:
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+
+        versions = entry['versions']
+        fresh = time.monotonic() - entry['validated_at'] < self.local_revalidate_interval
+        if fresh and self._matches_known(sede, versions):
+            self._count('local_hits')
+            return entry['rows']
+
+        current = self.current_versions(sede, list(versions))
+        if current is None:
+            return None
+        if current != versions:
+            self.local.discard(key)
+            return None
+
+        self.local.mark_validated(key)
+        self._count('local_revalidations')
+        self._count('local_hits')
+        return entry['rows']
+
+    def lookup(self, key: str, sede: str, tags: List[str]) -> Tuple[Optional[CachedValue], Optional[Dict[str, int]], bool]:
+        """
+        Devuelve (resultado o None, versiones actuales de las tablas, si hay que
+        refrescarlo). Las versiones son None si Redis falló: no es un fallo de
+        cache y no tiene sentido esperar ni guardar.
+        """
+        if self.local is not None:
+            value = self._lookup_local(key, sede)
+            if value is not None:
+                return _detach(value), {}, False
+
+        values = self.redis.mget_bytes([key] + [self.tag_key(sede, tag) for tag in tags])
+        if values is None:
+            self._count('errors')
+            return None, None, False
+
+        raw, tag_values = values[0], values[1:]
+        versions = self._seed_versions(sede, {tag: None if value is None else int(value)
+                                              for tag, value in zip(tags, tag_values)})
+        if versions is None:
+            self._count('errors')
+            return None, None, False
+        self._remember_versions(sede, versions)
+
+        if raw is None:
+            self._count('misses')
+            return None, versions, False
+
+        try:
+            entry = self.codec.decode(raw)
+        except Exception as e:
+            # Entradas de otro formato o corruptas se tratan como fallo
+            logger.warning(f"Entrada de cache ilegible {key}: {e}")
+            self._count('errors')
+            self._count('misses')
+            return None, versions, False
+
+        if entry.get('v') != versions:
+            self._count('stale')
+            self._count('misses')
+            return None, versions, False
+
+        self._count('hits')
+        now = time.time()
+        soft = entry.get('soft', entry.get('exp', 0))
+        if now >= soft:
+            self._count('stale_served')
+            return _detach(entry['rows']) if self.local is not None else entry['rows'], versions, True
+
+        # XFetch: cuanto más cara la consulta y más cerca del vencimiento,
+        # más probable es refrescarla antes de que venza
+        delta = entry.get('delta', 0)
+        if delta and now - delta * self.early_refresh_beta * math.log(random.random() or 1e-12) >= soft:
+            self._count('early_refreshes')
+            return _detach(entry['rows']) if self.local is not None else entry['rows'], versions, True
+
+        if self.local is not None:
+            remaining = int(soft - now)
+            if remaining > 0:
+                self.local.put(key, sede, entry['rows'], versions, len(raw), remaining)
+            return _detach(entry['rows']), versions, False
+        return entry['rows'], versions, False
+
+    def current_versions(self, sede: str, tags: List[str]) -> Optional[Dict[str, int]]:
+        values = self.redis.mget([self.tag_key(sede, tag) for tag in tags]) if tags else []
+        if values is None:
+            return None
+        versions = self._seed_versions(sede, {tag: None if value is None else int(value)
+                                              for tag, value in zip(tags, values)})
+        if versions is not None:
+            self._remember_versions(sede, versions)
+        return versions
+
+    def store(self, key: str, sede: str, value: CachedValue, versions: Dict[str, int],
+              ttl: Optional[int] = None, delta: float = 0.0):
+        ttl = ttl or self.default_ttl
+        now = time.time()
+        entry = self.codec.encode({'v': versions, 'soft': now + ttl, 'exp': now + ttl + self.stale_ttl,
+                                   'delta': delta, 'rows': value})
+        self.redis.set_bytes(key, entry, ttl + self.stale_ttl)
+        if key in self._hot_keys:
+            # La clave sombra vence con el TTL suave y su evento dispara el refresco
+            self.redis.set(self.shadow_key(key), '1', ttl)
+        if self.local is not None:
+            self.local.put(key, sede, _detach(value), versions, len(entry), ttl)
+
+    def acquire_refresh(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        return token if self.redis.acquire_lock(self.lock_key(key), token, self.refresh_lease_ms) else None
+
+    def release_refresh(self, key: str, token: str):
+        self.redis.release_lock(self.lock_key(key), token)
+
+    def wait_for(self, key: str, sede: str, tags: List[str]) -> Tuple[Optional[CachedValue], Optional[Dict[str, int]],
+                                                                       Optional[str]]:
+        """
+        Otro proceso está consultando: espera su resultado hasta lock_wait
+        segundos. Quien consulta guarda antes de soltar el lock, así que solo se
+        revisa el cache cuando el lock queda libre (la entrada vieja de antes de
+        una invalidación sigue en Redis y no cuenta). Si al tomarlo no hay un
+        resultado válido se devuelve el token para consultar con el lock.
+        """
+        self._count('lock_waits')
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            token = self.acquire_refresh(key)
+            if token is None:
+                continue
+            value, versions, _ = self.lookup(key, sede, tags)
+            if value is None and versions is not None:
+                return None, versions, token
+            self.release_refresh(key, token)
+            return value, versions, None
+        return None, self.current_versions(sede, tags), None
+
+    def refresh_async(self, key: str, spec: Dict[str, Any]):
+        if self.loader is None:
+            return
+        token = self.acquire_refresh(key)
+        if token is None:
+            return
+        self._executor.submit(self._refresh, key, spec, token)
+
+    def _refresh(self, key: str, spec: Dict[str, Any], token: str):
+        try:
+            versions = self.current_versions(spec['sede'], spec['tags'])
+            if versions is None:
+                return
+            start = time.perf_counter()
+            value = self.loader(spec)
+            if value is not None:
+                self.store(key, spec['sede'], value, versions, spec['ttl'], time.perf_counter() - start)
+                self._count('refreshes')
+        except Exception as e:
+            logger.warning(f"Error al refrescar {key}: {e}")
+        finally:
+            self.release_refresh(key, token)
+
+    def register_hot(self, key: str, spec: Dict[str, Any]):
+        with self._lock:
+            self._hot_keys[key] = {'spec': spec, 'last_access': time.monotonic()}
+            start_listener = self._listener is None
+            if start_listener:
+                self._listener = threading.Thread(target=self._listen_expirations,
+                                                  name='cache-expirations', daemon=True)
+        if start_listener:
+            self._listener.start()
+
+    def _listen_expirations(self):
+        channel = f"__keyevent@{REDIS_CONFIG.get('db', 0)}__:expired"
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                if pubsub is None:
+                    time.sleep(30)
+                    continue
+                pubsub.subscribe(channel)
+                logger.info(f"Escuchando vencimientos de claves calientes en {channel}")
+                for message in pubsub.listen():
+                    expired = message.get('data')
+                    if isinstance(expired, bytes):
+                        expired = expired.decode('utf-8', errors='replace')
+                    if isinstance(expired, str) and expired.endswith(_SHADOW_SUFFIX):
+                        self._on_shadow_expired(expired[:-len(_SHADOW_SUFFIX)])
+            except Exception as e:
+                logger.warning(f"Escucha de vencimientos interrumpida: {e}")
+                time.sleep(5)
+
+    def _on_shadow_expired(self, key: str):
+        with self._lock:
+            hot = self._hot_keys.get(key)
+            if hot is not None and time.monotonic() - hot['last_access'] > self.hot_key_idle:
+                # Nadie la consultó en un buen rato: deja de mantenerse caliente
+                del self._hot_keys[key]
+                hot = None
+        if hot is not None:
+            self.refresh_async(key, hot['spec'])
+
+    def invalidate(self, sede: str, tables: Iterable[str]):
+        tables = [table for table in tables if table]
+        if not tables:
+            return
+        if self.local is not None:
+            self.local.evict_tables(sede, tables)
+
+        new_versions = self.redis.tag_versions([self.tag_key(sede, table) for table in tables], _version_epoch(),
+                                               increment=True)
+        if new_versions:
+            self._remember_versions(sede, dict(zip(tables, new_versions)))
+            with self._lock:
+                self._stats['invalidations'] += len(tables)
+            logger.debug(f"Cache invalidado en {sede}: {tables}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['hits'] + stats['misses']
+        redis_lookups = stats['hits'] + stats['misses']
+        stats['local_hit_ratio'] = stats['local_hits'] / lookups if lookups else 0.0
+        stats['redis_hit_ratio'] = stats['hits'] / redis_lookups if redis_lookups else 0.0
+        stats['hit_ratio'] = (stats['local_hits'] + stats['hits']) / lookups if lookups else 0.0
+        stats['local'] = self.local.get_stats() if self.local is not None else None
+        stats['hot_keys'] = len(self._hot_keys)
+        return stats
+
+
+_LOADERS = {
+    'rows': lambda conn, spec: conn.execute_query(spec['sql'], spec['params']),
+    'df': lambda conn, spec: conn.get_dataframe(spec['sql'], spec['params'])
+}
+
+
+def _load(spec: Dict[str, Any], db=None) -> Optional[CachedValue]:
+    if db is not None:
+        return _LOADERS[spec['kind']](db, spec)
+    with get_db_connection(spec['sede']) as conn:
+        return _LOADERS[spec['kind']](conn, spec) if conn else None
+
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    logger.info("=== CREANDO CACHE DE CONSULTAS ===")
+    return QueryCache(get_redis_connection(), CACHE_CONFIG['key_prefix'], CACHE_CONFIG['default_ttl'],
+                      local_max_bytes=CACHE_CONFIG.get('local_max_bytes', 0),
+                      local_revalidate_interval=CACHE_CONFIG.get('local_revalidate_interval', 2),
+                      codec=CacheCodec(CACHE_CONFIG.get('serializer', 'msgpack'),
+                                       CACHE_CONFIG.get('compression', 'zlib'),
+                                       CACHE_CONFIG.get('compress_threshold', 1024)),
+                      loader=_load,
+                      stale_ttl=CACHE_CONFIG.get('stale_ttl', 0),
+                      refresh_lease_ms=CACHE_CONFIG.get('refresh_lease_ms', 10000),
+                      lock_wait=CACHE_CONFIG.get('lock_wait', 2),
+                      early_refresh_beta=CACHE_CONFIG.get('early_refresh_beta', 1.0),
+                      hot_key_idle=CACHE_CONFIG.get('hot_key_idle', 600))
+
+
+def _through_cache(spec: Dict[str, Any], db=None, hot: bool = False) -> Optional[CachedValue]:
+    cache = get_query_cache() if CACHE_CONFIG['enabled'] else None
+    if cache is None or not cache.redis.is_connected:
+        return _load(spec, db)
+
+    sede, tags = spec['sede'], spec['tags']
+    key = cache.key_for(sede, spec['sql'], spec['params'], spec['kind'])
+    if hot:
+        cache.register_hot(key, spec)
+
+    value, versions, needs_refresh = cache.lookup(key, sede, tags)
+    if value is not None:
+        logger.debug(f"{MESSAGES['cache_hit']}: {sede} {key}")
+        if needs_refresh:
+            cache.refresh_async(key, spec)
+        return value
+    if versions is None:
+        # Redis no respondió: cada llamada más podría esperar su socket_timeout
+        return _load(spec, db)
+    logger.debug(f"{MESSAGES['cache_miss']}: {sede} {key}")
+
+    # Ante un fallo solo un proceso consulta MySQL; el resto espera su resultado
+    # y solo consulta sin el lock si vence lock_wait
+    token = cache.acquire_refresh(key)
+    if token is None:
+        value, versions, token = cache.wait_for(key, sede, tags)
+        if value is not None:
+            return value
+        if versions is None:
+            return _load(spec, db)
+
+    try:
+        start = time.perf_counter()
+        value = _load(spec, db)
+        # Se guardan las versiones leídas antes de consultar: si hubo una escritura
+        # entretanto, la entrada nace inválida en vez de servir datos viejos
+        if value is not None:
+            cache.store(key, sede, value, versions, spec['ttl'], time.perf_counter() - start)
+        return value
+    finally:
+        if token is not None:
+            cache.release_refresh(key, token)
+
+
+def _spec(sede: str, sql: str, params: Optional[Tuple], ttl: Optional[int], tags: Optional[List[str]],
+          kind: str, **extra) -> Dict[str, Any]:
+    return {'sede': sede, 'sql': sql, 'params': params, 'ttl': ttl or CACHE_CONFIG['default_ttl'],
+            'tags': sorted(tags) if tags else extract_read_tables(sql), 'kind': kind, **extra}
+
+
+def cached_query(sede: str, sql: str, params: Optional[Tuple] = None, ttl: Optional[int] = None,
+                 tags: Optional[List[str]] = None, db=None, hot: bool = False) -> Optional[List[Dict]]:
+    """
+    Ejecuta la consulta a través del cache de Redis. Si no se indican tags se
+    usan las tablas del FROM/JOIN. Con db se reutiliza una conexión abierta.
+    Las consultas hot se refrescan solas cuando vence su TTL suave.
+    """
+    return _through_cache(_spec(sede, sql, params, ttl, tags, 'rows'), db, hot)
+
+
+def cached_dataframe(sede: str, sql: str, params: Optional[Tuple] = None, ttl: Optional[int] = None,
+                     tags: Optional[List[str]] = None, db=None, hot: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Como cached_query, pero guarda y devuelve el DataFrame en formato columnar.
+    Las lecturas de tablas enteras no pasan por aquí: se procesan por lotes con
+    DatabaseConnection.iter_dataframes.
+    """
+    return _through_cache(_spec(sede, sql, params, ttl, tags, 'df'), db, hot)
+
+
+def invalidate_tables(sede: str, tables: Iterable[str]):
+    if not CACHE_CONFIG['enabled']:
+        return
+    try:
+        cache = get_query_cache()
+        if cache.redis.is_connected:
+            cache.invalidate(sede, tables)
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar el cache de {sede}: {e}")
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    return get_query_cache().get_stats()
@@ -1,5 +1,6 @@
 import streamlit as st
 from .db_connections import get_redis_connection
+from .query_cache import get_cache_stats
 
 def show_redis_widget():
     st.markdown("### Cache Redis")
@@ -21,6 +22,24 @@ def show_redis_widget():
             
             st.progress(hit_rate / 100)
             
+            cache_stats = get_cache_stats()
+            st.caption("Cache de consultas (este servidor)")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Local", f"{cache_stats['local_hit_ratio'] * 100:.0f}%")
+            with col2:
+                st.metric("Redis", f"{cache_stats['redis_hit_ratio'] * 100:.0f}%")
+            with col3:
+                st.metric("Fallos", cache_stats['misses'])
+            local_stats = cache_stats.get('local')
+            if local_stats:
+                st.caption(f"LRU local: {local_stats['entries']} entradas · "
+                           f"{local_stats['bytes'] / 1024 / 1024:.1f}/{local_stats['max_bytes'] / 1024 / 1024:.0f} MB · "
+                           f"Desalojos: {local_stats['evictions']}")
+            st.caption(f"Hit ratio total: {cache_stats['hit_ratio'] * 100:.1f}% · Invalidaciones: {cache_stats['invalidations']}")
+            st.caption(f"Servidas vencidas: {cache_stats['stale_served']} · Refrescos: {cache_stats['refreshes']} "
+                       f"(anticipados: {cache_stats['early_refreshes']}) · Claves calientes: {cache_stats['hot_keys']}")
+            
         except:
             st.metric("Estado", "Conectado")
             st.caption("Estadísticas no disponibles")
@@ -1,13 +1,152 @@
+import importlib.util
 import logging
+import math
+import threading
 import time
 import json
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 import streamlit as st
-from .db_connections import get_db_connection
+from mysql.connector.errors import PoolError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from .db_connections import (DatabaseConnection, get_db_connection, get_replication_pool, get_circuit_breaker,
+                             get_connection_pool, get_query_executor)
+from .metrics import record_query, record_connect, record_operation
+from config import REPLICATION_CONFIG, OUTBOX_CONFIG, CDC_CONFIG
 
 logger = logging.getLogger(__name__)
 
+# Columnas replicadas de cada tabla maestra; la primera es la clave primaria
+MASTER_COLUMNS = {
+    'sede': ['id_sede', 'nombre', 'direccion'],
+    'carrera': ['id_carrera', 'nombre', 'id_sede'],
+    'profesor': ['id_profesor', 'nombre', 'email', 'id_sede']
+}
+
+# Filas por sentencia en la replicación por lotes
+BATCH_CHUNK_SIZE = 500
+
+# Con la captura del binlog activa el binlog es el único camino hacia los esclavos
+# y no se escribe el outbox: dos caminos sin orden entre sí podrían dejar en un
+# esclavo una versión vieja de la fila
+CDC_ACTIVE = CDC_CONFIG['enabled'] and importlib.util.find_spec('pymysqlreplication') is not None
+
+
+def master_upsert_sql(table: str, rows: int = 1) -> str:
+    """INSERT ... ON DUPLICATE KEY UPDATE multi-fila: aplicar dos veces el mismo cambio no falla."""
+    columns = MASTER_COLUMNS[table]
+    updates = ', '.join(f"{column} = VALUES({column})" for column in columns[1:])
+    row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_placeholder] * rows)} "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+def master_select_sql(table: str) -> str:
+    columns = MASTER_COLUMNS[table]
+    return f"SELECT {', '.join(columns[1:])} FROM {table} WHERE {columns[0]} = %s"
+
+
+def master_row_checksum_sql(table: str) -> str:
+    """CRC32 de las columnas replicadas de una fila, igual en master y esclavos."""
+    row_text = ', '.join(f"IFNULL({column}, '')" for column in MASTER_COLUMNS[table])
+    return f"CRC32(CONCAT_WS('|', {row_text}))"
+
+
+def master_checksum_sql(table: str, keys: int) -> str:
+    """Conteo y XOR de CRC32 por fila sobre las claves dadas: una fila por nodo para comparar el lote."""
+    return (f"SELECT COUNT(*) AS filas, COALESCE(BIT_XOR({master_row_checksum_sql(table)}), 0) AS checksum "
+            f"FROM {table} WHERE {MASTER_COLUMNS[table][0]} IN ({', '.join(['%s'] * keys)})")
+
+
+def _chunks(items: List, size: int) -> List[List]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class SlaveAttempt:
+    """
+    Plazo de un esclavo en _run_on_slaves: o el coordinador lo da por vencido
+    o el esclavo empieza el commit, nunca las dos cosas. Así un esclavo
+    reportado como fallido no puede confirmar el cambio después.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._committing = False
+
+    def begin_commit(self) -> bool:
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._committing = True
+            return True
+
+    def cancel(self) -> bool:
+        """False si el esclavo ya está confirmando: hay que esperar su resultado."""
+        with self._lock:
+            if self._committing:
+                return False
+            self._cancelled = True
+            return True
+
+
+def _apply_on_slave(sede: str, pool, breaker, statements: List[Tuple[str, Tuple]],
+                    verify: List[Tuple[str, Tuple]],
+                    attempt: Optional[SlaveAttempt] = None) -> Tuple[Optional[List[Dict]], Optional[str], float]:
+    """
+    Aplica las sentencias en una transacción del esclavo y con la misma conexión
+    ejecuta las lecturas de verificación; devuelve la primera fila de cada una
+    ({} si no hay). Con attempt las esperas de bloqueos y las lecturas quedan
+    acotadas por su plazo en el servidor y, si venció, se revierte en vez de
+    confirmar.
+    """
+    start = time.perf_counter()
+    db = DatabaseConnection(sede, pool=pool, breaker=breaker)
+    limited = False
+    try:
+        if not db.connect():
+            return None, db.last_error or 'sin conexión', time.perf_counter() - start
+        if attempt:
+            limited = db.execute_update("SET SESSION innodb_lock_wait_timeout = %s, max_execution_time = %s",
+                                        (max(1, math.ceil(attempt.timeout)), int(attempt.timeout * 1000))) is not None
+        try:
+            with db.transaction():
+                for query, params in statements:
+                    db.execute_update(query, params)
+                if attempt and not attempt.begin_commit():
+                    raise TimeoutError(f"plazo de {attempt.timeout}s vencido antes del commit")
+        except Exception as e:
+            return None, str(e), time.perf_counter() - start
+        verified = []
+        for query, params in verify:
+            rows = db.execute_query(query, params)
+            if rows is None:
+                return None, db.last_error, time.perf_counter() - start
+            verified.append(rows[0] if rows else {})
+        return verified, None, time.perf_counter() - start
+    finally:
+        if limited:
+            # La conexión vuelve al pool: se restauran los valores de la sesión
+            db.execute_update("SET SESSION innodb_lock_wait_timeout = DEFAULT, max_execution_time = DEFAULT")
+        db.disconnect()
+
+
+def _record_late_outcome(table: str, sede: str, future):
+    """Resultado de un esclavo que ya se reportó como vencido."""
+    if future.cancelled():
+        return
+    try:
+        rows, error, elapsed = future.result()
+    except Exception as e:
+        rows, error, elapsed = None, str(e), 0.0
+    record_operation(f'replicacion_{table}_tardia', sede, elapsed, error=rows is None)
+    if rows is None:
+        logger.warning(f"{table.capitalize()} en {sede}: el intento vencido terminó revertido ({error})")
+    else:
+        logger.error(f"{table.capitalize()} en {sede}: el intento reportado como vencido se confirmó "
+                     f"en {elapsed:.3f}s; la verificación de consistencia lo reconcilia")
+
 class ReplicationConnection:
     def __init__(self):
         self.replication_config = {
@@ -25,14 +164,19 @@ class ReplicationConnection:
             return get_db_connection('central')
     
     def _get_replication_connection(self):
-        return ReplicationDatabaseConnection(self.replication_config)
+        # El usuario de replicación vive en el nodo central: comparte su circuito
+        return ReplicationDatabaseConnection(self.replication_config, pool=get_replication_pool(),
+                                             breaker=get_circuit_breaker('central'))
 
 class ReplicationDatabaseConnection:
     
-    def __init__(self, config):
+    def __init__(self, config, pool=None, breaker=None):
         self.config = config
+        self.pool = pool
+        self.breaker = breaker
         self.connection = None
         self.cursor = None
+        self._broken = False
         
     def __enter__(self):
         self.connect()
@@ -42,44 +186,110 @@ class ReplicationDatabaseConnection:
         self.disconnect()
         
     def connect(self):
+        if self.breaker and not self.breaker.allow_request():
+            logger.warning("Nodo central no disponible: circuito abierto")
+            return False
+        start = time.perf_counter()
         try:
-            import mysql.connector
-            self.connection = mysql.connector.connect(**self.config)
-            if self.connection.is_connected():
+            verified = True
+            if self.pool:
+                self.connection, verified = self.pool.checkout_verified()
+            else:
+                import mysql.connector
+                self.connection = mysql.connector.connect(**self.config)
+            if self.pool or self.connection.is_connected():
+                record_connect('replicacion', 'central', time.perf_counter() - start)
+                self._broken = False
                 self.cursor = self.connection.cursor(dictionary=True)
-                logger.info("Conexión establecida con usuario de replicación")
+                # Sin ping del pool el éxito se anota al completar una consulta
+                if self.breaker and verified:
+                    self.breaker.record_success()
+                logger.debug("Conexión obtenida con usuario de replicación")
                 return True
         except Exception as e:
+            record_connect('replicacion', 'central', time.perf_counter() - start, error=True)
             logger.error(f"Error conectando con usuario replicación: {e}")
+            if self.breaker and not isinstance(e, PoolError):
+                self.breaker.record_failure(str(e))
             return False
     
     def disconnect(self):
         try:
             if self.cursor:
                 self.cursor.close()
-            if self.connection and self.connection.is_connected():
+        except Exception as e:
+            logger.error(f"Error cerrando cursor de replicación: {e}")
+            self._broken = True
+        finally:
+            self.cursor = None
+        
+        try:
+            if self.pool:
+                self.pool.checkin(self.connection, discard=self._broken)
+            elif self.connection and self.connection.is_connected():
                 self.connection.close()
                 logger.info("Desconexión del usuario de replicación")
         except Exception as e:
             logger.error(f"Error desconectando usuario replicación: {e}")
+        finally:
+            self.connection = None
     
     def execute_query(self, query: str, params: Optional[Tuple] = None):
+        start = None
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
+            if not self.connection or not (self.pool or self.connection.is_connected()):
+                if self.connection:
+                    self.disconnect()
+                if not self.connect():
+                    return None
             
+            start = time.perf_counter()
             self.cursor.execute(query, params)
-            return self.cursor.fetchall()
+            executed = time.perf_counter()
+            results = self.cursor.fetchall()
+            record_query('replicacion', 'central', query, executed - start, time.perf_counter() - executed, len(results))
+            if self.breaker:
+                self.breaker.record_success()
+            return results
         except Exception as e:
+            if start is not None:
+                record_query('replicacion', 'central', query, time.perf_counter() - start, error=True)
             logger.error(f"Error en consulta de replicación: {e}")
+            self._broken = True
             return None
 
 class MasterSlaveReplication:
-    def __init__(self):
-        self.master_sede = 'central'
-        self.slave_sedes = ['sancarlos', 'heredia']
+    def __init__(self, asynchronous: Optional[bool] = None):
+        self.master_sede = REPLICATION_CONFIG['master_sede']
+        self.slave_sedes = list(REPLICATION_CONFIG['slave_sedes'])
         self.replication_conn = ReplicationConnection()
+        # Asíncrona: replication_worker.py aplica el cambio en los esclavos, desde el
+        # binlog (CDC_ACTIVE) o desde las filas que la escritura deja en
+        # replication_log. Con asynchronous=False se aplica además en el momento;
+        # con CDC activo el binlog lo vuelve a aplicar después, en orden, y el
+        # resultado final es el mismo
+        if asynchronous is None:
+            asynchronous = OUTBOX_CONFIG['enabled'] or CDC_ACTIVE
+        self.asynchronous = asynchronous
+        self.use_outbox = asynchronous and not CDC_ACTIVE
         
+    def _step_reporter(self, progress_callback, first_step: int, total_steps: int):
+        steps = {'current': first_step}
+        def report(sede):
+            steps['current'] += 1
+            if progress_callback:
+                progress_callback(steps['current'] / total_steps)
+        return report
+    
+    def _report_queued(self, table: str, ids: List[int], progress_callback=None, status_callback=None) -> bool:
+        if progress_callback:
+            progress_callback(1.0)
+        if status_callback:
+            status_callback(f"✅ {len(ids)} fila(s) de {table} confirmadas en Central; "
+                            f"las sedes se actualizan en segundo plano")
+        logger.info(f"{table.capitalize()} {ids[0]}{'...' if len(ids) > 1 else ''} encolado para {', '.join(self.slave_sedes)}")
+        return True
+    
     def replicate_carrera(self, nombre_carrera: str, id_sede: int, progress_callback=None, status_callback=None) -> bool:
         try:
             total_steps = 5
@@ -103,27 +313,19 @@ class MasterSlaveReplication:
             current_step += 1
             if progress_callback:
                 progress_callback(current_step / total_steps)
-
-            replication_results = {}
             
-            for sede_slave in self.slave_sedes:
-                success = self._replicate_carrera_to_slave(carrera_id, nombre_carrera, id_sede, sede_slave)
-                replication_results[sede_slave] = success
-                
-                current_step += 1
-                if progress_callback:
-                    progress_callback(current_step / total_steps)
-                
-                time.sleep(0.5)
-            
-            consistency_check = self._verify_carrera_consistency(carrera_id)
+            if self.asynchronous:
+                return self._report_queued('carrera', [carrera_id], progress_callback, status_callback)
+
+            replication_results, consistency_check = self._apply_to_slaves(
+                'carrera', {'id_carrera': carrera_id, 'nombre': nombre_carrera, 'id_sede': id_sede},
+                self._step_reporter(progress_callback, current_step, total_steps))
             
             self._log_replication_audit('carrera', carrera_id, {
                 'nombre': nombre_carrera, 
                 'id_sede': id_sede
             }, replication_results, consistency_check)
             
-            current_step += 1
             if progress_callback:
                 progress_callback(1.0)
             
@@ -177,19 +379,13 @@ class MasterSlaveReplication:
             if progress_callback:
                 progress_callback(current_step / total_steps)
             
-            replication_results = {}
+            if self.asynchronous:
+                return self._report_queued('profesor', [profesor_id], progress_callback, status_callback)
             
-            for sede_slave in self.slave_sedes:
-                success = self._replicate_profesor_to_slave(profesor_id, nombre_profesor, email_profesor, id_sede, sede_slave)
-                replication_results[sede_slave] = success
-                
-                current_step += 1
-                if progress_callback:
-                    progress_callback(current_step / total_steps)
-                
-                time.sleep(0.5)
-            
-            consistency_check = self._verify_profesor_consistency(profesor_id)
+            replication_results, consistency_check = self._apply_to_slaves(
+                'profesor', {'id_profesor': profesor_id, 'nombre': nombre_profesor,
+                             'email': email_profesor, 'id_sede': id_sede},
+                self._step_reporter(progress_callback, current_step, total_steps))
             
             self._log_replication_audit('profesor', profesor_id, {
                 'nombre': nombre_profesor,
@@ -197,7 +393,6 @@ class MasterSlaveReplication:
                 'id_sede': id_sede
             }, replication_results, consistency_check)
             
-            current_step += 1
             if progress_callback:
                 progress_callback(1.0)
             
@@ -259,18 +454,17 @@ class MasterSlaveReplication:
                     raise Exception("No se pudo conectar con usuario admin")
                 
                 query = "INSERT INTO carrera (nombre, id_sede) VALUES (%s, %s)"
-                affected_rows = db.execute_update(query, (nombre_carrera, id_sede))
-                
-                if affected_rows and affected_rows > 0:
-                    query_id = "SELECT LAST_INSERT_ID() as id"
-                    result = db.execute_query(query_id)
-                    
-                    if result and len(result) > 0:
-                        carrera_id = result[0]['id']
-                        logger.info(f"🔧 Carrera insertada con usuario admin: ID {carrera_id}")
-                        return carrera_id
-                
-                raise Exception("No se pudo obtener el ID de la carrera insertada")
+                with db.transaction():
+                    affected_rows = db.execute_update(query, (nombre_carrera, id_sede))
+                    if not (affected_rows and affected_rows > 0 and db.last_insert_id):
+                        raise Exception("No se pudo obtener el ID de la carrera insertada")
+                    carrera_id = db.last_insert_id
+                    if self.use_outbox:
+                        self._append_outbox(db, 'carrera', [{'id_carrera': carrera_id, 'nombre': nombre_carrera,
+                                                             'id_sede': id_sede}])
+                
+                logger.info(f"🔧 Carrera insertada con usuario admin: ID {carrera_id}")
+                return carrera_id
                 
         except Exception as e:
             logger.error(f"Error al insertar carrera en Master: {e}")
@@ -283,175 +477,275 @@ class MasterSlaveReplication:
                     raise Exception("No se pudo conectar con usuario admin")
                 
                 query = "INSERT INTO profesor (nombre, email, id_sede) VALUES (%s, %s, %s)"
-                affected_rows = db.execute_update(query, (nombre_profesor, email_profesor, id_sede))
-                
-                if affected_rows and affected_rows > 0:
-                    query_id = "SELECT LAST_INSERT_ID() as id"
-                    result = db.execute_query(query_id)
-                    
-                    if result and len(result) > 0:
-                        profesor_id = result[0]['id']
-                        logger.info(f"🔧 Profesor insertado con usuario admin: ID {profesor_id}")
-                        return profesor_id
-                
-                raise Exception("No se pudo obtener el ID del profesor insertado")
+                with db.transaction():
+                    affected_rows = db.execute_update(query, (nombre_profesor, email_profesor, id_sede))
+                    if not (affected_rows and affected_rows > 0 and db.last_insert_id):
+                        raise Exception("No se pudo obtener el ID del profesor insertado")
+                    profesor_id = db.last_insert_id
+                    if self.use_outbox:
+                        self._append_outbox(db, 'profesor', [{'id_profesor': profesor_id, 'nombre': nombre_profesor,
+                                                              'email': email_profesor, 'id_sede': id_sede}])
+                
+                logger.info(f"🔧 Profesor insertado con usuario admin: ID {profesor_id}")
+                return profesor_id
                 
         except Exception as e:
             logger.error(f"Error al insertar profesor en Master: {e}")
             return None
     
-    def _replicate_carrera_to_slave(self, carrera_id: int, nombre_carrera: str, id_sede: int, sede_slave: str) -> bool:
-        try:
-            with get_db_connection(sede_slave) as db:
-                if not db:
-                    raise Exception(f"No se pudo conectar a {sede_slave}")
-                
-                check_query = "SELECT COUNT(*) as count FROM carrera WHERE id_carrera = %s"
-                result = db.execute_query(check_query, (carrera_id,))
-                
-                if result and result[0]['count'] > 0:
-                    logger.info(f"Carrera ID {carrera_id} ya existe en {sede_slave}, actualizando")
-                    update_query = """
-                    UPDATE carrera 
-                    SET nombre = %s, id_sede = %s 
-                    WHERE id_carrera = %s
-                    """
-                    affected_rows = db.execute_update(update_query, (nombre_carrera, id_sede, carrera_id))
-                    return affected_rows is not None and affected_rows >= 0
-                
-                insert_query = """
-                INSERT INTO carrera (id_carrera, nombre, id_sede) 
-                VALUES (%s, %s, %s)
-                """
-                
-                affected_rows = db.execute_update(insert_query, (carrera_id, nombre_carrera, id_sede))
-                
-                if affected_rows and affected_rows > 0:
-                    logger.info(f"🔧 Carrera '{nombre_carrera}' REPLICADA COMPLETAMENTE a {sede_slave}")
-                    return True
-                else:
-                    raise Exception(f"No se afectaron filas en {sede_slave}")
-                    
-        except Exception as e:
-            logger.error(f"Error replicando carrera a {sede_slave}: {e}")
-            return False
+    def _apply_to_slaves(self, table: str, row: Dict, on_slave_done=None) -> Tuple[Dict[str, bool], bool]:
+        """
+        Aplica la fila en todos los esclavos a la vez, cada uno con su plazo, y
+        mientras tanto lee la fila del maestro para la verificación. Cada esclavo
+        hace el upsert y la lectura de verificación con la misma conexión.
+        """
+        columns = MASTER_COLUMNS[table]
+        key = row[columns[0]]
+        statements = [(master_upsert_sql(table), tuple(row[column] for column in columns))]
+        verify = [(master_select_sql(table), (key,))]
+        
+        slave_results = self._run_on_slaves(table, statements, verify, lambda: self._read_master_rows(verify),
+                                            on_slave_done)
+        master_rows = slave_results.pop(None)
+        replication_results = {sede: rows is not None for sede, rows in slave_results.items()}
+        slave_rows = {sede: rows[0] if rows is not None else None for sede, rows in slave_results.items()}
+        master_row = master_rows[0] if master_rows else None
+        return replication_results, self._check_consistency(table, key, master_row, slave_rows)
+    
+    def _run_on_slaves(self, table: str, statements: List[Tuple[str, Tuple]], verify: List[Tuple[str, Tuple]],
+                       read_master, on_slave_done=None) -> Dict[Optional[str], Optional[List[Dict]]]:
+        """
+        Lanza _apply_on_slave en todos los esclavos a la vez, cada uno con su
+        plazo, y mientras tanto ejecuta read_master(). Devuelve por sede las filas
+        de verificación (None si falló) y bajo la clave None lo leído del maestro.
+        """
+        executor = get_query_executor()
+        start = time.perf_counter()
+        attempts = {sede: SlaveAttempt(REPLICATION_CONFIG['slave_timeouts'].get(sede, REPLICATION_CONFIG['slave_timeout']))
+                    for sede in self.slave_sedes}
+        futures = {
+            sede: executor.submit(_apply_on_slave, sede, get_connection_pool(sede), get_circuit_breaker(sede),
+                                  statements, verify, attempts[sede])
+            for sede in self.slave_sedes
+        }
+        
+        results = {None: read_master()}
+        for sede, future in futures.items():
+            timeout = attempts[sede].timeout
+            remaining = max(0.0, start + timeout - time.perf_counter())
+            try:
+                try:
+                    rows, error, elapsed = future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    if future.cancel() or attempts[sede].cancel():
+                        raise
+                    # Ya está confirmando: su resultado es el que vale
+                    rows, error, elapsed = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # Lo que termine después (normalmente revertido) queda registrado
+                future.add_done_callback(lambda done, sede=sede: _record_late_outcome(table, sede, done))
+                rows, error, elapsed = None, f"sin respuesta en {timeout}s", time.perf_counter() - start
+            except Exception as e:
+                rows, error, elapsed = None, str(e), time.perf_counter() - start
+            
+            record_operation(f'replicacion_{table}', sede, elapsed, error=rows is None)
+            if rows is None:
+                logger.error(f"Error replicando {table} a {sede}: {error}")
+            else:
+                logger.info(f"🔧 {table.capitalize()}: {len(statements)} sentencia(s) aplicadas en {sede} en {elapsed:.3f}s")
+            results[sede] = rows
+            if on_slave_done:
+                on_slave_done(sede)
+        return results
     
-    def _replicate_profesor_to_slave(self, profesor_id: int, nombre_profesor: str, email_profesor: str, id_sede: int, sede_slave: str) -> bool:
+    def _read_master_rows(self, queries: List[Tuple[str, Tuple]]) -> Optional[List[Dict]]:
         try:
-            with get_db_connection(sede_slave) as db:
+            with self.replication_conn.get_master_connection('read') as db:
                 if not db:
-                    raise Exception(f"No se pudo conectar a {sede_slave}")
-                
-                check_query = "SELECT COUNT(*) as count FROM profesor WHERE id_profesor = %s OR email = %s"
-                result = db.execute_query(check_query, (profesor_id, email_profesor))
-                
-                if result and result[0]['count'] > 0:
-                    logger.info(f"Profesor ID {profesor_id} ya existe en {sede_slave}, actualizando")
-                    update_query = """
-                    UPDATE profesor 
-                    SET nombre = %s, email = %s, id_sede = %s 
-                    WHERE id_profesor = %s OR email = %s
-                    """
-                    affected_rows = db.execute_update(update_query, (nombre_profesor, email_profesor, id_sede, profesor_id, email_profesor))
-                    return affected_rows is not None and affected_rows >= 0
-                
-                insert_query = """
-                INSERT INTO profesor (id_profesor, nombre, email, id_sede) 
-                VALUES (%s, %s, %s, %s)
-                """
-                
-                affected_rows = db.execute_update(insert_query, (profesor_id, nombre_profesor, email_profesor, id_sede))
-                
-                if affected_rows and affected_rows > 0:
-                    logger.info(f"🔧 Profesor '{nombre_profesor}' REPLICADO COMPLETAMENTE a {sede_slave}")
-                    return True
-                else:
-                    raise Exception(f"No se afectaron filas en {sede_slave}")
-                    
+                    return None
+                rows = []
+                for query, params in queries:
+                    result = db.execute_query(query, params)
+                    if result is None:
+                        return None
+                    rows.append(result[0] if result else {})
+                return rows
         except Exception as e:
-            logger.error(f"Error replicando profesor a {sede_slave}: {e}")
-            return False
+            logger.error(f"Error leyendo el Master para verificación: {e}")
+            return None
     
-    def _verify_carrera_consistency(self, carrera_id: int) -> bool:
+    def replicate_batch(self, table: str, rows: List[Dict], progress_callback=None, status_callback=None) -> Dict:
+        """
+        Replica muchas filas de una tabla maestra con un costo fijo por lote: una
+        verificación de permisos, un INSERT multi-fila en el maestro dentro de una
+        transacción, un upsert multi-fila por esclavo (en paralelo), una sola
+        comparación por conteo y checksum del lote y un registro de auditoría.
+        Las filas pueden traer la clave primaria; si no, la asigna el maestro.
+        """
+        start = time.perf_counter()
+        outcome = {'exito': False, 'ids': [], 'resultados': {}, 'consistente': False, 'segundos': 0.0}
         try:
-            with self.replication_conn.get_master_connection('read') as db:
-                if not db:
-                    return False
-                
-                query = "SELECT nombre, id_sede FROM carrera WHERE id_carrera = %s"
-                master_result = db.execute_query(query, (carrera_id,))
-                
-                if not master_result or len(master_result) == 0:
-                    logger.error(f"Carrera {carrera_id} no encontrada en Master")
-                    return False
-                
-                master_data = master_result[0]
+            if table not in MASTER_COLUMNS:
+                raise ValueError(f"Tabla '{table}' no es una tabla maestra replicada")
+            if not rows:
+                raise ValueError("El lote no tiene filas")
+            columns = MASTER_COLUMNS[table]
+            key_column = columns[0]
+            with_keys = key_column in rows[0]
+            expected = columns if with_keys else columns[1:]
+            for row in rows:
+                missing = [column for column in expected if column not in row]
+                if missing:
+                    raise ValueError(f"Fila sin columnas {', '.join(missing)}: {row}")
+            
+            total_steps = len(self.slave_sedes) + 3
+            current_step = 0
+            if status_callback:
+                status_callback(f"Procesando lote de {len(rows)} filas de {table}...")
             
-            for sede_slave in self.slave_sedes:
-                with get_db_connection(sede_slave) as db:
-                    if not db:
-                        return False
-                    
-                    result = db.execute_query(query, (carrera_id,))
-                    
-                    if not result or len(result) == 0:
-                        logger.error(f"Carrera {carrera_id} no replicada en {sede_slave}")
-                        return False
-                    
-                    slave_data = result[0]
-                    
-                    if (slave_data['nombre'] != master_data['nombre'] or 
-                        slave_data['id_sede'] != master_data['id_sede']):
-                        logger.error(f"Datos inconsistentes en {sede_slave}")
-                        return False
+            if not self._verify_replication_permissions():
+                raise Exception("Error en verificación de permisos de replicación")
+            current_step += 1
+            if progress_callback:
+                progress_callback(current_step / total_steps)
             
-            logger.info(f"🔍 Consistencia verificada para carrera {carrera_id}")
-            return True
+            ids = self._insert_batch_master(table, [{column: row[column] for column in expected} for row in rows],
+                                            key_column if with_keys else None)
+            if not ids or len(ids) != len(rows):
+                raise Exception("Error al insertar el lote en Master")
+            outcome['ids'] = ids
+            current_step += 1
+            if progress_callback:
+                progress_callback(current_step / total_steps)
+            
+            if self.asynchronous:
+                outcome['exito'] = outcome['encolado'] = self._report_queued(table, ids, progress_callback, status_callback)
+                outcome['segundos'] = time.perf_counter() - start
+                return outcome
+            
+            full_rows = [{key_column: id_value, **{column: row[column] for column in columns[1:]}}
+                         for id_value, row in zip(ids, rows)]
+            statements = [
+                (master_upsert_sql(table, len(chunk)), tuple(row[column] for row in chunk for column in columns))
+                for chunk in _chunks(full_rows, BATCH_CHUNK_SIZE)
+            ]
+            verify = [(master_checksum_sql(table, len(chunk)), tuple(chunk)) for chunk in _chunks(ids, BATCH_CHUNK_SIZE)]
+            
+            results = self._run_on_slaves(table, statements, verify, lambda: self._read_master_rows(verify),
+                                          self._step_reporter(progress_callback, current_step, total_steps))
+            master_parts = results.pop(None)
+            outcome['resultados'] = {sede: parts is not None for sede, parts in results.items()}
+            outcome['consistente'] = self._check_batch_consistency(table, len(rows), master_parts, results)
+            
+            self._log_replication_audit(table, ids[0], {
+                'filas': len(rows),
+                'ids': ids
+            }, outcome['resultados'], outcome['consistente'])
+            
+            if progress_callback:
+                progress_callback(1.0)
+            outcome['exito'] = all(outcome['resultados'].values()) and outcome['consistente']
             
+            if status_callback:
+                if outcome['exito']:
+                    status_callback(f"✅ Lote de {len(rows)} filas de {table} replicado exitosamente")
+                else:
+                    failed_sedes = [sede for sede, success in outcome['resultados'].items() if not success]
+                    details = ["verificación de consistencia falló"] if not outcome['consistente'] else []
+                    if failed_sedes:
+                        details.append(f"replicación falló en: {', '.join(failed_sedes)}")
+                    status_callback(f"❌ Error: {'; '.join(details)}")
         except Exception as e:
-            logger.error(f"Error en verificación de consistencia de carrera: {e}")
-            return False
+            logger.error(f"Error en replicación por lote de {table}: {e}")
+            outcome['error'] = str(e)
+            if status_callback:
+                status_callback(f"❌ Error en replicación: {str(e)}")
+        
+        outcome['segundos'] = time.perf_counter() - start
+        record_operation(f'replicacion_lote_{table}', 'central', outcome['segundos'], error=not outcome['exito'])
+        logger.info(f"Lote de {table}: {len(rows)} filas en {outcome['segundos']:.2f}s (éxito: {outcome['exito']})")
+        return outcome
     
-    def _verify_profesor_consistency(self, profesor_id: int) -> bool:
+    def _insert_batch_master(self, table: str, rows: List[Dict], key_column: Optional[str]) -> Optional[List[int]]:
         try:
-            with self.replication_conn.get_master_connection('read') as db:
+            with self.replication_conn.get_master_connection('write') as db:
                 if not db:
-                    return False
-                
-                query = "SELECT nombre, email, id_sede FROM profesor WHERE id_profesor = %s"
-                master_result = db.execute_query(query, (profesor_id,))
-                
-                if not master_result or len(master_result) == 0:
-                    logger.error(f"Profesor {profesor_id} no encontrado en Master")
-                    return False
-                
-                master_data = master_result[0]
-            
-            for sede_slave in self.slave_sedes:
-                with get_db_connection(sede_slave) as db:
-                    if not db:
-                        return False
-                    
-                    result = db.execute_query(query, (profesor_id,))
-                    
-                    if not result or len(result) == 0:
-                        logger.error(f"Profesor {profesor_id} no replicado en {sede_slave}")
-                        return False
-                    
-                    slave_data = result[0]
-                    
-                    if (slave_data['nombre'] != master_data['nombre'] or 
-                        slave_data['email'] != master_data['email'] or
-                        slave_data['id_sede'] != master_data['id_sede']):
-                        logger.error(f"Datos de profesor inconsistentes en {sede_slave}")
-                        return False
-            
-            logger.info(f"Consistencia verificada para profesor {profesor_id}")
-            return True
-            
+                    raise Exception("No se pudo conectar con usuario admin")
+                with db.transaction():
+                    ids = db.bulk_insert(table, rows, chunk_size=BATCH_CHUNK_SIZE, id_column=key_column)
+                    if self.use_outbox:
+                        master_key = MASTER_COLUMNS[table][0]
+                        self._append_outbox(db, table, [{master_key: id_value, **row} for id_value, row in zip(ids, rows)])
+                logger.info(f"🔧 {len(rows)} filas de {table} insertadas en Master en una transacción")
+                return ids
         except Exception as e:
-            logger.error(f"Error en verificación de consistencia de profesor: {e}")
+            logger.error(f"Error al insertar lote de {table} en Master: {e}")
+            return None
+    
+    def _append_outbox(self, db, table: str, rows: List[Dict], operacion: str = 'INSERT'):
+        """
+        Una fila 'pendiente' de replication_log por fila maestra, dentro de la
+        transacción abierta en db: el cambio y su registro se confirman juntos.
+        """
+        key_column = MASTER_COLUMNS[table][0]
+        entries = [{
+            'tabla_afectada': table,
+            'operacion': operacion,
+            'registro_id': row[key_column],
+            'datos_nuevos': json.dumps({'fila': row}, default=str),
+            'usuario': f'sistema_replicacion_{table}',
+            'sede_destino': ','.join(self.slave_sedes),
+            'estado_replicacion': 'pendiente'
+        } for row in rows]
+        db.bulk_insert(REPLICATION_CONFIG['replication_log_table'], entries, chunk_size=BATCH_CHUNK_SIZE)
+    
+    def _check_batch_consistency(self, table: str, expected_rows: int, master_parts: Optional[List[Dict]],
+                                 slave_parts: Dict[str, Optional[List[Dict]]]) -> bool:
+        def combine(parts):
+            checksum = 0
+            for part in parts:
+                checksum ^= int(part.get('checksum') or 0)
+            return sum(int(part.get('filas') or 0) for part in parts), checksum
+        
+        if master_parts is None:
+            logger.error(f"No se pudo leer el lote de {table} del Master")
+            return False
+        master_summary = combine(master_parts)
+        if master_summary[0] != expected_rows:
+            logger.error(f"Master tiene {master_summary[0]} de {expected_rows} filas del lote de {table}")
             return False
+        
+        consistent = True
+        for sede, parts in slave_parts.items():
+            if parts is None:
+                consistent = False
+                continue
+            summary = combine(parts)
+            if summary != master_summary:
+                logger.error(f"Lote de {table} inconsistente en {sede}: {summary[0]} filas, "
+                             f"checksum {summary[1]} (Master: {master_summary[0]}, {master_summary[1]})")
+                consistent = False
+        if consistent:
+            logger.info(f"🔍 Consistencia verificada para lote de {expected_rows} filas de {table}")
+        return consistent
+    
+    def _check_consistency(self, table: str, key, master_row: Optional[Dict], slave_rows: Dict[str, Optional[Dict]]) -> bool:
+        if not master_row:
+            logger.error(f"{table.capitalize()} {key} no encontrado en Master")
+            return False
+        
+        for sede, slave_row in slave_rows.items():
+            if slave_row is None:
+                return False
+            if not slave_row:
+                logger.error(f"{table.capitalize()} {key} no replicado en {sede}")
+                return False
+            if any(slave_row[column] != master_row[column] for column in master_row):
+                logger.error(f"Datos de {table} inconsistentes en {sede}")
+                return False
+        
+        logger.info(f"🔍 Consistencia verificada para {table} {key}")
+        return True
     
     def _log_replication_audit(self, tabla: str, registro_id: int, datos: Dict, replication_results: Dict[str, bool], consistency_check: bool):
         try:
@@ -665,6 +959,21 @@ def execute_profesor_replication(nombre_profesor: str, email_profesor: str, sede
     return success
 
 
+def execute_batch_replication(table: str, rows: List[Dict], progress_bar=None, status_container=None) -> Dict:
+    replicator = MasterSlaveReplication()
+    
+    def update_progress(progress):
+        if progress_bar:
+            progress_bar.progress(progress)
+    
+    def update_status(message):
+        if status_container:
+            with status_container:
+                st.info(message)
+    
+    return replicator.replicate_batch(table, rows, progress_callback=update_progress, status_callback=update_status)
+
+
 def _insert_profesor_planilla(profesor_id: int, salario: float) -> bool:
     try:
         from datetime import datetime
@@ -0,0 +1,253 @@
+"""
+Directorio global de estudiantes en Redis: email -> sede, id_estudiante y estado
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+import streamlit as st
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DIRECTORY_CONFIG
+from utils.db_connections import RedisConnection, get_redis_connection
+from utils.async_db import run_distributed_queries
+from utils.fragment_router import route_query, sede_for_id
+
+logger = logging.getLogger(__name__)
+
+TRANSFERIDO = 'transferido'
+
+_LOOKUP_SQL = "SELECT id_estudiante, email, estado, sede_actual FROM estudiante WHERE email = %s"
+_BACKFILL_SQL = "SELECT id_estudiante, email, estado, sede_actual FROM estudiante WHERE email IS NOT NULL"
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def build_entry(rows_by_sede: Dict[str, List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Entrada del directorio a partir de las filas de un mismo email en cada sede.
+    La sede del estudiante es la de su fila activa; si todas están marcadas como
+    transferidas se usa la sede a la que apunta sede_actual. ids guarda el
+    id_estudiante de cada sede donde hay fila (los id se repiten entre sedes).
+    """
+    ids = {}
+    active = None
+    for sede, rows in rows_by_sede.items():
+        for row in rows:
+            ids[sede] = int(row['id_estudiante'])
+            estado = row.get('estado') or 'activo'
+            if estado == TRANSFERIDO:
+                continue
+            if active is not None:
+                logger.warning(f"Email {row.get('email')} activo en {active[0]} y en {sede}; se usa {active[0]}")
+                continue
+            active = (sede, int(row['id_estudiante']), estado)
+
+    if not ids:
+        return None
+    if active is None:
+        first = next(row for rows in rows_by_sede.values() for row in rows)
+        sede = sede_for_id(first['sede_actual']) if first.get('sede_actual') else None
+        if sede not in ids:
+            sede = next(iter(ids))
+        active = (sede, ids[sede], TRANSFERIDO)
+
+    sede, id_estudiante, estado = active
+    return {'sede': sede, 'id_estudiante': id_estudiante, 'estado': estado, 'ids': ids}
+
+
+class StudentDirectory:
+    """
+    Un hash de Redis por email (sin expiración) con la sede, el id y el estado
+    del estudiante más los campos id:<sede> de cada copia. Lo mantienen el alta
+    de estudiantes y las transferencias, y backfill() lo reconstruye desde las
+    sedes. Solo acelera los aciertos: un email ausente nunca prueba nada (la
+    entrada puede haber sido expulsada de Redis o la fila escrita fuera de la
+    aplicación) y quien consulta debe ir a las bases de datos.
+    """
+
+    def __init__(self, redis_conn: RedisConnection, key_prefix: str, reservation_ms: int, backfill_batch: int):
+        self.redis = redis_conn
+        self.key_prefix = key_prefix
+        self.reservation_ms = reservation_ms
+        self.backfill_batch = backfill_batch
+
+    def email_key(self, email: str) -> str:
+        return f"{self.key_prefix}:email:{normalize_email(email)}"
+
+    def meta_key(self) -> str:
+        return f"{self.key_prefix}:meta"
+
+    def reservation_key(self, email: str) -> str:
+        return f"{self.key_prefix}:reserva:{normalize_email(email)}"
+
+    @staticmethod
+    def _encode(entry: Dict[str, Any]) -> Dict[str, str]:
+        values = {'sede': entry['sede'], 'id_estudiante': str(entry['id_estudiante']), 'estado': entry['estado']}
+        values.update({f"id:{sede}": str(id_estudiante) for sede, id_estudiante in entry.get('ids', {}).items()})
+        return values
+
+    @staticmethod
+    def _decode(values: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        if not values or 'sede' not in values:
+            return None
+        return {
+            'sede': values['sede'],
+            'id_estudiante': int(values['id_estudiante']),
+            'estado': values.get('estado', 'activo'),
+            'ids': {field[3:]: int(value) for field, value in values.items() if field.startswith('id:')}
+        }
+
+    def lookup(self, email: str) -> Optional[Dict[str, Any]]:
+        """
+        Entrada del email o None. Un None no prueba que el email no exista: la
+        entrada puede haber sido expulsada de Redis o la fila escrita fuera de
+        la aplicación, así que antes de insertar hay que consultar las sedes.
+        """
+        hashes = self.redis.get_hashes([self.email_key(email)])
+        return self._decode(hashes[0]) if hashes else None
+
+    def status(self) -> Dict[str, Any]:
+        hashes = self.redis.get_hashes([self.meta_key()])
+        meta = hashes[0] if hashes else {}
+        return {
+            'disponible': hashes is not None,
+            'completo': meta.get('completo') == '1',
+            'entradas': int(meta.get('entradas', 0)),
+            'reconstruido': meta.get('reconstruido')
+        }
+
+    def register(self, email: str, sede: str, id_estudiante: int, estado: str = 'activo') -> bool:
+        entry = {'sede': sede, 'id_estudiante': int(id_estudiante), 'estado': estado, 'ids': {sede: int(id_estudiante)}}
+        return self.redis.update_hashes({self.email_key(email): self._encode(entry)})
+
+    def record_transfer(self, email: str, from_sede: str, from_id: int, to_sede: str, to_id: int) -> bool:
+        entry = {'sede': to_sede, 'id_estudiante': int(to_id), 'estado': 'activo',
+                 'ids': {from_sede: int(from_id), to_sede: int(to_id)}}
+        return self.redis.update_hashes({self.email_key(email): self._encode(entry)})
+
+    @contextmanager
+    def reservation(self, email: str) -> Iterator[bool]:
+        """
+        Bloqueo corto sobre el email durante el alta: entre la verificación y el
+        INSERT otra sesión no puede usar el mismo email. Sin Redis no hay
+        reserva posible y se deja pasar.
+        """
+        if not self.redis.is_connected:
+            yield True
+            return
+        key = self.reservation_key(email)
+        token = uuid.uuid4().hex
+        acquired = self.redis.acquire_lock(key, token, self.reservation_ms)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.redis.release_lock(key, token)
+
+    def backfill(self, sedes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Reconstruye el directorio leyendo estudiante en todas las sedes en
+        paralelo. Solo si respondieron todas se borran las entradas que ya no
+        existen y se marca el directorio como completo.
+        """
+        start = time.perf_counter()
+        sedes = sedes or route_query(['estudiante'])
+        # Las claves se listan antes de leer las sedes: un alta durante el backfill no se borra
+        existing = self.redis.scan_keys(f"{self.key_prefix}:email:*") or []
+        outcomes = run_distributed_queries({sede: (sede, _BACKFILL_SQL, None) for sede in sedes})
+        failed = {sede: outcome.get('error') or 'sin respuesta'
+                  for sede, outcome in outcomes.items() if outcome['rows'] is None}
+
+        by_email = {}
+        for sede, outcome in outcomes.items():
+            for row in outcome['rows'] or []:
+                by_email.setdefault(normalize_email(row['email']), {}).setdefault(sede, []).append(row)
+
+        hashes = {}
+        for email, rows_by_sede in by_email.items():
+            entry = build_entry(rows_by_sede)
+            if entry is not None:
+                hashes[self.email_key(email)] = self._encode(entry)
+
+        keys = list(hashes)
+        written = True
+        for index in range(0, len(keys), self.backfill_batch):
+            batch = {key: hashes[key] for key in keys[index:index + self.backfill_batch]}
+            written = self.redis.update_hashes(batch, replace=True) and written
+
+        removed = 0
+        complete = written and not failed
+        if complete:
+            stale = [key for key in existing if key not in hashes]
+            for index in range(0, len(stale), self.backfill_batch):
+                removed += self.redis.delete_many(stale[index:index + self.backfill_batch])
+        self.redis.update_hashes({self.meta_key(): {
+            'completo': '1' if complete else '0',
+            'entradas': str(len(hashes)),
+            'reconstruido': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }}, replace=True)
+
+        elapsed = time.perf_counter() - start
+        if failed:
+            logger.warning(f"Directorio de estudiantes reconstruido sin: {', '.join(failed)}")
+        logger.info(f"Directorio de estudiantes: {len(hashes)} entradas, {removed} eliminadas en {elapsed:.2f}s")
+        return {
+            'entradas': len(hashes),
+            'eliminadas': removed,
+            'sedes': [sede for sede in sedes if sede not in failed],
+            'fallidas': failed,
+            'completo': complete,
+            'segundos': elapsed
+        }
+
+    def scan_sedes(self, email: str, sedes: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Búsqueda en todas las sedes en paralelo; lo encontrado se escribe en el directorio."""
+        return self._scan(email, sedes)[0]
+
+    def _scan(self, email: str, sedes: Optional[List[str]] = None) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        sedes = sedes or route_query(['estudiante'])
+        outcomes = run_distributed_queries({sede: (sede, _LOOKUP_SQL, (email,)) for sede in sedes})
+        entry = build_entry({sede: outcome['rows'] for sede, outcome in outcomes.items() if outcome['rows']})
+        if entry is not None:
+            self.redis.update_hashes({self.email_key(email): self._encode(entry)})
+        return entry, [sede for sede, outcome in outcomes.items() if outcome['rows'] is None]
+
+    def is_registered(self, email: str) -> Optional[bool]:
+        """
+        Para altas: True si el email existe en alguna sede, False solo si todas
+        las sedes respondieron sin encontrarlo y None si no se pudo confirmar.
+        """
+        if self.lookup(email) is not None:
+            return True
+        entry, failed = self._scan(email)
+        if entry is not None:
+            return True
+        if failed:
+            logger.warning(f"No se pudo confirmar el email en: {', '.join(failed)}")
+            return None
+        return False
+
+
+@st.cache_resource
+def get_student_directory() -> StudentDirectory:
+    return StudentDirectory(get_redis_connection(), DIRECTORY_CONFIG['key_prefix'],
+                            DIRECTORY_CONFIG['reservation_ms'], DIRECTORY_CONFIG['backfill_batch'])
+
+
+def find_student(email: str) -> Optional[Dict[str, Any]]:
+    """
+    Dónde está el estudiante con ese email. Un acierto en el directorio responde
+    sin tocar las sedes; si no hay entrada se consultan todas en paralelo.
+    """
+    directory = get_student_directory()
+    entry = directory.lookup(email)
+    if entry is not None:
+        return entry
+    return directory.scan_sedes(email)
@@ -0,0 +1,90 @@
+"""
+Top-N distribuido: ORDER BY/LIMIT en cada sede y mezcla k-way con un heap
+"""
+import heapq
+import logging
+from itertools import islice
+from typing import Optional, Dict, Any, List, Tuple, Sequence
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.async_db import run_distributed_queries
+
+logger = logging.getLogger(__name__)
+
+
+class TopNQuery:
+    """
+    Una consulta "los N primeros" sobre varias sedes. order_by es la lista de
+    (expresión SQL, columna del resultado): la misma clave arma el ORDER BY que
+    se envía a cada sede y la clave de la mezcla, así ambas no pueden diferir.
+    Los NULL quedan al final en ambos sentidos.
+    """
+
+    def __init__(self, base_sql: str, order_by: Sequence[Tuple[str, str]], n: int = 10,
+                 descending: bool = True, params: Optional[Tuple] = None):
+        self.base_sql = base_sql.strip()
+        self.order_by = list(order_by)
+        self.n = n
+        self.descending = descending
+        self.params = params
+
+    def sql(self) -> str:
+        if self.descending:
+            # En DESC MySQL ya deja los NULL al final y puede recorrer el índice
+            order = ', '.join(f"{expression} DESC" for expression, _ in self.order_by)
+        else:
+            # En ASC los NULL van primero: se fuerzan al final como en key()
+            order = ', '.join(f"{expression} IS NULL, {expression} ASC" for expression, _ in self.order_by)
+        return f"{self.base_sql}\nORDER BY {order}\nLIMIT {int(self.n)}"
+
+    def key(self, row: Dict[str, Any]) -> Tuple:
+        parts = []
+        for _, column in self.order_by:
+            value = row.get(column)
+            # heapq.merge(reverse=True) toma el mayor primero: NULL debe ser el menor
+            if value is None:
+                parts.append((not self.descending,))
+            else:
+                parts.append((self.descending, value))
+        return tuple(parts)
+
+    def _sorted_stream(self, sede: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        keys = [self.key(row) for row in rows]
+        in_order = all(
+            (a >= b) if self.descending else (a <= b) for a, b in zip(keys, keys[1:])
+        )
+        if not in_order:
+            logger.warning(f"Resultado de {sede} no viene ordenado por la clave del top-N; se ordena localmente")
+            return sorted(rows, key=self.key, reverse=self.descending)
+        return rows
+
+    def merge(self, streams: Dict[str, Optional[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """
+        Mezcla k-way de los resultados ya ordenados de cada sede: se detiene al
+        producir n filas, O(n log k). Los empates se resuelven por el orden de las sedes.
+        """
+        ordered = [self._sorted_stream(sede, rows) for sede, rows in streams.items() if rows]
+        merged = heapq.merge(*ordered, key=self.key, reverse=self.descending)
+        return list(islice(merged, self.n))
+
+
+def run_top_n(queries: Dict[str, TopNQuery], sedes: List[str],
+              timeout: Optional[float] = None) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Ejecuta varias consultas top-N en un único fan-out y devuelve por nombre
+    las filas mezcladas, más el resultado de cada (nombre, sede) para reportar
+    sedes degradadas o con error.
+    """
+    statements = {
+        (name, sede): (sede, query.sql(), query.params)
+        for name, query in queries.items()
+        for sede in sedes
+    }
+    outcomes = run_distributed_queries(statements, timeout)
+    results = {
+        name: query.merge({sede: outcomes[(name, sede)]['rows'] for sede in sedes})
+        for name, query in queries.items()
+    }
+    return results, outcomes